@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+import argparse
+import filecmp
+import json
+import os
+import subprocess
+import sys
+import time
+
+import syntheticData
+
+"""
+benchmarkStages.py
+
+Times and memory-profiles every bin script of the LEAP flow on synthetic data (see syntheticData.py), at
+one or more scales, and checks that the engines the scripts offer produce the same results.
+
+For every scale a dataset is generated once (and reused if it is already there), then the flow main.nf runs
+is replayed stage by stage, each script started the way its Nextflow module starts it:
+    humanFilter, startOrEndGrab (both), and for fivePrime and threePrime: globalExonMatcher,
+    splitChromosomes, globalTranscriptChecker (per chromosome), catTables, finalFilterandStats, prepNext;
+    round 2 of both directions on the prepNext output of the other; makeGFF on the four final tables.
+Wall time, CPU time and peak RSS are taken from each script's own process (os.wait4), so start-up costs are
+included, as they are in the pipeline. The per-chromosome globalTranscriptChecker runs are summed (times) and
+maxed (RSS) into one row per direction and round.
+
+Engines are alternative settings the results must not depend on:
+    default     tsv intermediates, low-memory loading, sweep transcript matching
+    parquet     LEAP_INTERMEDIATE_FORMAT=parquet
+    arrow       LEAP_INTERMEDIATE_FORMAT=arrow
+    legacy      LEAP_LOAD_PROFILE=legacy
+    loop        globalTranscriptChecker.py ... loop (exon by exon, slow on large scales)
+Every engine's final outputs (final tables, extension statistics, prepNext GFFs, the extended GFF and the
+merged table) are compared byte for byte with the first engine's; engines that both write text
+intermediates have every intermediate file compared as well. Each run gets its own LEAP_CACHE_DIR so no
+stage is served from a cache filled by another run.
+
+Usage:
+    python benchmarkStages.py <work_dir> [--scales tiny,chr21] [--engines default,parquet] [--report report.json]
+
+Scales:
+    tiny        chr21 at a tenth of its length, 10k reads
+    chr21       chr21, 100k reads
+    chr1        chr1, 1M reads
+    genome      all chromosomes, 10M reads
+
+Example:
+    python benchmarkStages.py /tmp/leap_bench --scales tiny,chr21 --engines default,parquet,loop
+"""
+
+SCALES = {
+    'tiny': {'chromosomes': '21', 'reads': 10000, 'length_scale': 0.1},
+    'chr21': {'chromosomes': '21', 'reads': 100000},
+    'chr1': {'chromosomes': '1', 'reads': 1000000},
+    'genome': {'chromosomes': 'all', 'reads': 10000000},
+}
+
+ENGINES = {
+    'default': {'env': {}, 'checker': 'sweep'},
+    'parquet': {'env': {'LEAP_INTERMEDIATE_FORMAT': 'parquet'}, 'checker': 'sweep'},
+    'arrow': {'env': {'LEAP_INTERMEDIATE_FORMAT': 'arrow'}, 'checker': 'sweep'},
+    'legacy': {'env': {'LEAP_LOAD_PROFILE': 'legacy'}, 'checker': 'sweep'},
+    'loop': {'env': {}, 'checker': 'loop'},
+}
+
+DIRECTIONS = ['fivePrime', 'threePrime']
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+# Files compared between every pair of engines; the intermediates in between are only compared as text
+FINAL_OUTPUT_SUFFIXES = ('_final.csv', '_ExtendStats.txt', '_ExtendStats.json', '_nextRun.gff', 'extended.gff', 'merged.csv')
+
+
+def rss_mb(usage):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024) if sys.platform == 'darwin' else usage.ru_maxrss / 1024
+
+
+class StageRunner:
+    '''
+    Runs the bin scripts of one (scale, engine) pair in its own directory and records a row per stage.
+    '''
+
+    def __init__(self, run_dir, env):
+        self.run_dir = run_dir
+        self.env = env
+        self.records = []
+
+    def run(self, stage, args, cwd=None, direction=None, round_number=None, chromosome=None):
+        cwd = cwd or self.run_dir
+        os.makedirs(cwd, exist_ok=True)
+        log_name = '_'.join(str(part) for part in (stage, direction, round_number, chromosome) if part is not None)
+        command = [sys.executable, os.path.join(BIN_DIR, f"{stage}.py")] + [str(arg) for arg in args]
+        start = time.perf_counter()
+        with open(os.path.join(self.run_dir, 'logs', f"{log_name}.log"), 'w') as log:
+            process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=self.env)
+            _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode != 0:
+            raise RuntimeError(f"{' '.join(command)} failed with exit code {returncode}, see logs/{log_name}.log")
+        record = {'stage': stage, 'direction': direction, 'round': round_number, 'chromosome': chromosome,
+                  'wall_s': wall, 'cpu_s': usage.ru_utime + usage.ru_stime, 'peak_rss_mb': rss_mb(usage)}
+        self.records.append(record)
+        return record
+
+
+def run_direction(runner, dataset, direction, round_number, human, capOrTail, chromosomes, checker):
+    # GENERAL_EXON_MATCHER to CLEANUP for one direction, as the subworkflows run them
+    work = os.path.join(runner.run_dir, f"round{round_number}", direction)
+    tags = {'cwd': work, 'direction': direction, 'round_number': round_number}
+    runner.run('globalExonMatcher', [human, os.path.join(dataset, 'fantom.gff'), os.path.join(dataset, 'longread.gtf'),
+                                     'true', direction.lower(), '.'], **tags)
+    runner.run('splitChromosomes', [','.join(chromosomes), 'matched_fantom_blocks.gff', 'matched_longread_blocks.gff',
+                                    capOrTail, 'filtered_matched_human_exons.gff', direction], **tags)
+    outputs = []
+    for chromosome in chromosomes:
+        if not os.path.exists(os.path.join(work, f"split_human_{chromosome}.txt")):
+            continue
+        runner.run('globalTranscriptChecker', [f"split_human_{chromosome}.txt", f"split_capOrTail_{chromosome}.txt",
+                                               f"split_fantom_{chromosome}.txt", f"split_longRead_{chromosome}.txt",
+                                               direction, chromosome, 'output', checker], chromosome=chromosome, **tags)
+        outputs.append(f"output_matched_chr{chromosome}.csv")
+    runner.run('catTables', ['combined.csv'] + outputs, **tags)
+    runner.run('finalFilterandStats', ['combined.csv', direction, f"round{round_number}_extended_transcripts.csv", '--no-plot'], **tags)
+    return os.path.join(work, f"round{round_number}_extended_transcripts_{direction}_final.csv")
+
+
+def run_pipeline(dataset, run_dir, engine, chromosomes):
+    env = dict(os.environ, LEAP_CACHE_DIR=os.path.join(run_dir, 'cache'), **ENGINES[engine]['env'])
+    runner = StageRunner(run_dir, env)
+    os.makedirs(os.path.join(run_dir, 'logs'), exist_ok=True)
+    human = os.path.join(dataset, 'human.gff3')
+    capOrTails = {'fivePrime': os.path.join(dataset, 'cage_peaks.gff'), 'threePrime': os.path.join(dataset, 'polya_sites.gff')}
+    checker = ENGINES[engine]['checker']
+
+    runner.run('humanFilter', [human, 'noReadthroughProteinCoding.gff3', os.path.join(dataset, 'readthrough.txt'), 'true'])
+    runner.run('startOrEndGrab', ['noReadthroughProteinCoding.gff3', 'both', 'grabbedhg38.gff'])
+
+    finals = {}
+    next_runs = {}
+    for direction in DIRECTIONS:
+        grabbed = os.path.join(run_dir, f"grabbedhg38_{direction}.gff")
+        finals[(direction, 1)] = run_direction(runner, dataset, direction, 1, grabbed, capOrTails[direction], chromosomes, checker)
+        runner.run('prepNext', [finals[(direction, 1)], direction, human], direction=direction, round_number=1)
+        next_runs[direction] = os.path.join(run_dir, f"{direction}_nextRun.gff")
+
+    # Round 2 starts from the transcripts the other direction extended
+    for direction, other in zip(DIRECTIONS, reversed(DIRECTIONS)):
+        finals[(direction, 2)] = run_direction(runner, dataset, direction, 2, next_runs[other], capOrTails[direction], chromosomes, checker)
+
+    runner.run('makeGFF', [finals[('fivePrime', 1)], finals[('threePrime', 1)], finals[('fivePrime', 2)], finals[('threePrime', 2)],
+                           human, 'extended.gff', 'merged.csv'])
+    return runner.records
+
+
+def summarize(records):
+    # One row per stage, direction and round: the per-chromosome runs are summed (times) and maxed (RSS)
+    rows = {}
+    for record in records:
+        key = (record['stage'], record['direction'], record['round'])
+        row = rows.setdefault(key, {'stage': record['stage'], 'direction': record['direction'], 'round': record['round'],
+                                    'runs': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0})
+        row['runs'] += 1
+        row['wall_s'] += record['wall_s']
+        row['cpu_s'] += record['cpu_s']
+        row['peak_rss_mb'] = max(row['peak_rss_mb'], record['peak_rss_mb'])
+    return list(rows.values())
+
+
+def output_files(run_dir):
+    # Outputs to compare; the metrics sidecars hold timings, which always differ between runs
+    files = []
+    for root, dirs, names in os.walk(run_dir):
+        dirs[:] = [name for name in dirs if name not in ('logs', 'cache')]
+        files.extend(os.path.relpath(os.path.join(root, name), run_dir) for name in names if not name.endswith('.metrics.json'))
+    return sorted(files)
+
+
+def text_intermediates(engine):
+    return ENGINES[engine]['env'].get('LEAP_INTERMEDIATE_FORMAT', 'tsv') == 'tsv'
+
+
+def compare_runs(reference_dir, reference_engine, run_dir, engine):
+    # Files that differ between two runs of the same scale
+    both_text = text_intermediates(reference_engine) and text_intermediates(engine)
+    differences = []
+    for name in output_files(reference_dir):
+        if not both_text and not name.endswith(FINAL_OUTPUT_SUFFIXES):
+            continue
+        other = os.path.join(run_dir, name)
+        if not os.path.exists(other):
+            differences.append(f"{name} missing")
+        elif not filecmp.cmp(os.path.join(reference_dir, name), other, shallow=False):
+            differences.append(name)
+    return differences
+
+
+def print_table(scale, engine, rows):
+    print(f"\n{scale} / {engine}")
+    print(f"{'stage':<26}{'direction':<12}{'round':>6}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'peak MB':>10}")
+    for row in rows:
+        print(f"{row['stage']:<26}{row['direction'] or '':<12}{row['round'] or '':>6}{row['runs']:>6}"
+              f"{row['wall_s']:>10.2f}{row['cpu_s']:>10.2f}{row['peak_rss_mb']:>10.1f}")
+    print(f"{'total':<50}{sum(row['wall_s'] for row in rows):>10.2f}{sum(row['cpu_s'] for row in rows):>10.2f}"
+          f"{max(row['peak_rss_mb'] for row in rows):>10.1f}")
+
+
+def main(work_dir, scales, engines, report_file=None, seed=1):
+    # The stages run inside their run directories, so every path handed to them must be absolute
+    work_dir = os.path.abspath(work_dir)
+    report = {'scales': {}}
+    mismatches = 0
+    for scale in scales:
+        dataset = os.path.join(work_dir, scale, 'data')
+        if not os.path.exists(os.path.join(dataset, 'input.csv')):
+            syntheticData.main(dataset, seed=seed, **SCALES[scale])
+        chromosomes = syntheticData.parse_chromosomes(SCALES[scale]['chromosomes'])
+        scale_report = report['scales'][scale] = {'engines': {}, 'differences': {}}
+        for engine in engines:
+            run_dir = os.path.join(work_dir, scale, engine)
+            records = run_pipeline(dataset, run_dir, engine, chromosomes)
+            rows = summarize(records)
+            scale_report['engines'][engine] = {'stages': rows, 'runs': records}
+            print_table(scale, engine, rows)
+            if engine != engines[0]:
+                differences = compare_runs(os.path.join(work_dir, scale, engines[0]), engines[0], run_dir, engine)
+                scale_report['differences'][engine] = differences
+                mismatches += len(differences)
+                print(f"{engine} vs {engines[0]}: " + ('identical' if not differences else f"{len(differences)} files differ: {', '.join(differences)}"))
+    if report_file is not None:
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+    return mismatches
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the LEAP bin scripts on synthetic data and compare engines.")
+    parser.add_argument("work_dir", type=str, help="Directory for the datasets, runs and logs")
+    parser.add_argument("--scales", type=str, default='tiny', help=f"Comma separated scales from {', '.join(SCALES)} (default tiny)")
+    parser.add_argument("--engines", type=str, default='default', help=f"Comma separated engines from {', '.join(ENGINES)} (default default)")
+    parser.add_argument("--report", type=str, default=None, help="Write the timings and comparisons to this JSON file")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the synthetic data (default 1)")
+    args = parser.parse_args()
+
+    scales = args.scales.split(',')
+    engines = args.engines.split(',')
+    for name, known in ((scales, SCALES), (engines, ENGINES)):
+        unknown = [value for value in name if value not in known]
+        if unknown:
+            parser.error(f"Unknown {', '.join(unknown)}; choose from {', '.join(known)}")
+
+    sys.exit(1 if main(args.work_dir, scales, engines, args.report, args.seed) else 0)
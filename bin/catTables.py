@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+catTables.py
+
+Concatenates the per-chromosome outputs of globalTranscriptChecker.py into one table. Text inputs are
+copied byte for byte, exactly like cat. Parquet/Arrow inputs (LEAP_INTERMEDIATE_FORMAT) are combined
+into one table of the same format, since binary files cannot simply be appended to each other.
+
+Usage:
+    python catTables.py <output_file> <input_file> [<input_file> ...]
+
+Example:
+    python catTables.py three_result.csv output_threeprime_matched_chr1.csv output_threeprime_matched_chr2.csv
+"""
+import sys
+from intermediateFormat import concatenate_tables
+from stageMetrics import StageMetrics
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python catTables.py <output_file> <input_file> [<input_file> ...]")
+        sys.exit(1)
+
+    metrics = StageMetrics('catTables')
+    with metrics.phase('concatenate') as phase:
+        concatenate_tables(sys.argv[2:], sys.argv[1])
+        phase.read(*sys.argv[2:])
+        phase.wrote(sys.argv[1])
+    metrics.write()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import json
+import math
+import sys
+
+import numpy as np
+
+"""
+extensionStats.py
+
+Mergeable summary of transcript extension lengths, written by finalFilterandStats.py next to its
+_ExtendStats.txt as _ExtendStats.json.
+
+The summary keeps the count, sum, min and max, the exact number of times every extension length was
+seen and a fixed width histogram. Extension lengths are whole numbers of bases with a lot of repeats,
+so the exact counts stay small and the median (or any quantile) of several summaries merged together is
+the same as the median of all their extensions. Per-sample or per-chromosome summaries can therefore be
+combined across runs without reading the extension tables again.
+
+Usage:
+    python extensionStats.py <output_prefix> <stats.json> [<stats.json> ...]
+
+    Merges the summaries and writes <output_prefix>_ExtendStats.json and <output_prefix>_ExtendStats.txt.
+
+Example:
+    python extensionStats.py all_samples sampleA_fivePrime_ExtendStats.json sampleB_fivePrime_ExtendStats.json
+"""
+
+# Width of the histogram bins, in bases
+BIN_WIDTH = 50
+
+
+class ExtensionStats:
+    '''
+    Counts, sum, exact value counts and histogram bins of a set of extension lengths. Summaries built
+    from different tables can be merged with merge() or "+".
+    '''
+
+    def __init__(self, bin_width=BIN_WIDTH):
+        self.bin_width = bin_width
+        self.count = 0
+        self.total = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.values = {}
+        self.bins = {}
+
+    @classmethod
+    def from_values(cls, differences, bin_width=BIN_WIDTH):
+        stats = cls(bin_width)
+        stats.add(differences)
+        return stats
+
+    def add(self, differences):
+        differences = np.asarray(differences, dtype=float)
+        differences = differences[~np.isnan(differences)]
+        if differences.size == 0:
+            return self
+        self.count += int(differences.size)
+        self.total += float(differences.sum())
+        self.minimum = min(self.minimum, float(differences.min()))
+        self.maximum = max(self.maximum, float(differences.max()))
+        for value, n in zip(*np.unique(differences, return_counts=True)):
+            self.values[float(value)] = self.values.get(float(value), 0) + int(n)
+        for start, n in zip(*np.unique(np.floor(differences / self.bin_width) * self.bin_width, return_counts=True)):
+            self.bins[float(start)] = self.bins.get(float(start), 0) + int(n)
+        return self
+
+    def merge(self, other):
+        if other.bin_width != self.bin_width:
+            raise ValueError(f"Cannot merge summaries with bin widths {self.bin_width} and {other.bin_width}")
+        self.count += other.count
+        self.total += other.total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        for value, n in other.values.items():
+            self.values[value] = self.values.get(value, 0) + n
+        for start, n in other.bins.items():
+            self.bins[start] = self.bins.get(start, 0) + n
+        return self
+
+    def __add__(self, other):
+        return ExtensionStats(self.bin_width).merge(self).merge(other)
+
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    def quantile(self, q):
+        # Exact quantile from the value counts, interpolating between the two middle values like statistics.median
+        if not self.count:
+            return math.nan
+        values = np.array(sorted(self.values))
+        cumulative = np.cumsum([self.values[value] for value in values])
+        position = q * (self.count - 1)
+        lower = values[np.searchsorted(cumulative, math.floor(position), side='right')]
+        upper = values[np.searchsorted(cumulative, math.ceil(position), side='right')]
+        return float(lower + (upper - lower) * (position - math.floor(position)))
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def largest(self):
+        return self.maximum if self.count else math.nan
+
+    def histogram(self):
+        # (bin starts, counts) in increasing order
+        starts = sorted(self.bins)
+        return starts, [self.bins[start] for start in starts]
+
+    def to_dict(self):
+        return {
+            'bin_width': self.bin_width,
+            'count': self.count,
+            'sum': self.total,
+            'min': self.minimum if self.count else None,
+            'max': self.maximum if self.count else None,
+            'values': [[value, n] for value, n in sorted(self.values.items())],
+            'bins': [[start, n] for start, n in sorted(self.bins.items())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls(data['bin_width'])
+        stats.count = data['count']
+        stats.total = data['sum']
+        stats.minimum = data['min'] if data['min'] is not None else math.inf
+        stats.maximum = data['max'] if data['max'] is not None else -math.inf
+        stats.values = {float(value): n for value, n in data['values']}
+        stats.bins = {float(start): n for start, n in data['bins']}
+        return stats
+
+    def write_json(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def read_json(cls, file_path):
+        with open(file_path) as f:
+            return cls.from_dict(json.load(f))
+
+    def write_text(self, file_path):
+        with open(file_path, 'w') as f:
+            f.write(f"Mean of differences: {self.mean()}\n")
+            f.write(f"Median of differences: {self.median()}\n")
+            f.write(f"Largest extension: {self.largest()}\n")
+
+
+def merge_files(file_paths):
+    merged = None
+    for file_path in file_paths:
+        stats = ExtensionStats.read_json(file_path)
+        merged = stats if merged is None else merged.merge(stats)
+    return merged
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: python extensionStats.py <output_prefix> <stats.json> [<stats.json> ...]")
+        sys.exit(1)
+
+    merged = merge_files(sys.argv[2:])
+    merged.write_json(f"{sys.argv[1]}_ExtendStats.json")
+    merged.write_text(f"{sys.argv[1]}_ExtendStats.txt")
+    print(f"Merged {len(sys.argv) - 2} summaries of {merged.count} extensions")
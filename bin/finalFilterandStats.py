@@ -1,11 +1,10 @@
 #!/usr/bin/env python3
 import pandas as pd
 import argparse
-import re
-import csv
-import statistics
-import matplotlib.pyplot as plt
-import os
+from extensionStats import ExtensionStats
+from gffAttributes import attribute_value
+from intermediateFormat import read_table
+from stageMetrics import StageMetrics
 
 '''
 Author: Lucas Cortes
@@ -15,148 +14,148 @@ This script takes incoming extend transcripts on either the 3 or 5' end and prod
 
 You must specify whether your input is 3' or 5' in the command line arguments.
 
+The biggest extension per transcript is picked with a strand aware sort and drop_duplicates, and its length
+(Difference) is computed as a column, so the final file is written once with no intermediate file.
+
+The statistics come from a mergeable summary (see extensionStats.py) that is also written as _ExtendStats.json,
+so the statistics of several samples or chromosomes can be combined later. The histogram is optional (--no-plot)
+and matplotlib is only imported to draw it, with the non-interactive Agg backend. The load, select and write
+phases are recorded in a metrics sidecar (see stageMetrics.py).
+
 Usage: python finalFilterandStats.py <input_file> <5primeOr3Prime> <output_file>
 '''
 
-# Function to filter the DataFrame to find the biggest extension
-def filter_group(group, prime_label):
-    if group.iloc[0]['Strand'] == '+' and prime_label == 'fivePrime':
-        return group.loc[group['capOrTail_Start'].idxmin()]
-    elif group.iloc[0]['Strand'] == '-' and prime_label == 'fivePrime':
-        return group.loc[group['capOrTail_End'].idxmax()]
-    elif group.iloc[0]['Strand'] == '+' and prime_label == 'threePrime':
-        return group.loc[group['capOrTail_End'].idxmax()]
-    elif group.iloc[0]['Strand'] == '-' and prime_label == 'threePrime':
-        return group.loc[group['capOrTail_Start'].idxmin()]
+# Per direction and strand (of the first row of each transcript):
+#   (capOrTail column picked from, pick the smallest value?, transcript end and capOrTail column the extension is measured between)
+BEST_EXTENSION = {
+    'fivePrime': {'+': ('capOrTail_Start', True, 'Transcript_Start', 'capOrTail_Start'),
+                  '-': ('capOrTail_End', False, 'Transcript_End', 'capOrTail_End')},
+    'threePrime': {'+': ('capOrTail_End', False, 'Transcript_End', 'capOrTail_Start'),
+                   '-': ('capOrTail_Start', True, 'Transcript_Start', 'capOrTail_Start')},
+}
+
+def select_best_extensions(df, prime_label):
+    '''
+    One row per Name: the capOrTail site that extends the transcript furthest. A strand aware sort key is
+    built per row and the first row per Name is kept after a stable sort, so ties go to the earlier row.
+    '''
+    strand = df.groupby('Name')['Strand'].transform('first')
+    sort_key = pd.Series(float('nan'), index=df.index)
+    for group_strand, (column, smallest, _, _) in BEST_EXTENSION[prime_label].items():
+        on_strand = strand == group_strand
+        sort_key[on_strand] = df.loc[on_strand, column] if smallest else -df.loc[on_strand, column]
+    # Transcripts on any other strand have no biggest extension
+    best = df.assign(sort_key=sort_key).dropna(subset=['sort_key'])
+    best = best.sort_values(['Name', 'sort_key'], kind='stable').drop_duplicates('Name')
+    return best.drop(columns='sort_key').reset_index(drop=True)
+
+def extension_lengths(df, prime_label):
+    # Distance between the transcript end and the capOrTail site, as a column
+    difference = pd.Series(float('nan'), index=df.index)
+    for strand, (_, _, transcript_column, site_column) in BEST_EXTENSION[prime_label].items():
+        on_strand = df['Strand'] == strand
+        difference[on_strand] = (pd.to_numeric(df.loc[on_strand, transcript_column], errors='coerce')
+                                 - pd.to_numeric(df.loc[on_strand, site_column], errors='coerce')).abs()
+    return difference
 
 def extract_transcript_name(attributes):
-    match = re.search(r'Parent=transcript:(ENST\d+)', attributes)
-    return match.group(1) if match else None
-
-def main(input_file, prime_choice, output_file):
-    prime_label = 'fivePrime' if prime_choice in ['5', '5\'', 'five', 'fiveprime', 'fivePrime'] else 'threePrime'
-    # Specify the data types for the columns
-    dtype_dict = {
-        'Chromosome': 'str',
-        'Source': 'str',
-        'Type': 'str',
-        'Start': 'str',
-        'End': 'str',
-        'Score': 'str',
-        'Strand': 'str',
-        'Phase': 'str',
-        'Attributes': 'str',
-        'gene_id': 'str',
-        'Name': 'str',
-        'capOrTail_Start': 'str',
-        'capOrTail_End': 'str',
-        'Transcript_Start': 'str',
-        'Transcript_End': 'str',
-        'Transcript_Name': 'str'
-    }
-    # Read the data into a DataFrame with specified dtypes
-    df = pd.read_csv(input_file, sep='\t', dtype=dtype_dict, low_memory=False)
-
+    return attribute_value(attributes, 'Parent', 'transcript')
+
+# Every column is read as text, the capOrTail sites are made numeric after loading
+INPUT_DTYPES = {
+    'Chromosome': 'str',
+    'Source': 'str',
+    'Type': 'str',
+    'Start': 'str',
+    'End': 'str',
+    'Score': 'str',
+    'Strand': 'str',
+    'Phase': 'str',
+    'Attributes': 'str',
+    'gene_id': 'str',
+    'Name': 'str',
+    'capOrTail_Start': 'str',
+    'capOrTail_End': 'str',
+    'Transcript_Start': 'str',
+    'Transcript_End': 'str',
+    'Transcript_Name': 'str'
+}
+
+def get_prime_label(prime_choice):
+    return 'fivePrime' if prime_choice in ['5', '5\'', 'five', 'fiveprime', 'fivePrime'] else 'threePrime'
+
+def select_extensions(df, prime_label):
+    # The biggest extension per transcript with its length, and the statistics of those lengths
     # Clean the capOrTail_Start and PolyA_End columns to remove non-numeric values
     df['capOrTail_Start'] = pd.to_numeric(df['capOrTail_Start'], errors='coerce')
     df['capOrTail_End'] = pd.to_numeric(df['capOrTail_End'], errors='coerce')
     df = df.dropna(subset=['capOrTail_Start', 'capOrTail_End', 'Name'])
 
-    # Group by 'Transcript_Name' and apply the filter function
-    filtered_df = df.groupby('Name').apply(filter_group, prime_label).reset_index(drop=True)
-
-    # Save the filtered DataFrame to a new CSV file with header
-    filtered_df.to_csv(output_file, sep='\t', index=False, header=True)
-
-    # Calculate differences and statistics
-    differences = []
-    ensg_largest_extension = None
-    largest_difference = 0
+    # Keep the biggest extension per transcript and measure it
+    filtered_df = select_best_extensions(df, prime_label)
+    filtered_df['Difference'] = extension_lengths(filtered_df, prime_label)
+    # Rows without transcript coordinates cannot be measured and are left out
+    filtered_df = filtered_df.dropna(subset=['Difference'])
+    return filtered_df, ExtensionStats.from_values(filtered_df['Difference'].to_numpy())
 
+def write_outputs(filtered_df, stats, prime_label, output_file, plot=True):
+    # Returns the final table and the statistics files written next to it
     final_output_file = output_file.replace('.csv', f'_{prime_label}_final.csv')
-
-    with open(output_file, mode='r') as infile, open(final_output_file, mode='w', newline='') as outfile:
-        reader = csv.reader(infile, delimiter='\t')
-        writer = csv.writer(outfile, delimiter='\t')
-        
-        header = next(reader)  # Read header
-        header.append('Difference')  # Add new column for differences
-        writer.writerow(header)  # Write header to output file
-
-        current_gene_name = None  # Track the current gene name
-
-        for row in reader:
-            try:
-                gene_name = row[9]  # Assuming gene name is in column 9
-                strand = row[6]
-
-                # Reset current_gene_name when the gene name changes
-                if gene_name != current_gene_name:
-                    if current_gene_name is not None:
-                        # Debugging print for the previous gene
-                        print(f"Processed gene: {current_gene_name}")
-                    current_gene_name = gene_name
-
-                # Calculate the difference based on prime_label and strand
-                if prime_label == 'fivePrime':
-                    if strand == '+':
-                        selected_value = float(row[13])
-                        difference = abs(selected_value - float(row[11]))
-                    else:
-                        selected_value = float(row[14])
-                        difference = abs(selected_value - float(row[12]))
-                elif prime_label == 'threePrime':
-                    if strand == '+':
-                        selected_value = float(row[14])
-                        difference = abs(selected_value - float(row[11]))
-                    else:
-                        selected_value = float(row[13])
-                        difference = abs(selected_value - float(row[11]))
-
-                # Append the difference and write the row
-                differences.append(difference)
-                row.append(difference)  # Add difference to the row
-                writer.writerow(row)  # Write row to output file
-
-                # Debugging prints
-                print(f"Gene: {gene_name}, Difference: {difference}")
-
-            except (ValueError, IndexError) as e:
-                print(f"Error processing row: {row} - {e}")
-                continue  # Skip to the next row if there's an error
-    mean_difference = statistics.mean(differences)
-    median_difference = statistics.median(differences)
-    # Calculate the largest extension
-    largest_difference = max(differences)
-
-
-    # Write statistics to a file
-    
-    stats_file = output_file.replace('.csv', f'_{prime_label}_ExtendStats.txt')
-    plot_file = output_file.replace('.csv', f'_{prime_label}_ExtendPlot.png')
-    with open(stats_file, 'w') as f:
-        f.write(f"Mean of differences: {mean_difference}\n")
-        f.write(f"Median of differences: {median_difference}\n")
-        f.write(f"Largest extension: {largest_difference}\n")
-
-    # Create a distribution chart (histogram) of the differences
-    plt.hist(differences, bins=30, edgecolor='black')
+    # Same layout as the csv module wrote, including its \r\n line endings
+    filtered_df.to_csv(final_output_file, sep='\t', index=False, header=True, lineterminator='\r\n')
+
+    # Write statistics to a file, with the mergeable summary they come from next to it
+    stats_files = [output_file.replace('.csv', f'_{prime_label}_ExtendStats.txt'),
+                   output_file.replace('.csv', f'_{prime_label}_ExtendStats.json')]
+    stats.write_text(stats_files[0])
+    stats.write_json(stats_files[1])
+
+    if plot:
+        plot_extensions(stats, prime_label, output_file.replace('.csv', f'_{prime_label}_ExtendPlot.png'))
+    return [final_output_file] + stats_files
+
+def main(input_file, prime_choice, output_file, plot=True):
+    prime_label = get_prime_label(prime_choice)
+    metrics = StageMetrics('finalFilterandStats', direction=prime_label)
+    # Read the data into a DataFrame with specified dtypes
+    with metrics.phase('load') as phase:
+        df = read_table(input_file, dtype=INPUT_DTYPES, low_memory=False)
+        phase.read(input_file)
+        phase.rows_out = len(df)
+
+    with metrics.phase('select') as phase:
+        phase.rows_in = len(df)
+        filtered_df, stats = select_extensions(df, prime_label)
+        phase.rows_out = len(filtered_df)
+
+    with metrics.phase('write') as phase:
+        phase.wrote(*write_outputs(filtered_df, stats, prime_label, output_file, plot))
+        phase.rows_in = len(filtered_df)
+    metrics.write()
+
+def plot_extensions(stats, prime_label, plot_file):
+    # Imported here so the statistics never need matplotlib; Agg renders to file without a display
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    # Create a distribution chart (histogram) of the differences, from the exact value counts
+    values = list(stats.values)
+    plt.hist(values, bins=30, weights=[stats.values[value] for value in values], edgecolor='black')
     plt.title(f'Distribution of Transcript Extensions {prime_label.capitalize()}')
     plt.xlabel('Transcript Extension Length')
     plt.ylabel('Frequency')
     plt.grid(True)
     plt.xlim(left=0)  # Set the x-axis limit to start at 0
     plt.savefig(plot_file)
-    plt.show()
-
-    # Delete the intermediary output file
-    os.remove(output_file)
+    plt.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Process capOrTail entries from a CSV file.')
     parser.add_argument('input_file', help='Path to the input CSV file')
     parser.add_argument('prime_choice', help='Specify whether the input is 5\' or 3\' (case-insensitive, partial matches allowed)')
     parser.add_argument('output_file', help='Path to the output CSV file')
+    parser.add_argument('--no-plot', action='store_true', help='Skip the histogram (and the matplotlib import)')
     args = parser.parse_args()
     
-    main(args.input_file, args.prime_choice, args.output_file)
+    main(args.input_file, args.prime_choice, args.output_file, plot=not args.no_plot)
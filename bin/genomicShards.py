@@ -0,0 +1,61 @@
+"""
+genomicShards.py
+
+Helpers shared by the bin scripts for the genomic shards planned by shardGenome.py. A shard is a comma
+separated list of regions, each "contig" for a whole contig or "contig:start-end" (1-based, inclusive) for
+a piece of one, e.g. "1:1-61872213" or "21,22,Y,KI270728.1". Contig names are compared without a "chr"
+prefix. A row belongs to every region it overlaps, so a feature spanning two pieces is in both.
+
+The shard plan is a tab separated table with a header line and one shard per row:
+    shard       regions
+    shard001    1:1-61872213
+
+Example:
+    from genomicShards import read_shards, region_mask
+    for contig, start, end in read_shards('shards.tsv')['shard001']:
+        rows = df[region_mask(df[3], df[4], start, end)]
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+
+def parse_regions(spec):
+    # "1:1-1000,chr21" -> [('1', 1, 1000), ('21', None, None)]
+    regions = []
+    for region in spec.split(','):
+        match = re.fullmatch(r'(.+):(-?\d+)-(\d+)', region.strip())
+        if match:
+            contig, start, end = match.group(1), int(match.group(2)), int(match.group(3))
+        else:
+            contig, start, end = region.strip(), None, None
+        regions.append((contig[3:] if contig.startswith('chr') else contig, start, end))
+    return regions
+
+
+def format_regions(regions):
+    return ','.join(contig if start is None else f"{contig}:{start}-{end}" for contig, start, end in regions)
+
+
+def read_shards(shards_file):
+    # {shard: [(contig, start, end), ...]} in plan order
+    shards = pd.read_csv(shards_file, sep='\t', dtype=str)
+    return {shard: parse_regions(spec) for shard, spec in zip(shards['shard'], shards['regions'])}
+
+
+def write_shards(shards, output_file):
+    # shards: the regions of every shard, named shard001, shard002, ... in the order given
+    plan = pd.DataFrame({'shard': [f"shard{i + 1:03d}" for i in range(len(shards))],
+                         'regions': [format_regions(regions) for regions in shards]})
+    plan.to_csv(output_file, sep='\t', index=False)
+    return plan
+
+
+def region_mask(starts, ends, start, end):
+    # Rows whose start-end overlaps the region; a whole contig (start None) keeps them all
+    if start is None:
+        return np.ones(len(starts), dtype=bool)
+    starts = pd.to_numeric(pd.Series(starts), errors='coerce').to_numpy(dtype='float64')
+    ends = pd.to_numeric(pd.Series(ends), errors='coerce').to_numpy(dtype='float64')
+    return (starts <= end) & (ends >= start)
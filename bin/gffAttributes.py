@@ -0,0 +1,188 @@
+"""
+gffAttributes.py
+
+Shared parsing of the attribute column of GFF3 and GTF files, used by the bin scripts instead of their
+own regular expressions.
+
+GFF3 attributes are "key=value" pairs separated by ";" (e.g. "ID=transcript:ENST0001;Parent=gene:ENSG0001"),
+GTF attributes are 'key "value"' pairs separated by "; " (e.g. 'transcript_id "ENST0001"; exon_number "1"').
+Keys only match at the start of an attribute, so "gene_id" does not match inside "ref_gene_id". Quotes
+around a value (as in the FANTOM "Name=" attributes) are removed.
+
+The patterns are compiled once per key. gff3_attribute() and gtf_attribute() extract a key from a whole
+column at once; attribute_value() does the same for a single line, for scripts that stream a file.
+
+key_columns() extracts the keys the pipeline selects on (ID, Parent, biotype, tag and rank) together,
+once per file. The columns are kept for the rest of the process and, with pyarrow installed, saved under
+$LEAP_CACHE_DIR/attributes (default ~/.cache/leap/attributes) keyed on the file's resolved path, size,
+modification time and row count, so the stages that read the same reference annotation (startOrEndGrab,
+prepNext and makeGFF) parse its attributes once between them. Like the result cache, the least recently
+used files are removed once the directory grows past $LEAP_ATTRIBUTE_CACHE_MB (default 1024), and 0
+turns the on disk cache off.
+
+Example:
+    from gffAttributes import key_columns, strip_prefix
+    keys = key_columns(df['Attributes'], source='human.gff3')
+    transcript_ids = strip_prefix(keys['Parent'], 'transcript')
+"""
+import functools
+import hashlib
+import os
+import re
+
+import pandas as pd
+
+KEY_COLUMNS = ['ID', 'Parent', 'biotype', 'tag', 'rank']
+DEFAULT_CACHE_MB = 1024
+
+# Block name of a FANTOM exon, e.g. "ENCT0001" and "3" for Name="ENCT0001.1_block3"
+FANTOM_TRANSCRIPT = re.compile(r'Name="(.*?)\..*?"')
+FANTOM_BLOCK = re.compile(r'Name=".*?_block(.*?)"')
+
+_key_column_cache = {}
+
+
+@functools.lru_cache(maxsize=None)
+def gff3_pattern(key, prefix=None):
+    # "key=value", or "key=prefix:value" with the prefix dropped
+    value = rf'{re.escape(prefix)}:([^;"]*)' if prefix else r'([^;"]*)'
+    return re.compile(rf'(?:^|;)\s*{re.escape(key)}=\s*"?{value}"?')
+
+
+@functools.lru_cache(maxsize=None)
+def gtf_pattern(key):
+    return re.compile(rf'(?:^|;)\s*{re.escape(key)}\s+"?([^;"]*)"?')
+
+
+def _extract(attributes, pattern):
+    return attributes.astype(str).str.extract(pattern.pattern, expand=False)
+
+
+def gff3_attribute(attributes, key, prefix=None):
+    # One GFF3 key of every row of an attribute column, NaN where it is missing
+    return _extract(attributes, gff3_pattern(key, prefix))
+
+
+def gtf_attribute(attributes, key):
+    return _extract(attributes, gtf_pattern(key))
+
+
+def attribute_value(attributes, key, prefix=None, gtf=False):
+    # Single line version of gff3_attribute/gtf_attribute, None where the key is missing
+    match = (gtf_pattern(key) if gtf else gff3_pattern(key, prefix)).search(attributes)
+    return match.group(1) if match else None
+
+
+def strip_prefix(values, prefix=None):
+    # "transcript:ENST0001" -> "ENST0001"; values without the prefix (any prefix if None) become NaN
+    pattern = rf'^{re.escape(prefix)}:(.*)$' if prefix else r'^[^:]*:([^:]*)'
+    return values.str.extract(pattern, expand=False)
+
+
+def transcript_ids(keys):
+    # Transcript of every row: its own ID on transcript rows, its Parent on exon/UTR/CDS rows
+    return strip_prefix(keys['ID'], 'transcript').fillna(strip_prefix(keys['Parent'], 'transcript'))
+
+
+def fantom_blocks(attributes):
+    # Transcript ID and block number of FANTOM exons named "<transcript>.<version>_block<n>"
+    attributes = attributes.astype(str)
+    return (attributes.str.extract(FANTOM_TRANSCRIPT.pattern, expand=False),
+            attributes.str.extract(FANTOM_BLOCK.pattern, expand=False))
+
+
+def attribute_cache_dir():
+    cache_dir = os.environ.get('LEAP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'leap'))
+    return os.path.join(cache_dir, 'attributes')
+
+
+def attribute_cache_limit():
+    # Size limit of the cache directory in bytes, 0 when the on disk cache is off
+    return int(float(os.environ.get('LEAP_ATTRIBUTE_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+def source_key(file_path, rows):
+    # Like the validation cache, files are identified by path, size and modification time; the resolved
+    # path makes the copies Nextflow links into every work directory share one entry
+    stat = os.stat(file_path)
+    return f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{rows}"
+
+
+def _cache_file(key):
+    return os.path.join(attribute_cache_dir(), hashlib.sha1(key.encode()).hexdigest() + '.parquet')
+
+
+def _load_cached(key, index):
+    if attribute_cache_limit() <= 0:
+        return None
+    try:
+        columns = pd.read_parquet(_cache_file(key))
+    except (ImportError, OSError, ValueError):
+        return None
+    if list(columns.columns) != KEY_COLUMNS or len(columns) != len(index):
+        return None
+    try:
+        # Mark as recently used for evict()
+        os.utime(_cache_file(key))
+    except OSError:
+        pass
+    return columns.set_axis(index)
+
+
+def _save_cached(key, columns):
+    if attribute_cache_limit() <= 0:
+        return
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return
+    try:
+        os.makedirs(attribute_cache_dir(), exist_ok=True)
+        # Written next to the final name and renamed, so concurrent stages never read a partial file
+        temp_file = f"{_cache_file(key)}.{os.getpid()}"
+        columns.reset_index(drop=True).to_parquet(temp_file, index=False)
+        os.replace(temp_file, _cache_file(key))
+    except OSError as e:
+        print(f"Could not update the attribute cache: {e}")
+        return
+    evict()
+
+
+def evict():
+    # Remove the least recently used files until the directory fits the size limit
+    try:
+        entries = [entry for entry in os.scandir(attribute_cache_dir()) if entry.name.endswith('.parquet')]
+        cached = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+    except OSError:
+        return
+    total = 0
+    for _, size, path in cached:
+        total += size
+        if total > attribute_cache_limit():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def key_columns(attributes, source=None):
+    '''
+    ID, Parent, biotype, tag and rank of every row of a GFF3 attribute column, as a DataFrame on the same
+    index. With source, the file the rows were read from, the columns are extracted once per file.
+    '''
+    key = source_key(source, len(attributes)) if source is not None and os.path.isfile(source) else None
+    if key is not None:
+        columns = _key_column_cache.get(key)
+        if columns is None:
+            columns = _load_cached(key, attributes.index)
+        if columns is not None:
+            if not columns.index.equals(attributes.index):
+                columns = columns.set_axis(attributes.index)
+            _key_column_cache[key] = columns
+            return columns
+
+    columns = pd.DataFrame({column: gff3_attribute(attributes, column) for column in KEY_COLUMNS}, index=attributes.index)
+    if key is not None:
+        _key_column_cache[key] = columns
+        _save_cached(key, columns)
+    return columns
@@ -0,0 +1,74 @@
+"""
+gffLoading.py
+
+Shared, low-memory loading profile for the GFF/GTF style tables read by the bin scripts.
+
+Columns are typed by position, so the same profile works whether a file is read with header=None,
+with names=... or with a header line:
+    - seqname, source, feature, score, strand and phase (columns 0, 1, 2, 5, 6, 7) as categoricals
+    - start and end (columns 3 and 4) as int32
+    - attributes (column 8) as Arrow backed strings when pyarrow is installed
+
+If a file does not fit the profile (e.g. a stray header line in the coordinate columns) it is read
+again with the default pandas dtypes. Setting LEAP_LOAD_PROFILE=legacy always uses the default dtypes,
+which makes it easy to compare the peak RSS reported by report_peak_rss() before and after.
+
+Binary intermediate tables (see intermediateFormat.py) already carry their dtypes and are read as they are.
+
+Example:
+    from gffLoading import read_gff, report_peak_rss
+    df = read_gff('human.gff3', names=gff_column_names, comment='#')
+    report_peak_rss('startOrEndGrab')
+"""
+import os
+import resource
+import sys
+
+import pandas as pd
+
+from intermediateFormat import is_binary, read_table
+
+try:
+    import pyarrow  # noqa: F401
+    ATTRIBUTE_DTYPE = 'string[pyarrow]'
+except ImportError:
+    ATTRIBUTE_DTYPE = 'object'
+
+CATEGORICAL_COLUMNS = [0, 1, 2, 5, 6, 7]
+COORDINATE_COLUMNS = [3, 4]
+ATTRIBUTE_COLUMN = 8
+
+
+def gff_dtypes():
+    dtypes = {col: 'category' for col in CATEGORICAL_COLUMNS}
+    dtypes.update({col: 'int32' for col in COORDINATE_COLUMNS})
+    dtypes[ATTRIBUTE_COLUMN] = ATTRIBUTE_DTYPE
+    return dtypes
+
+
+def low_memory_enabled():
+    return os.environ.get('LEAP_LOAD_PROFILE', 'lowmem').lower() != 'legacy'
+
+
+def read_gff(file_path, sep='\t', **read_csv_kwargs):
+    # Drop-in replacement for pd.read_csv on GFF-like tables; text buffers (io.StringIO) are read like files
+    if not hasattr(file_path, 'read') and is_binary(file_path):
+        return read_table(file_path, **read_csv_kwargs)
+    if not low_memory_enabled() or 'dtype' in read_csv_kwargs:
+        return pd.read_csv(file_path, sep=sep, **read_csv_kwargs)
+    try:
+        return pd.read_csv(file_path, sep=sep, dtype=gff_dtypes(), **read_csv_kwargs)
+    except (ValueError, TypeError) as e:
+        print(f"{file_path} does not fit the low-memory profile ({e}), using default dtypes")
+        return pd.read_csv(file_path, sep=sep, **read_csv_kwargs)
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def report_peak_rss(script_name):
+    profile = 'low-memory' if low_memory_enabled() else 'legacy'
+    print(f"{script_name}: peak RSS {peak_rss_mb():.1f} MB ({profile} loading profile)")
@@ -2,7 +2,7 @@
 '''
 Author: Lucas Cortes
 Date: 2020-10-15
-Usage: python globalExonMatcher.py <human_exons.gff> <FANTOM_exons.gff> <long_read_exons.gff> <single_exon?> <fiveprimeOrThreeprime?> <output_directory>
+Usage: python globalExonMatcher.py <human_exons.gff> <FANTOM_exons.gff> <long_read_exons.gff> <single_exon?> <fiveprimeOrThreeprime?> <output_directory> [region] [--strict] [--write-index|--index]
 
 This script is used to match exons of incoming files in both the 3' and 5' direction 
 so that when the outputs are passed to the next script, we have matching acceptor 
@@ -11,7 +11,28 @@ splice sites in the 5' or 3' direction.
 The script takes in three GFF files, one for human exons, one for FANTOM exons, and one 
 for the long read data (e.g. Nanopore or PacBio). The script then matches the exons and returns
 a filtered_matched_human_exons file which contains the human exons that are matched for both 
-the FANTOM and long read data.
+the FANTOM and long read data. Terminal exons and blocks are matched with a hash join on
+(chromosome, strand, splice site), so coordinates only ever match within the same chromosome.
+
+An optional region ("chr" or "chr:start-end") restricts matching to that part of the genome. Bgzipped,
+coordinate sorted inputs are then read through their tabix/CSI index so only that region is fetched.
+
+Inputs are validated in the same pass that strips their comments (column count, coordinates, strand and
+attribute syntax). Files that passed are remembered by resolved path, size and mtime in $LEAP_CACHE_DIR/validated
+(default ~/.cache/leap), one marker file each, and not checked again. --strict also runs gffread -E on every input.
+
+The matched exons and blocks are written in the format selected by LEAP_INTERMEDIATE_FORMAT (see
+intermediateFormat.py); Parquet/Arrow tables from startOrEndGrab are read without validation.
+Timings per phase (load, match, write) are written to a metrics sidecar (see stageMetrics.py).
+
+The matches of every chromosome are kept in the result cache (see resultCache.py), keyed on its human and
+block rows, the direction and single_exon, and put back together in the order of a genome-wide match. A
+rerun after changing the evidence of one chromosome only matches that chromosome again.
+
+--write-index also writes the terminal blocks of the FANTOM and long read evidence (terminal_fantom_blocks.gff,
+terminal_longread_blocks.gff). A later run in the same direction, e.g. round 2 of main.nf, can pass them with
+--index in place of the evidence: the terminal blocks do not depend on the human exons, so it matches them
+directly and gets the same results without loading and parsing the evidence again.
 '''
 
 import pandas as pd
@@ -19,24 +40,152 @@ import re
 import sys
 import os
 import subprocess
-import argparse
-import csv
+import hashlib
+from indexedInputs import filter_region, is_indexed, read_region
+from gffLoading import read_gff, report_peak_rss
+from gffAttributes import fantom_blocks, gff3_attribute, gtf_attribute, strip_prefix
+from intermediateFormat import is_binary, read_table, write_table
+import resultCache
+from stageMetrics import StageMetrics
+
+# Column names of the startOrEndGrab output
+HUMAN_COLUMNS = ["seqname", "source", "feature", "Start", "End", "score", "Strand", "frame", "Attributes", "ensembl_gene_id"]
 
 def validate_gff(file_path):
+    # Strict validation through gffread, only run with --strict
     result = subprocess.run(['gffread', file_path, '-E'], capture_output=True, text=True)
     if result.returncode != 0:
         print(f"Validation failed for {file_path}:\n{result.stderr}")
     else:
         print(f"{file_path} is valid.")
 
-def preprocess_gff(file_path):
+class GffValidator:
+    '''
+    Checks GFF/GTF lines as they stream past: at least 9 columns, positive integer coordinates with
+    start <= end, a valid strand and key=value (GFF3) or key "value" (GTF) attributes.
+    Only the first MAX_ERRORS problems are kept for the report.
+    '''
+    MAX_ERRORS = 10
+    STRANDS = {'+', '-', '.', '?'}
+    ATTRIBUTE = re.compile(r'^\s*[^\s=;]+(=[^;]*|\s+"?[^";]*"?)\s*$')
+
+    def __init__(self, file_path, header=False):
+        self.file_path = file_path
+        self.skip_header = header
+        self.line_number = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, message):
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"line {self.line_number}: {message}")
+
+    def check(self, line):
+        self.line_number += 1
+        if line.startswith('#') or not line.strip():
+            return
+        if self.skip_header:
+            self.skip_header = False
+            return
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) < 9:
+            self.error(f"expected at least 9 columns, found {len(fields)}")
+            return
+        start, end, strand, attributes = fields[3], fields[4], fields[6], fields[8]
+        if not (start.isdigit() and end.isdigit()):
+            self.error(f"non-integer coordinates {start}-{end}")
+        elif int(start) < 1 or int(start) > int(end):
+            self.error(f"invalid coordinates {start}-{end}")
+        if strand not in self.STRANDS:
+            self.error(f"invalid strand '{strand}'")
+        for attribute in attributes.split(';'):
+            if attribute.strip() and not self.ATTRIBUTE.match(attribute):
+                self.error(f"malformed attribute '{attribute.strip()}'")
+
+    @property
+    def valid(self):
+        return self.error_count == 0
+
+    def report(self):
+        if self.valid:
+            print(f"{self.file_path} is valid.")
+        else:
+            print(f"Validation failed for {self.file_path} ({self.error_count} problems):\n" + "\n".join(self.errors))
+
+def validation_cache_dir():
+    cache_dir = os.environ.get('LEAP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'leap'))
+    return os.path.join(cache_dir, 'validated')
+
+def validation_key(file_path):
+    # Files are identified by path, size and modification time rather than a full checksum; the resolved
+    # path makes the copies Nextflow links into every work directory share one entry
+    stat = os.stat(file_path)
+    return f"{os.path.realpath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+def _validation_marker(file_path):
+    return os.path.join(validation_cache_dir(), hashlib.sha1(validation_key(file_path).encode()).hexdigest())
+
+def is_validated(file_path):
+    return os.path.exists(_validation_marker(file_path))
+
+def record_validation(file_path):
+    # One marker file per validated input, so concurrent jobs never rewrite each other's entries
+    marker = _validation_marker(file_path)
+    try:
+        os.makedirs(validation_cache_dir(), exist_ok=True)
+        temp_file = f"{marker}.{os.getpid()}"
+        with open(temp_file, 'w') as f:
+            f.write(validation_key(file_path) + '\n')
+        os.replace(temp_file, marker)
+    except OSError as e:
+        print(f"Could not update the validation cache: {e}")
+
+def preprocess_gff(file_path, validator=None):
     processed_file = 'processed_' + os.path.basename(file_path)
     with open(file_path, 'r') as infile, open(processed_file, 'w') as outfile:
         for line in infile:
+            if validator is not None:
+                validator.check(line)
             if not line.startswith('#'):
                 outfile.write(line)
     return processed_file
 
+def load_gff(file_path, region=None, header=None, validate=True, **read_csv_kwargs):
+    # Bgzipped inputs are fetched through their tabix/CSI index, only for the requested region
+    if region is not None and is_indexed(file_path):
+        df = read_region(file_path, region, on_bad_lines='skip')
+        if header is not None:
+            # The startOrEndGrab output is written with a header, which an indexed copy cannot keep
+            df.columns = HUMAN_COLUMNS[:len(df.columns)] + list(df.columns[len(HUMAN_COLUMNS):])
+        return df
+
+    # Binary tables were written by an earlier stage of the pipeline, not supplied by the user
+    if is_binary(file_path):
+        df = read_table(file_path, header=header)
+        if region is not None:
+            df = filter_region(df, region, *((0, 3, 4) if header is None else ('seqname', 'Start', 'End')))
+        return df
+
+    # Validate while the file is streamed for matching, unless this exact file already passed or is a
+    # pipeline intermediate (validate=False, e.g. the terminal block indexes of --index)
+    validator = None
+    if validate and is_validated(file_path):
+        print(f"{file_path} was already validated, skipping.")
+    elif validate:
+        validator = GffValidator(file_path, header=header is not None)
+    processed_file = preprocess_gff(file_path, validator)
+    if validator is not None:
+        validator.report()
+        if validator.valid:
+            record_validation(file_path)
+
+    df = read_gff(processed_file, header=header, on_bad_lines='skip', **read_csv_kwargs)
+    os.remove(processed_file)
+    if region is not None:
+        df = filter_region(df, region, *((0, 3, 4) if header is None else ('seqname', 'Start', 'End')))
+    return df
+
 def filter_by_ensg(df1, df2):
     ensg_set = set(df2.iloc[:, -2])
     filtered_df = df1[df1.iloc[:, -2].isin(ensg_set)]
@@ -44,20 +193,26 @@ def filter_by_ensg(df1, df2):
 
 def extract_transcript_id_and_exon_number(df):
     if 'Name=' in df.iloc[0, 8]:
-        df['transcript_id'] = df[8].str.extract('Name="(.*?)\..*?"')
-        df['block_num'] = df[8].str.extract('Name=".*?_block(.*?)"')
+        df['transcript_id'], df['block_num'] = fantom_blocks(df[8])
     else:
-        df['transcript_id'] = df[8].str.extract('transcript_id "(.*?)"')
-        df['block_num'] = df[8].str.extract('exon_number "(.*?)"')
+        df['transcript_id'] = gtf_attribute(df[8], 'transcript_id')
+        df['block_num'] = gtf_attribute(df[8], 'exon_number')
     return df
 
-def match_exons_with_blocks_threeprime(human_df, block_df, single_exon):
+# For each direction: (block_num picked for + strand, for - strand) and the shared splice site coordinate,
+# as (human column, block column) for the + strand and the - strand
+TERMINAL_BLOCKS = {
+    'threeprime': {'pick': ('idxmax', 'idxmin'), '+': ('Start', 3), '-': ('End', 4)},
+    'fiveprime': {'pick': ('idxmin', 'idxmax'), '+': ('End', 4), '-': ('Start', 3)},
+}
+
+def terminal_blocks(block_df, single_exon, direction):
     # Check if 'chr' is present in any of the entries in the column
-    if block_df[0].str.contains('chr').any():
-        block_df[0] = block_df[0].str.replace('^chr', '', regex=True)
-    print(block_df.head())
-    human_df['transcript_id'] = human_df['Attributes'].str.extract('Parent=transcript:(.*?);')
-    block_df = extract_transcript_id_and_exon_number(block_df)
+    if block_df[0].astype(str).str.contains('chr').any():
+        block_df[0] = block_df[0].astype(str).str.replace('^chr', '', regex=True)
+    # Blocks shared between directions (see localPipeline.py) are given with their IDs already parsed
+    if 'block_num' not in block_df.columns:
+        block_df = extract_transcript_id_and_exon_number(block_df)
 
     block_df['block_num'] = pd.to_numeric(block_df['block_num'], errors='coerce')
     block_df = block_df.dropna(subset=['block_num'])
@@ -65,71 +220,185 @@ def match_exons_with_blocks_threeprime(human_df, block_df, single_exon):
     if single_exon == True:
         max_block_num = block_df.groupby('transcript_id')['block_num'].transform('max')
         block_df = block_df[max_block_num > 1]
+    pick_forward, pick_reverse = TERMINAL_BLOCKS[direction]['pick']
     blocks_forward = block_df[block_df[6] == '+']
     blocks_reverse = block_df[block_df[6] == '-']
-    last_blocks_forward = blocks_forward.loc[blocks_forward.groupby('transcript_id')['block_num'].idxmax()]
-    last_blocks_reverse = blocks_reverse.loc[blocks_reverse.groupby('transcript_id')['block_num'].idxmin()]
+    terminal_forward = blocks_forward.loc[getattr(blocks_forward.groupby('transcript_id')['block_num'], pick_forward)()]
+    terminal_reverse = blocks_reverse.loc[getattr(blocks_reverse.groupby('transcript_id')['block_num'], pick_reverse)()]
+    terminal_forward[0] = terminal_forward[0].astype(str)
+    terminal_reverse[0] = terminal_reverse[0].astype(str)
+    return terminal_forward, terminal_reverse
 
-    last_blocks_forward[0] = last_blocks_forward[0].astype(str)
-    last_blocks_reverse[0] = last_blocks_reverse[0].astype(str)
+def splice_site_keys(chromosomes, coordinates, chromosome_codes):
+    # (chromosome, splice site) packed into one int64; the strand is implied by which frames are joined
+    codes = pd.Categorical(chromosomes.astype(str).str.replace('^chr', '', regex=True), categories=chromosome_codes).codes.astype('int64')
+    return pd.Series((codes << 32) | pd.to_numeric(coordinates).to_numpy(dtype='int64'), index=chromosomes.index)
 
-    matched_human_exons_forward = human_df[human_df['Strand'] == '+']
-    matched_human_exons_forward = matched_human_exons_forward[matched_human_exons_forward['Start'].isin(last_blocks_forward[3])]
-    matched_blocks_forward = last_blocks_forward[last_blocks_forward[3].isin(matched_human_exons_forward['Start'])]
+def join_splice_sites(human_keys, block_keys):
+    # Hash join on the packed keys, returning the matched (human row, block row) pairs
+    human_side = pd.DataFrame({'key': human_keys.to_numpy(), 'human_row': human_keys.index})
+    block_side = pd.DataFrame({'key': block_keys.to_numpy(), 'block_row': block_keys.index})
+    return human_side.merge(block_side, on='key')[['human_row', 'block_row']]
 
-    matched_human_exons_reverse = human_df[human_df['Strand'] == '-']
-    matched_human_exons_reverse = matched_human_exons_reverse[matched_human_exons_reverse['End'].isin(last_blocks_reverse[4])]
-    matched_blocks_reverse = last_blocks_reverse[last_blocks_reverse[4].isin(matched_human_exons_reverse['End'])]
+def read_terminal_index(index_df):
+    # The terminal blocks written by --write-index, split back into the frames terminal_blocks returns
+    index_df = index_df.rename(columns={9: 'transcript_id', 10: 'block_num'})
+    index_df[0] = index_df[0].astype(str)
+    index_df['block_num'] = pd.to_numeric(index_df['block_num'], errors='coerce')
+    return index_df[(index_df[6] == '+').to_numpy()], index_df[(index_df[6] == '-').to_numpy()]
 
-    matched_human_exons_forward = matched_human_exons_forward.sort_values(by=['Start'])
-    matched_human_exons_reverse = matched_human_exons_reverse.sort_values(by=['End'])
-    matched_blocks_forward = matched_blocks_forward.sort_values(by=[3])
-    matched_blocks_reverse = matched_blocks_reverse.sort_values(by=[4])
+def match_exons_with_blocks(human_df, block_df, single_exon, direction):
+    return match_terminal_blocks(human_df, *terminal_blocks(block_df, single_exon, direction), direction)
 
-    matched_human_exons = pd.concat([matched_human_exons_forward, matched_human_exons_reverse])
-    matched_blocks = pd.concat([matched_blocks_forward, matched_blocks_reverse])
+def match_terminal_blocks(human_df, terminal_forward, terminal_reverse, direction):
+    human_df['transcript_id'] = strip_prefix(gff3_attribute(human_df['Attributes'], 'Parent'), 'transcript')
+    chromosome_codes = pd.unique(pd.concat([
+        human_df.iloc[:, 0].astype(str).str.replace('^chr', '', regex=True), terminal_forward[0], terminal_reverse[0]]))
+    matched_human_exons = []
+    matched_blocks = []
+    for strand, terminal in (('+', terminal_forward), ('-', terminal_reverse)):
+        human_col, block_col = TERMINAL_BLOCKS[direction][strand]
+        human_strand = human_df[human_df['Strand'] == strand]
+        pairs = join_splice_sites(splice_site_keys(human_strand.iloc[:, 0], human_strand[human_col], chromosome_codes),
+                                  splice_site_keys(terminal[0], terminal[block_col], chromosome_codes))
+        # Keep the original row order before sorting on the splice site, as the isin filters did
+        matched_human_exons.append(human_strand[human_strand.index.isin(pairs['human_row'])].sort_values(by=[human_col]))
+        matched_blocks.append(terminal[terminal.index.isin(pairs['block_row'])].sort_values(by=[block_col]))
 
-    return matched_human_exons, matched_blocks
+    return pd.concat(matched_human_exons), pd.concat(matched_blocks)
+
+def match_exons_with_blocks_threeprime(human_df, block_df, single_exon):
+    return match_exons_with_blocks(human_df, block_df, single_exon, 'threeprime')
 
 def match_exons_with_blocks_fiveprime(human_df, block_df, single_exon):
-    # Check if 'chr' is present in any of the entries in the column
-    if block_df[0].str.contains('chr').any():
-        block_df[0] = block_df[0].str.replace('^chr', '', regex=True)
-    human_df['transcript_id'] = human_df['Attributes'].str.extract('Parent=transcript:(.*?);')
-    block_df = extract_transcript_id_and_exon_number(block_df)
+    return match_exons_with_blocks(human_df, block_df, single_exon, 'fiveprime')
 
-    block_df['block_num'] = pd.to_numeric(block_df['block_num'], errors='coerce')
-    block_df = block_df.dropna(subset=['block_num'])
-    # FILTER OUT SINGLE EXON GENES
-    if single_exon == True:
-        max_block_num = block_df.groupby('transcript_id')['block_num'].transform('max')
-        block_df = block_df[max_block_num > 1]
-    blocks_forward = block_df[block_df[6] == '+']
-    blocks_reverse = block_df[block_df[6] == '-']
-    first_blocks_forward = blocks_forward.loc[blocks_forward.groupby('transcript_id')['block_num'].idxmin()]
-    first_blocks_reverse = blocks_reverse.loc[blocks_reverse.groupby('transcript_id')['block_num'].idxmax()]
-    first_blocks_forward[0] = first_blocks_forward[0].astype(str)
-    first_blocks_reverse[0] = first_blocks_reverse[0].astype(str)
-    matched_human_exons_forward = human_df[human_df['Strand'] == '+']
-    matched_human_exons_forward = matched_human_exons_forward[matched_human_exons_forward['End'].isin(first_blocks_forward[4])]
-    matched_blocks_forward = first_blocks_forward[first_blocks_forward[4].isin(matched_human_exons_forward['End'])]
-    matched_human_exons_reverse = human_df[human_df['Strand'] == '-']
-    matched_human_exons_reverse = matched_human_exons_reverse[matched_human_exons_reverse['Start'].isin(first_blocks_reverse[3])]
-    matched_blocks_reverse = first_blocks_reverse[first_blocks_reverse[3].isin(matched_human_exons_reverse['Start'])]
-    matched_human_exons_forward = matched_human_exons_forward.sort_values(by=['End'])
-    matched_human_exons_reverse = matched_human_exons_reverse.sort_values(by=['Start'])
-    matched_blocks_forward = matched_blocks_forward.sort_values(by=[4])
-    matched_blocks_reverse = matched_blocks_reverse.sort_values(by=[3])
-    matched_human_exons = pd.concat([matched_human_exons_forward, matched_human_exons_reverse])
-    matched_blocks = pd.concat([matched_blocks_forward, matched_blocks_reverse])
-
-    return matched_human_exons, matched_blocks
+def chromosome_slices(df):
+    # Rows of every chromosome (first column, without any "chr" prefix), in file order and keeping their labels
+    codes, chromosomes = pd.factorize(df.iloc[:, 0], use_na_sentinel=False)
+    chromosome_codes, chromosomes = pd.factorize(pd.Index(chromosomes).astype(str).str.replace('^chr', '', regex=True))
+    return {chromosomes[code]: rows for code, rows in df.groupby(chromosome_codes[codes], sort=False)}
+
+def match_chromosome(human_slice, block_slice, single_exon, direction):
+    '''
+    The matches of one chromosome as a cacheable table: the positions within the slices of the matched human
+    exons ('human') and terminal blocks ('block', with their transcript and block number), the transcripts of
+    all the blocks of the chromosome ('transcript') and the dtype the block numbers parsed to ('dtype').
+    '''
+    human_slice = human_slice.reset_index(drop=True)
+    block_slice = block_slice.reset_index(drop=True)
+    matched_human, matched_blocks = match_exons_with_blocks(human_slice, block_slice, single_exon, direction)
+    return pd.concat([
+        pd.DataFrame({'table': 'human', 'row': matched_human.index}),
+        pd.DataFrame({'table': 'block', 'row': matched_blocks.index,
+                      'transcript_id': matched_blocks['transcript_id'].astype(str), 'block_num': matched_blocks['block_num']}),
+        pd.DataFrame({'table': 'transcript', 'transcript_id': block_slice['transcript_id'].dropna().astype(str).unique()}),
+        pd.DataFrame({'table': 'dtype', 'transcript_id': [str(matched_blocks['block_num'].dtype)]}),
+    ], ignore_index=True)
+
+def match_exons_with_blocks_cached(human_df, block_df, single_exon, direction, human_slices):
+    '''
+    match_exons_with_blocks from per-chromosome results kept in the result cache (see resultCache.py), keyed on
+    the human and block rows of the chromosome. The cached rows are put back in the order the genome-wide
+    match gives them, so the output is the same. Falls back to the genome-wide match when the cache is off or
+    a transcript has blocks on several chromosomes, as its terminal block is then picked across them.
+    '''
+    if not resultCache.enabled():
+        return match_exons_with_blocks(human_df, block_df, single_exon, direction)
+    human_rows, block_rows, block_ids, block_dtypes = [], [], [], set()
+    cached = 0
+    block_slices = chromosome_slices(block_df)
+    for chromosome, block_slice in block_slices.items():
+        human_slice = human_slices.get(chromosome, human_df.iloc[:0])
+        key = resultCache.result_key('globalExonMatcher', [human_slice, block_slice], direction=direction, single_exon=single_exon)
+        matches = resultCache.load_result(key)
+        if matches is None:
+            matches = match_chromosome(human_slice, block_slice, single_exon, direction)
+            resultCache.save_result(key, matches)
+        else:
+            cached += 1
+        human_matches = matches[matches['table'] == 'human']
+        block_matches = matches[matches['table'] == 'block']
+        human_rows.append(human_slice.index[human_matches['row'].astype('int64').to_numpy()].to_series())
+        block_rows.append(block_matches.set_index(block_slice.index[block_matches['row'].astype('int64').to_numpy()]))
+        block_ids.append(matches.loc[matches['table'] == 'transcript', 'transcript_id'])
+        block_dtypes.update(matches.loc[matches['table'] == 'dtype', 'transcript_id'])
+    print(f"{cached} of {len(block_slices)} chromosomes from the result cache")
+    if not block_slices or pd.concat(block_ids).duplicated().any():
+        return match_exons_with_blocks(human_df, block_df, single_exon, direction)
+
+    human_df['transcript_id'] = strip_prefix(gff3_attribute(human_df['Attributes'], 'Parent'), 'transcript')
+    human_rows = pd.concat(human_rows)
+    block_rows = pd.concat(block_rows)
+    terminal = block_df.loc[block_rows.index].copy()
+    terminal[0] = terminal[0].astype(str).str.replace('^chr', '', regex=True)
+    terminal['transcript_id'] = block_rows['transcript_id']
+    # Block numbers are ints unless one failed to parse anywhere in the file
+    terminal['block_num'] = block_rows['block_num'].astype(block_dtypes.pop() if len(block_dtypes) == 1 else 'float64')
+    matched_human_exons = []
+    matched_blocks = []
+    for strand in ('+', '-'):
+        human_col, block_col = TERMINAL_BLOCKS[direction][strand]
+        human_strand = human_df[human_df['Strand'] == strand]
+        matched_human_exons.append(human_strand[human_strand.index.isin(human_rows)].sort_values(by=[human_col]))
+        # Terminal blocks come out of the groupby ordered on their transcript, one per transcript and strand
+        terminal_strand = terminal[(terminal[6] == strand).to_numpy()].sort_values(by='transcript_id', kind='stable')
+        matched_blocks.append(terminal_strand.sort_values(by=[block_col]))
+
+    return pd.concat(matched_human_exons), pd.concat(matched_blocks)
+
+def match_exons(human_df, fantom_df, longread_df, single_exon, direction, write_index=False, indexed=False):
+    '''
+    The matched exons and blocks of one direction, keyed on the file each is written to. The human table gains
+    its transcript column along the way, and so do the block tables when they are matched genome-wide.
+
+    write_index adds the terminal blocks of all the evidence to the outputs. With indexed, fantom_df and
+    longread_df are such terminal block indexes, from an earlier run with the same direction and single_exon,
+    and are matched as they are.
+    '''
+    if direction not in TERMINAL_BLOCKS:
+        raise ValueError("Invalid direction argument. Use 'fiveprime' or 'threeprime'.")
+
+    outputs = {}
+    if indexed or write_index:
+        matched = {}
+        for name, block_df in (('fantom', fantom_df), ('longread', longread_df)):
+            if indexed:
+                terminal_forward, terminal_reverse = read_terminal_index(block_df)
+            else:
+                terminal_forward, terminal_reverse = terminal_blocks(block_df, single_exon, direction)
+                outputs[f'terminal_{name}_blocks.gff'] = pd.concat([terminal_forward, terminal_reverse])
+            matched[name] = match_terminal_blocks(human_df, terminal_forward, terminal_reverse, direction)
+        matched_human_exons_fantom, matched_fantom_blocks = matched['fantom']
+        matched_human_exons_longread, matched_longread_blocks = matched['longread']
+    else:
+        # Sliced before the matches add the transcript column, so both evidence types key on the same rows
+        human_slices = chromosome_slices(human_df)
+        matched_human_exons_fantom, matched_fantom_blocks = match_exons_with_blocks_cached(human_df, fantom_df, single_exon, direction, human_slices)
+        matched_human_exons_longread, matched_longread_blocks = match_exons_with_blocks_cached(human_df, longread_df, single_exon, direction, human_slices)
+
+    # ENSG filtering
+    filtered_human_exons_fantom = filter_by_ensg(matched_human_exons_fantom, matched_human_exons_longread)
+    outputs.update({
+        'matched_human_exons_fantom.gff': matched_human_exons_fantom,
+        'matched_fantom_blocks.gff': matched_fantom_blocks,
+        'matched_human_exons_longread.gff': matched_human_exons_longread,
+        'matched_longread_blocks.gff': matched_longread_blocks,
+        'filtered_matched_human_exons.gff': filtered_human_exons_fantom,
+    })
+    return outputs
 
 def write_file(file_path, data):
-    data.to_csv(file_path, sep='\t', index=False, header=False)
+    write_table(data, file_path, header=False)
 def main():
+    # --strict additionally runs gffread on every input
+    strict = '--strict' in sys.argv
+    # --write-index also writes the terminal blocks of the evidence, --index matches against them instead
+    write_index = '--write-index' in sys.argv
+    indexed = '--index' in sys.argv
+    sys.argv = [arg for arg in sys.argv if arg not in ['--strict', '--write-index', '--index']]
     if len(sys.argv) < 5:
-        print("Usage: python exonMatcher.py <human_file.gff> <fantom_file.gff> <longread_file.gff> <single_exon?>  <fiveprimeOrThreeprime?> <output_directory>")
+        print("Usage: python exonMatcher.py <human_file.gff> <fantom_file.gff> <longread_file.gff> <single_exon?>  <fiveprimeOrThreeprime?> <output_directory> [region] [--strict] [--write-index|--index]")
         sys.exit(1)
 
     human_file = sys.argv[1]
@@ -147,43 +416,35 @@ def main():
     else:
         direction = 'fiveprime'  # Default value
     output_dir = sys.argv[6] if len(sys.argv) > 6 else os.getcwd()
+    region = sys.argv[7] if len(sys.argv) > 7 else None
 
-    validate_gff(human_file)
-    validate_gff(fantom_file)
-    validate_gff(longread_file)
+    if strict:
+        validate_gff(human_file)
+        if not indexed:
+            validate_gff(fantom_file)
+            validate_gff(longread_file)
 
-    processed_human_file = preprocess_gff(human_file)
-    processed_fantom_file = preprocess_gff(fantom_file)
-    processed_longread_file = preprocess_gff(longread_file)
+    metrics = StageMetrics('globalExonMatcher', direction=direction, region=region)
+    with metrics.phase('load') as phase:
+        human_df = load_gff(human_file, region, header='infer')
+        # With --index the evidence is the terminal block indexes round 1 wrote, not user input
+        fantom_df = load_gff(fantom_file, region, header=None, validate=not indexed, comment='#')
+        longread_df = load_gff(longread_file, region, header=None, validate=not indexed, comment='#')
+        phase.read(human_file, fantom_file, longread_file)
+        phase.rows_out = len(human_df) + len(fantom_df) + len(longread_df)
 
-    human_df = pd.read_csv(processed_human_file, sep='\t', on_bad_lines='skip')
-    fantom_df = pd.read_csv(processed_fantom_file, sep='\t', header=None, comment='#', on_bad_lines='skip')
-    longread_df = pd.read_csv(processed_longread_file, sep='\t', header=None, comment='#', on_bad_lines='skip')
+    with metrics.phase('match') as phase:
+        phase.rows_in = len(human_df) + len(fantom_df) + len(longread_df)
+        outputs = match_exons(human_df, fantom_df, longread_df, single_exon, direction, write_index, indexed)
+        phase.rows_out = sum(len(df) for df in outputs.values())
 
-    # Determine which function to use based on the direction
-    if direction == 'fiveprime':
-        match_exons_with_blocks = match_exons_with_blocks_fiveprime
-    elif direction == 'threeprime':
-        match_exons_with_blocks = match_exons_with_blocks_threeprime
-    else:
-        raise ValueError("Invalid direction argument. Use 'fiveprime' or 'threeprime'.")
-
-    # Call the appropriate function
-    matched_human_exons_fantom, matched_fantom_blocks = match_exons_with_blocks(human_df, fantom_df, single_exon)
-    matched_human_exons_longread, matched_longread_blocks = match_exons_with_blocks(human_df, longread_df, single_exon)
-
-    output_dir = os.path.join(output_dir, '')
-    matched_human_exons_fantom.to_csv(output_dir + 'matched_human_exons_fantom.gff', sep='\t', index=False, header=False)
-    matched_fantom_blocks.to_csv(output_dir + 'matched_fantom_blocks.gff', sep='\t', index=False, header=False)
-    matched_human_exons_longread.to_csv(output_dir + 'matched_human_exons_longread.gff', sep='\t', index=False, header=False)
-    matched_longread_blocks.to_csv(output_dir + 'matched_longread_blocks.gff', sep='\t', index=False, header=False)
-
-    # ENSG filtering
-    filtered_human_exons_fantom = filter_by_ensg(matched_human_exons_fantom, matched_human_exons_longread)
-    write_file(output_dir + 'filtered_matched_human_exons.gff' , filtered_human_exons_fantom)
-    os.remove(processed_human_file)
-    os.remove(processed_fantom_file)
-    os.remove(processed_longread_file)
+    with metrics.phase('write') as phase:
+        for file_name, df in outputs.items():
+            write_file(os.path.join(output_dir, file_name), df)
+            phase.wrote(os.path.join(output_dir, file_name))
+        phase.rows_in = sum(len(df) for df in outputs.values())
+    report_peak_rss('globalExonMatcher')
+    metrics.write()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
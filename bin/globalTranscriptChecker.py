@@ -4,7 +4,8 @@ Author: Lucas Cortes
 Date: 2020-10-15
 
 Usage: python globalTranscriptChecker.py <human_transcripts> <fantom> <longread_transcripts>  
-<capOrTail/capOrTail_transcripts> <fiveprimeOrThreeprime?> <chromosome> <output_directory> 
+<capOrTail/capOrTail_transcripts> <fiveprimeOrThreeprime?> <chromosome> <output_directory> [sweep|loop] [--previous <matches>]
+[--shards <plan>]
 
 This script will check in order:
 1. If there is a capOrTail peak or capOrTail site 5' or 3' of the selected Human Transcript 
@@ -14,17 +15,52 @@ This script will check in order:
 It does this human transcript by human transcript. The files coming in must be exon matched already, 
 so there should only be human, FANTOM, and long read transcripts that have matching acceptor sites. 
 This script does an extra check for that to make sure that the transcripts are in the correct order.
+Bgzipped, coordinate sorted inputs are read through their tabix/CSI index, fetching only <chromosome>.
+The matches are written in the format selected by LEAP_INTERMEDIATE_FORMAT (see intermediateFormat.py).
+
+The optional last argument picks the matching engine. 'sweep' (the default) sorts the exons, peaks,
+FANTOM and long read blocks once per chromosome and strand and resolves every exon -> peak -> FANTOM
+-> long read chain with binary searches over the sorted arrays. 'loop' is the original exon by exon
+scan, kept so the two can be compared.
+
+The matches of a chromosome are kept in the result cache (see resultCache.py), keyed on its slices of the
+four inputs, the direction, the capOrTail window and the engine, so a rerun with the same slices skips the
+matching.
+
+--previous takes the matches of an earlier run in the same direction (the CAT_ALL table of round 1, for round 2
+of main.nf). The human exons that run already matched get its rows back, rebuilt on the current exon, and only
+the others are checked; the output is the same as checking all of them. Exons the earlier run checked without a
+match are not known here (only its matches are) and are checked again.
+
+--shards takes the shard plan of shardGenome.py, and <chromosome> is then the name of a shard: every region of
+the shard is checked on its own (a row belongs to each region it overlaps, see genomicShards.py) and the matches
+are written in region order. The shard splits of splitChromosomes.py are read without a header, as they already
+leave out the human rows a per chromosome split loses to skiprows=1.
 
 '''
 
 
+import numpy as np
 import pandas as pd
 import sys
+from genomicShards import read_shards, region_mask
+from indexedInputs import is_indexed, read_region
+from gffLoading import read_gff, report_peak_rss
+from gffAttributes import gff3_attribute, gtf_attribute, strip_prefix
+from intermediateFormat import is_binary, read_table, write_table
+import resultCache
+from stageMetrics import StageMetrics, get_logger
+
+log = get_logger('globalTranscriptChecker')
+
+# How far (bp) upstream/downstream of the terminal exon a capOrTail site may sit
+WINDOW = 10000
 
 def strip_chr_prefix(df):
-    df.iloc[:, 0] = df.iloc[:, 0].astype(str)
+    # Replace the whole column, the loaders read it as a categorical
+    df[df.columns[0]] = df.iloc[:, 0].astype(str)
     if df.iloc[:, 0].str.contains('chr').any():
-        df.iloc[:, 0] = df.iloc[:, 0].str.replace('chr', '')
+        df[df.columns[0]] = df.iloc[:, 0].str.replace('chr', '')
     return df
 # Convert numeric chromosomes to int, leave 'X' and 'Y' as str
 def convert_chromosome(chromosome):
@@ -34,21 +70,34 @@ def convert_chromosome(chromosome):
         return chromosome
 def process_dataframe(df, column_names):
     #df.iloc[:, 0] = df.iloc[:, 0].apply(convert_chromosome)
-    df.iloc[:, 3] = pd.to_numeric(df.iloc[:, 3])
-    df.iloc[:, 4] = pd.to_numeric(df.iloc[:, 4])
-    df.iloc[:, 6] = df.iloc[:, 6].astype(str)
+    df[df.columns[3]] = pd.to_numeric(df.iloc[:, 3])
+    df[df.columns[4]] = pd.to_numeric(df.iloc[:, 4])
+    df[df.columns[6]] = df.iloc[:, 6].astype(str)
     df.columns = column_names + list(df.columns[len(column_names):])
     df = df[column_names]
     return df
 
-def importGffs(human_file, capOrTail_file, fantom_file, longRead_file):
-    human = pd.read_csv(human_file, sep='\t', skiprows=1)
-    capOrTail = pd.read_csv(capOrTail_file, sep='\t', header=None).iloc[:, :9]
-    fantom = pd.read_csv(fantom_file, sep='\t', header=None).iloc[:, :9]
-    longRead = pd.read_csv(longRead_file, sep='\t', header=None).iloc[:, :9]
-    
+def read_input(file_path, chromosome=None, **read_csv_kwargs):
+    # Bgzipped inputs with a tabix/CSI index only have the requested chromosome fetched
+    if chromosome is not None and is_indexed(file_path):
+        return read_region(file_path, chromosome, n_columns=10)
+    # Binary intermediate tables are filtered to the chromosome as they are read
+    if is_binary(file_path):
+        return read_table(file_path, chromosome=chromosome, **read_csv_kwargs)
+    return read_gff(file_path, **read_csv_kwargs)
 
-    
+def importGffs(human_file, capOrTail_file, fantom_file, longRead_file, chromosome=None, sharded=False):
+    human = read_input(human_file, chromosome, **({'header': None} if sharded else {'skiprows': 1}))
+    capOrTail = read_input(capOrTail_file, chromosome, header=None)
+    fantom = read_input(fantom_file, chromosome, header=None)
+    longRead = read_input(longRead_file, chromosome, header=None)
+    return prepare_inputs(human, capOrTail, fantom, longRead)
+
+def prepare_inputs(human, capOrTail, fantom, longRead):
+    # Names and types the columns of the four split tables, as read from their files
+    capOrTail = capOrTail.iloc[:, :9]
+    fantom = fantom.iloc[:, :9]
+    longRead = longRead.iloc[:, :9]
 
     # Strip unwatned 'chr' prefix
     human = strip_chr_prefix(human)
@@ -68,14 +117,51 @@ def importGffs(human_file, capOrTail_file, fantom_file, longRead_file):
     fantom = process_dataframe(fantom, fantom_column_names) 
     longRead = process_dataframe(longRead, longRead_column_names)
 
-    fantom['Name'] = fantom['Attributes'].str.extract('Name="([^"]*)')
-    longRead['Name'] = longRead['Attributes'].str.extract('gene_id\s+"([^"]+)"')
-    human['Name'] = human['Attributes'].str.extract('Parent=transcript:(.*?);')
-    print(human.head(), capOrTail.head(), fantom.head(), longRead.head())
+    fantom['Name'] = gff3_attribute(fantom['Attributes'], 'Name')
+    longRead['Name'] = gtf_attribute(longRead['Attributes'], 'gene_id')
+    human['Name'] = strip_prefix(gff3_attribute(human['Attributes'], 'Parent'), 'transcript')
+    log.debug("%s\n%s\n%s\n%s", human.head(), capOrTail.head(), fantom.head(), longRead.head())
     return human, capOrTail, fantom, longRead
 
-def findMatchesFivePrime(human, fantom, longRead, capOrTail):
-    results = pd.DataFrame()
+# Number of matches buffered before they are turned into a DataFrame chunk
+RESULT_CHUNK_SIZE = 50000
+
+class MatchResults:
+    '''
+    Collects accepted matches without copying the whole results table on every append.
+    Rows are buffered as tuples and turned into one DataFrame per chunk_size matches, and to_frame()
+    returns everything as a single DataFrame.
+    '''
+    extra_columns = ['capOrTail_Start', 'capOrTail_End', 'Transcript_Start', 'Transcript_End', 'Transcript_Name']
+
+    def __init__(self, chunk_size=RESULT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.columns = None
+        self.buffer = []
+        self.chunks = []
+
+    def append(self, exon, capOrTail_site):
+        if self.columns is None:
+            self.columns = list(exon.index) + self.extra_columns
+        self.buffer.append(tuple(exon.tolist()) + (
+            capOrTail_site['Start'], capOrTail_site['End'], exon['Start'], exon['End'], exon['Name']))
+        if len(self.buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.chunks.append(pd.DataFrame.from_records(self.buffer, columns=self.columns))
+        self.buffer = []
+
+    def to_frame(self):
+        self.flush()
+        if not self.chunks:
+            return pd.DataFrame()
+        return pd.concat(self.chunks, ignore_index=True) if len(self.chunks) > 1 else self.chunks[0]
+
+def findMatchesFivePrime(human, fantom, longRead, capOrTail, chunk_size=RESULT_CHUNK_SIZE):
+    results = MatchResults(chunk_size)
     # Loop over human exons
     for i, exon in human.iterrows():
         # Filter capOrTail based on the strand, chromosome, position, within 10000bp of the exon
@@ -87,8 +173,7 @@ def findMatchesFivePrime(human, fantom, longRead, capOrTail):
         ]
 
         for j, capOrTail_site in capOrTail_filtered.iterrows():
-            print(exon['Start'])
-            print(fantom['Start'])
+            log.debug("%s\n%s", exon['Start'], fantom['Start'])
             # Filter FANTOM based on strand, chromosome, position, within 10000bp of the capOrTail site
             fantom_filtered = fantom[
                 (fantom['Strand'] == exon['Strand']) &
@@ -111,19 +196,12 @@ def findMatchesFivePrime(human, fantom, longRead, capOrTail):
                 
             # Add the capOrTail/fantom/longRead start & ends to the results
                 if not longRead_filtered.empty:
-                    result = exon.copy()
-                    result['gene_id'] = exon['gene_id']
-                    result['capOrTail_Start'] = capOrTail_site['Start']
-                    result['capOrTail_End'] = capOrTail_site['End']
-                    result['Transcript_Start'] = exon['Start']
-                    result['Transcript_End'] = exon['End']
-                    result['Transcript_Name'] = exon['Name']  # Assuming 'Name' column exists, otherwise default to 'Unknown'
-                    results = pd.concat([results, pd.DataFrame([result])], ignore_index=True)
-    return results
+                    results.append(exon, capOrTail_site)
+    return results.to_frame()
 
-def findMatchesThreePrime(human, fantom, longRead, capOrTail):
-    # Initialize an empty dataframe to store the results
-    results = pd.DataFrame()
+def findMatchesThreePrime(human, fantom, longRead, capOrTail, chunk_size=RESULT_CHUNK_SIZE):
+    # Collect the results in chunks rather than re-concatenating a DataFrame per match
+    results = MatchResults(chunk_size)
     # Ensure no NaN values in critical columns
 
     # Loop over human exons
@@ -136,7 +214,7 @@ def findMatchesThreePrime(human, fantom, longRead, capOrTail):
             
         ]
         # Debug filtered results
-        print(capOrTail['Strand'], capOrTail['Start'], exon['End'])
+        log.debug("%s %s %s", capOrTail['Strand'], capOrTail['Start'], exon['End'])
 
 
         # Loop over filtered capOrTail sites
@@ -170,17 +248,281 @@ def findMatchesThreePrime(human, fantom, longRead, capOrTail):
             # If there are matching transcripts, add them to the results
             if not combined_filtered.empty:
                 for k, transcript in combined_filtered.iterrows():
-                    result = exon.copy()
-                    result['gene_id'] = exon['gene_id']
-                    result['capOrTail_Start'] = capOrTail_site['Start']
-                    result['capOrTail_End'] = capOrTail_site['End']
-                    result['Transcript_Start'] = exon['Start']
-                    result['Transcript_End'] = exon['End']
-                    result['Transcript_Name'] = exon['Name']  # Assuming 'Name' column exists, otherwise default to 'Unknown'
-                    results = pd.concat([results, pd.DataFrame([result])], ignore_index=True)
-    return(results)
+                    results.append(exon, capOrTail_site)
+    return results.to_frame()
+
+# Per direction and strand, how the sweep resolves a chain (mirrors the masks in the loop functions above):
+#   window     - which peak coordinate is searched, which exon edge it is measured from and the bounds
+#                of the window as (offset, searchsorted side) pairs
+#   peak_check - extra peak condition that the window search alone does not cover
+#   anchor     - exon edge that the FANTOM/long read block must share
+#   evidence   - block edge that must reach the peak, the comparison and the peak edge it is compared to
+SWEEP_RULES = {
+    ('fiveprime', '+'): {
+        'window': ('Start', 'Start', (-WINDOW, 'left'), (0, 'left')),
+        'peak_check': ('End', '<', 'Start'),
+        'anchor': 'End',
+        'evidence': ('Start', '<', 'Start'),
+    },
+    ('fiveprime', '-'): {
+        'window': ('End', 'End', (0, 'right'), (WINDOW, 'right')),
+        'peak_check': ('Start', '>', 'End'),
+        'anchor': 'Start',
+        'evidence': ('End', '>', 'End'),
+    },
+    ('threeprime', '+'): {
+        'window': ('Start', 'End', (0, 'right'), (WINDOW, 'right')),
+        'peak_check': None,
+        'anchor': 'Start',
+        'evidence': ('End', '>=', 'Start'),
+    },
+    ('threeprime', '-'): {
+        'window': ('End', 'Start', (-WINDOW, 'left'), (0, 'left')),
+        'peak_check': None,
+        'anchor': 'End',
+        'evidence': ('Start', '<=', 'Start'),
+    },
+}
+
+def _coordinates(df, column):
+    return pd.to_numeric(df[column]).to_numpy(dtype='int64')
+
+def _block_keys(anchors, values):
+    # Pack (anchor, value) into one sortable int64 so a block group and a threshold inside it can be
+    # found with a single searchsorted. Values are biased so malformed negative coordinates still sort.
+    return (anchors << 32) + (values + (1 << 31))
+
+def _count_blocks(block_keys, anchors, thresholds, comparison):
+    # Count the blocks sharing each anchor whose evidence edge satisfies `edge <comparison> threshold`
+    group_lo = np.searchsorted(block_keys, anchors << 32, 'left')
+    group_hi = np.searchsorted(block_keys, (anchors + 1) << 32, 'left')
+    queries = _block_keys(anchors, thresholds)
+    if comparison == '<':
+        return np.searchsorted(block_keys, queries, 'left') - group_lo
+    if comparison == '<=':
+        return np.searchsorted(block_keys, queries, 'right') - group_lo
+    if comparison == '>':
+        return group_hi - np.searchsorted(block_keys, queries, 'right')
+    return group_hi - np.searchsorted(block_keys, queries, 'left')
+
+def _compare(left, comparison, right):
+    if comparison == '<':
+        return left < right
+    if comparison == '>':
+        return left > right
+    if comparison == '<=':
+        return left <= right
+    return left >= right
+
+def _sweep_group(exons, peaks, fantom, longRead, rules):
+    # Resolve every exon -> peak -> FANTOM -> long read chain for one chromosome/strand.
+    # Returns positional indexes into `exons` and `peaks`, one entry per result row.
+    empty = np.empty(0, dtype='int64')
+    if exons.empty or peaks.empty or fantom.empty or longRead.empty:
+        return empty, empty
+
+    peak_col, exon_col, (lo_offset, lo_side), (hi_offset, hi_side) = rules['window']
+    peak_values = _coordinates(peaks, peak_col)
+    peak_order = np.argsort(peak_values, kind='stable')
+    sorted_peaks = peak_values[peak_order]
+
+    # Peaks inside each exon's window, found once against the sorted peak coordinates
+    exon_values = _coordinates(exons, exon_col)
+    lo = np.searchsorted(sorted_peaks, exon_values + lo_offset, lo_side)
+    hi = np.searchsorted(sorted_peaks, exon_values + hi_offset, hi_side)
+    counts = np.maximum(hi - lo, 0)
+    exon_idx = np.repeat(np.arange(len(exons)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    peak_idx = peak_order[np.repeat(lo, counts) + offsets]
+
+    if rules['peak_check'] is not None:
+        check_peak_col, comparison, check_exon_col = rules['peak_check']
+        keep = _compare(_coordinates(peaks, check_peak_col)[peak_idx], comparison,
+                        _coordinates(exons, check_exon_col)[exon_idx])
+        exon_idx = exon_idx[keep]
+        peak_idx = peak_idx[keep]
+
+    anchors = _coordinates(exons, rules['anchor'])[exon_idx]
+    block_col, comparison, threshold_col = rules['evidence']
+    thresholds = _coordinates(peaks, threshold_col)[peak_idx]
+
+    fantom_keys = np.sort(_block_keys(_coordinates(fantom, rules['anchor']), _coordinates(fantom, block_col)))
+    longRead_keys = np.sort(_block_keys(_coordinates(longRead, 'LONGREAD_' + rules['anchor']),
+                                        _coordinates(longRead, 'LONGREAD_' + block_col)))
+    fantom_counts = _count_blocks(fantom_keys, anchors, thresholds, comparison)
+    longRead_counts = _count_blocks(longRead_keys, anchors, thresholds, comparison)
+
+    # The loop emits one row per supporting FANTOM block, as long as any long read also supports the peak
+    repeats = np.where(longRead_counts > 0, fantom_counts, 0)
+    return np.repeat(exon_idx, repeats), np.repeat(peak_idx, repeats)
+
+def findMatchesSweep(human, fantom, longRead, capOrTail, direction):
+    human = human.dropna(subset=['Start', 'End']).reset_index(drop=True)
+    capOrTail = capOrTail.dropna(subset=['Start', 'End']).reset_index(drop=True)
+    fantom = fantom.dropna(subset=['Start', 'End'])
+    longRead = longRead.dropna(subset=['LONGREAD_Start', 'LONGREAD_End'])
+
+    exon_rows = []
+    peak_rows = []
+    peak_groups = capOrTail.groupby(['Chromosome', 'Strand'], sort=False).indices
+    fantom_groups = fantom.groupby(['Chromosome', 'Strand'], sort=False).indices
+    longRead_groups = longRead.groupby(['Chromosome', 'Strand'], sort=False).indices
+    for (chromosome, strand), exon_positions in human.groupby(['Chromosome', 'Strand'], sort=False).indices.items():
+        rules = SWEEP_RULES.get((direction, strand))
+        key = (chromosome, strand)
+        if rules is None or key not in peak_groups or key not in fantom_groups or key not in longRead_groups:
+            continue
+        peak_positions = peak_groups[key]
+        exon_idx, peak_idx = _sweep_group(human.iloc[exon_positions], capOrTail.iloc[peak_positions],
+                                          fantom.iloc[fantom_groups[key]], longRead.iloc[longRead_groups[key]], rules)
+        exon_rows.append(exon_positions[exon_idx])
+        peak_rows.append(peak_positions[peak_idx])
+
+    if not exon_rows or sum(len(rows) for rows in exon_rows) == 0:
+        return pd.DataFrame()
+    exon_rows = np.concatenate(exon_rows)
+    peak_rows = np.concatenate(peak_rows)
+    # Same row order as the loop: exon by exon, then peaks in file order
+    order = np.lexsort((peak_rows, exon_rows))
+    exon_rows = exon_rows[order]
+    peak_rows = peak_rows[order]
+
+    results = human.iloc[exon_rows].reset_index(drop=True)
+    results['capOrTail_Start'] = capOrTail['Start'].to_numpy()[peak_rows]
+    results['capOrTail_End'] = capOrTail['End'].to_numpy()[peak_rows]
+    results['Transcript_Start'] = results['Start']
+    results['Transcript_End'] = results['End']
+    results['Transcript_Name'] = results['Name']
+    return results
+
+PREVIOUS_COLUMNS = ['Chromosome', 'Strand', 'Start', 'End', 'capOrTail_Start', 'capOrTail_End', 'Transcript_Name']
+
+def load_previous(previous):
+    '''
+    The matches of an earlier run in the same direction (the CAT_ALL table, as a path or as the table itself),
+    one transcript's rows per exon.
+    '''
+    if not isinstance(previous, pd.DataFrame):
+        try:
+            previous = read_table(previous)
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame(columns=PREVIOUS_COLUMNS)
+    if previous.empty:
+        return pd.DataFrame(columns=PREVIOUS_COLUMNS)
+    # Concatenated text tables repeat their header line once per chromosome
+    previous = previous[pd.to_numeric(previous['Start'], errors='coerce').notna()]
+    previous = pd.DataFrame({
+        'Chromosome': previous['Chromosome'].astype(str).str.replace('^chr', '', regex=True),
+        'Strand': previous['Strand'].astype(str),
+        'Start': pd.to_numeric(previous['Start']).astype('int64'),
+        'End': pd.to_numeric(previous['End']).astype('int64'),
+        'capOrTail_Start': pd.to_numeric(previous['capOrTail_Start']),
+        'capOrTail_End': pd.to_numeric(previous['capOrTail_End']),
+        'Transcript_Name': previous['Transcript_Name'].astype(str),
+    }).reset_index(drop=True)
+    # Transcripts sharing an exon (e.g. a MANE copy) have the same matches, so keep those of the first
+    first_transcript = previous.groupby(['Chromosome', 'Strand', 'Start', 'End'])['Transcript_Name'].transform('first')
+    return previous[previous['Transcript_Name'] == first_transcript].reset_index(drop=True)
+
+def reuse_matches(human, capOrTail, previous):
+    '''
+    Splits the human exons of one chromosome into those an earlier run already matched and the rest. The
+    matches of an exon only depend on its coordinates, the capOrTail sites and the blocks sharing its splice
+    site, all of which a later run in the same direction gets again, so the earlier rows are rebuilt on the
+    current exon. Returns the rebuilt matches and the exons still to check, both with their '_row' position.
+    '''
+    human = human.assign(_row=np.arange(len(human)))
+    starts = pd.to_numeric(human['Start'])
+    ends = pd.to_numeric(human['End'])
+    keyed = (starts.notna() & ends.notna()).to_numpy()
+    exon_keys = pd.DataFrame({'Strand': human['Strand'].astype(str).to_numpy()[keyed],
+                              'Start': starts.to_numpy()[keyed].astype('int64'),
+                              'End': ends.to_numpy()[keyed].astype('int64'),
+                              '_row': human['_row'].to_numpy()[keyed]})
+    pairs = exon_keys.merge(previous.assign(_peak=np.arange(len(previous))), on=['Strand', 'Start', 'End'])
+    # Exon by exon, then the sites in the order the earlier run found them, as the sweep orders them
+    pairs = pairs.sort_values(['_row', '_peak'], kind='stable')
+
+    reused = human.iloc[pairs['_row'].to_numpy()].reset_index(drop=True)
+    reused['capOrTail_Start'] = pairs['capOrTail_Start'].to_numpy().astype(capOrTail['Start'].dtype)
+    reused['capOrTail_End'] = pairs['capOrTail_End'].to_numpy().astype(capOrTail['End'].dtype)
+    reused['Transcript_Start'] = reused['Start']
+    reused['Transcript_End'] = reused['End']
+    reused['Transcript_Name'] = reused['Name']
+    return reused, human[~human['_row'].isin(pairs['_row']).to_numpy()]
+
+def check_chromosome(human, capOrTail, fantom, longRead, direction, chromosome_value, engine='sweep', previous=None):
+    '''
+    Matches of the prepared tables (see prepare_inputs) on one chromosome. previous (see load_previous) has the
+    matches of an earlier run in the same direction; its exons are not checked again (see reuse_matches).
+    '''
+    # Filter dataframes based on the chromosome value
+    human = human[human['Chromosome'] == chromosome_value]
+    capOrTail = pd.DataFrame(capOrTail.loc[capOrTail['Chromosome'] == chromosome_value, :])  # Ensure capOrTail is a DataFrame
+    fantom = fantom[fantom['Chromosome'] == chromosome_value]
+    longRead = longRead[longRead['Chromosome'] == chromosome_value]
+    if previous is not None:
+        reused, human = reuse_matches(human, capOrTail, previous[previous['Chromosome'] == str(chromosome_value)])
+        log.info("Chromosome %s: %d exons matched by the previous run, %d to check", chromosome_value,
+                 reused['_row'].nunique(), len(human))
+        matches = find_chromosome_matches(human, capOrTail, fantom, longRead, direction, chromosome_value, engine)
+        frames = [frame for frame in (reused, matches) if len(frame)]
+        if not frames:
+            return pd.DataFrame()
+        # Back in the order of the exons, as if they had all been checked
+        return pd.concat(frames).sort_values('_row', kind='stable').drop(columns='_row').reset_index(drop=True)
+    return find_chromosome_matches(human, capOrTail, fantom, longRead, direction, chromosome_value, engine)
+
+def check_shard(human, capOrTail, fantom, longRead, direction, regions, engine='sweep', previous=None):
+    '''
+    Matches of the prepared tables on the regions of one shard (see genomicShards.py), region by region.
+    '''
+    frames = []
+    for contig, start, end in regions:
+        region_tables = [df[region_mask(df.iloc[:, 3], df.iloc[:, 4], start, end)] for df in (human, capOrTail, fantom, longRead)]
+        matches = check_chromosome(*region_tables, direction, contig, engine, previous)
+        if len(matches):
+            frames.append(matches)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def find_chromosome_matches(human, capOrTail, fantom, longRead, direction, chromosome_value, engine):
+    # Determine which function to use based on the direction
+    if direction == 'fiveprime':
+        findMatches = findMatchesFivePrime
+    elif direction == 'threeprime':
+        log.debug("threeprime")
+        findMatches = findMatchesThreePrime
+    else:
+        raise ValueError("Invalid direction argument. Use 'fiveprime' or 'threeprime'.")
+    # Unchanged slices of a chromosome come back from the result cache (see resultCache.py)
+    key = resultCache.result_key('globalTranscriptChecker', [human, capOrTail, fantom, longRead], direction=direction,
+                                 chromosome=str(chromosome_value), window=WINDOW, engine=engine)
+    matches = resultCache.load_result(key)
+    if matches is not None:
+        log.info("Chromosome %s matches from the result cache", chromosome_value)
+        return matches
+    if engine == 'sweep':
+        matches = findMatchesSweep(human, fantom, longRead, capOrTail, direction)
+    else:
+        matches = findMatches(human,fantom, longRead, capOrTail)
+    resultCache.save_result(key, matches)
+    return matches
 
 def main():
+    # --previous <matches> reuses the matches of an earlier run in the same direction
+    previous_file = None
+    if '--previous' in sys.argv:
+        at = sys.argv.index('--previous')
+        previous_file = sys.argv[at + 1]
+        del sys.argv[at:at + 2]
+    # --shards <plan> makes <chromosome> the name of a shard of that plan
+    shards_file = None
+    if '--shards' in sys.argv:
+        at = sys.argv.index('--shards')
+        shards_file = sys.argv[at + 1]
+        del sys.argv[at:at + 2]
     output_file = sys.argv[7]
     chromosome_value = sys.argv[6]
     #chromosome_value = int(chromosome_value)
@@ -190,33 +532,37 @@ def main():
             direction = 'fiveprime'
         elif arg in ['threeprime', '3', "3'"]:
             direction = 'threeprime'
-            print("threeprime")
+            log.debug("threeprime")
         else:
             raise ValueError("Invalid direction argument. Use 'fiveprime', 'threeprime', '5', '3', '5\' or '3\'.")
     else:
         direction = 'fiveprime'  # Default value
-    imported = importGffs(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])
-    human = imported[0]
-    capOrTail = imported[1]
-    fantom = imported[2]
-    longRead = imported[3]
-    # Filter dataframes based on the chromosome value
-    human = human[human['Chromosome'] == chromosome_value]
-    capOrTail = pd.DataFrame(capOrTail.loc[capOrTail['Chromosome'] == chromosome_value, :])  # Ensure capOrTail is a DataFrame
-    fantom = fantom[fantom['Chromosome'] == chromosome_value]
-    longRead = longRead[longRead['Chromosome'] == chromosome_value]
-        # Determine which function to use based on the direction
-    if direction == 'fiveprime':
-        findMatches = findMatchesFivePrime
-    elif direction == 'threeprime':
-        print("threeprime")
-        findMatches = findMatchesThreePrime
-    else:
-        raise ValueError("Invalid direction argument. Use 'fiveprime' or 'threeprime'.")
-    matches = findMatches(human,fantom, longRead, capOrTail)
+    engine = sys.argv[8].lower() if len(sys.argv) > 8 else 'sweep'
+    if engine not in ['sweep', 'loop']:
+        raise ValueError("Invalid engine argument. Use 'sweep' or 'loop'.")
+    previous = load_previous(previous_file) if previous_file else None
+    regions = read_shards(shards_file)[chromosome_value] if shards_file else None
+    metrics = StageMetrics('globalTranscriptChecker', direction=direction, chromosome=chromosome_value)
+    with metrics.phase('load') as phase:
+        imported = importGffs(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4],
+                              None if regions else chromosome_value, sharded=regions is not None)
+        phase.read(*sys.argv[1:5])
+        phase.rows_out = sum(len(df) for df in imported)
+    with metrics.phase('match') as phase:
+        phase.rows_in = len(imported[0])
+        if regions is not None:
+            matches = check_shard(*imported, direction, regions, engine, previous)
+        else:
+            matches = check_chromosome(*imported, direction, chromosome_value, engine, previous)
+        phase.rows_out = len(matches)
 
     output_file = f"{output_file}_matched_chr{chromosome_value}.csv"
-    matches.to_csv(output_file, sep='\t', index=False)
+    with metrics.phase('write') as phase:
+        write_table(matches, output_file)
+        phase.rows_in = len(matches)
+        phase.wrote(output_file)
+    report_peak_rss('globalTranscriptChecker')
+    metrics.write()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -2,6 +2,7 @@
 import re
 import sys
 import pandas as pd
+from stageMetrics import StageMetrics
 
 """
 humanFilter.py
@@ -24,11 +25,13 @@ Steps:
 2. Parse the input GFF file block by block (genes are separated by "###").
 3. For each gene block:
    - Include the block if it contains a protein-coding gene and does not match any readthrough IDs.
+     IDs are matched as whole tokens against a hashed set, so each line is scanned once.
    - Optionally exclude single-exon genes based on the `single_exon` flag.
 4. Write the filtered gene blocks to the output file.
 
 Output:
     - A filtered GFF file containing only the desired protein-coding genes.
+    - A metrics sidecar with the time, memory, lines and bytes of the filter (see stageMetrics.py).
 
 Dependencies:
     - pandas: For reading the readthrough transcript list.
@@ -39,26 +42,49 @@ Example:
     python humanFilter.py input.gff output.gff readthrough.txt true
 """
 
-def load_readthrough_list(readthrough_file):
-    readthrough_df = pd.read_csv(readthrough_file, sep='\t')
-    return set(readthrough_df['stable_id'])
-
-def filter_protein_coding_genes(input_file, output_file, readthrough_file, single_exon):
-    readthrough_ids = load_readthrough_list(readthrough_file)
+# Splits a GFF line into the tokens an ID can be, e.g. "ID=transcript:ENST0001;" -> "ID", "transcript", "ENST0001"
+ID_DELIMITERS = re.compile(r'[\t;=:,"\s]+')
 
-    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
+def load_readthrough_list(readthrough_file):
+    readthrough_df = pd.read_csv(readthrough_file, sep='\t', dtype={'stable_id': str})
+    return set(readthrough_df['stable_id'].dropna())
+
+def has_readthrough_id(line, readthrough_ids):
+    # Hashed lookup of every token in the line (with and without a ".version" suffix),
+    # instead of a substring scan per readthrough ID
+    for token in ID_DELIMITERS.split(line):
+        if token in readthrough_ids or token.partition('.')[0] in readthrough_ids:
+            return True
+    return False
+
+class GeneBlockFilter:
+    '''
+    Keeps the gene blocks of a GFF3 line stream that are protein coding, have no readthrough ID and
+    (with single_exon) more than one exon. filter() yields the kept lines; lines_in and lines_out count
+    the lines seen and kept.
+    '''
+
+    def __init__(self, readthrough_ids, single_exon):
+        self.readthrough_ids = readthrough_ids
+        self.single_exon = single_exon
+        self.lines_in = 0
+        self.lines_out = 0
+
+    def filter(self, lines):
         gene_block = []
         keep_block = False
-        if single_exon == True:
+        if self.single_exon == True:
             exon_count = 0
         else:
             exon_count = 1 
 
-        for line in infile:
+        for line in lines:
+            self.lines_in += 1
             if line.startswith("###"):
                 if keep_block and exon_count > 1:
-                    outfile.write("".join(gene_block))
-                    outfile.write(line)
+                    yield from gene_block
+                    yield line
+                    self.lines_out += len(gene_block) + 1
                 gene_block = []
                 keep_block = False
                 exon_count = 0
@@ -67,7 +93,7 @@ def filter_protein_coding_genes(input_file, output_file, readthrough_file, singl
                 gene_block.append(line)
                 if "biotype=protein_coding" in line:
                     keep_block = True
-                if any(str(readthrough_id) in line for readthrough_id in readthrough_ids):
+                if has_readthrough_id(line, self.readthrough_ids):
                     keep_block = False
                 if "\texon\t" in line:
                     exon_count += 1
@@ -75,7 +101,14 @@ def filter_protein_coding_genes(input_file, output_file, readthrough_file, singl
 
         # Write the last block if it should be kept
         if keep_block and exon_count > 1:
-            outfile.write("".join(gene_block))
+            yield from gene_block
+            self.lines_out += len(gene_block)
+
+def filter_protein_coding_genes(input_file, output_file, readthrough_file, single_exon):
+    gene_filter = GeneBlockFilter(load_readthrough_list(readthrough_file), single_exon)
+    with open(input_file, 'r') as infile, open(output_file, 'w') as outfile:
+        outfile.writelines(gene_filter.filter(infile))
+    return gene_filter.lines_in, gene_filter.lines_out
 
 if __name__ == "__main__":
     if len(sys.argv) != 5:
@@ -91,4 +124,9 @@ if __name__ == "__main__":
         print("Single exon is True")
     else:
         print("Single exon is False")
-    filter_protein_coding_genes(input_file, output_file, readthrough_file, single_exon)
\ No newline at end of file
+    metrics = StageMetrics('humanFilter')
+    with metrics.phase('filter') as phase:
+        phase.rows_in, phase.rows_out = filter_protein_coding_genes(input_file, output_file, readthrough_file, single_exon)
+        phase.read(input_file, readthrough_file)
+        phase.wrote(output_file)
+    metrics.write()
\ No newline at end of file
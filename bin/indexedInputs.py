@@ -0,0 +1,141 @@
+"""
+indexedInputs.py
+
+Helpers shared by the bin scripts for reading only one chromosome or region out of a bgzipped,
+coordinate sorted input (human GFF3, FANTOM GFF, long read GTF/BED, CAGE/polyA peaks) through its
+tabix/CSI index, instead of loading and filtering the whole file.
+
+An input is treated as indexed when it is BGZF compressed (e.g. "human.gff3.gz" written by bgzip).
+If neither "<file>.tbi" nor "<file>.csi" exists, a CSI index is built on first use next to the real
+file a staged symlink points to (not in the task's work directory), so every later job reuses it. If
+that directory is not writable the index has to be built beforehand (tabix -C <file>). Plain text
+inputs are left alone and read as before.
+
+Regions are given as "chr" or "chr:start-end" (1-based, inclusive). A missing or extra "chr" prefix
+is resolved against the contig names in the index.
+
+Dependencies:
+    - pysam (preferred) or the tabix command line tool.
+    - pandas: For turning the fetched lines into DataFrames.
+
+Example:
+    from indexedInputs import is_indexed, read_region
+    if is_indexed('fantom.gff.gz'):
+        fantom = read_region('fantom.gff.gz', '1')
+"""
+import io
+import os
+import subprocess
+
+import pandas as pd
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+BGZF_MAGIC = b'\x1f\x8b\x08\x04'
+
+
+def input_extension(file_path):
+    # File type without any compression suffix, e.g. "gff" for "fantom.gff.gz"
+    parts = os.path.basename(file_path).split('.')
+    if parts[-1] in ['gz', 'bgz'] and len(parts) > 2:
+        return parts[-2]
+    return parts[-1]
+
+
+def is_indexed(file_path):
+    # Only BGZF compressed files can be tabix indexed
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(4) == BGZF_MAGIC
+    except OSError:
+        return False
+
+
+def ensure_index(file_path):
+    # An index staged next to the file (or its symlink) wins, then one next to the real file
+    real_path = os.path.realpath(file_path)
+    for path in dict.fromkeys([file_path, real_path]):
+        for suffix in ['.csi', '.tbi']:
+            if os.path.exists(path + suffix):
+                return path + suffix
+    if not os.access(os.path.dirname(real_path), os.W_OK):
+        raise PermissionError(f"No index found for {file_path} and {os.path.dirname(real_path)} is not writable, "
+                              f"index it beforehand with: tabix -C {real_path}")
+    preset = 'bed' if input_extension(file_path) == 'bed' else 'gff'
+    print(f"No index found for {file_path}, building one at {real_path}.csi")
+    if pysam is not None:
+        pysam.tabix_index(real_path, preset=preset, csi=True, force=True, keep_original=True)
+    else:
+        subprocess.run(['tabix', '-p', preset, '-C', real_path], check=True)
+    return real_path + '.csi'
+
+
+def _tabix_path(file_path):
+    # The index may not sit next to file_path, so name it explicitly for the tabix command line tool
+    return f"{file_path}##idx##{ensure_index(file_path)}"
+
+
+def parse_region(region):
+    # "1" -> ("1", None, None), "1:1000-2000" -> ("1", 1000, 2000)
+    contig, _, span = str(region).partition(':')
+    if not span:
+        return contig, None, None
+    start, _, end = span.replace(',', '').partition('-')
+    return contig, int(start), int(end) if end else None
+
+
+def list_contigs(file_path):
+    index = ensure_index(file_path)
+    if pysam is not None:
+        with pysam.TabixFile(file_path, index=index) as tbx:
+            return list(tbx.contigs)
+    result = subprocess.run(['tabix', '-l', _tabix_path(file_path)], check=True, capture_output=True, text=True)
+    return result.stdout.split()
+
+
+def resolve_contig(contigs, contig):
+    # Match "1" against "chr1" (and the other way round)
+    if contig in contigs:
+        return contig
+    if 'chr' + contig in contigs:
+        return 'chr' + contig
+    if contig.startswith('chr') and contig[3:] in contigs:
+        return contig[3:]
+    return None
+
+
+def fetch_lines(file_path, region):
+    contig, start, end = parse_region(region)
+    contig = resolve_contig(list_contigs(file_path), contig)
+    if contig is None:
+        return []
+    if pysam is not None:
+        with pysam.TabixFile(file_path, index=ensure_index(file_path)) as tbx:
+            return list(tbx.fetch(contig, start - 1 if start else None, end))
+    query = contig if start is None else f"{contig}:{start}-{end if end else ''}"
+    result = subprocess.run(['tabix', _tabix_path(file_path), query], check=True, capture_output=True, text=True)
+    return result.stdout.splitlines()
+
+
+def read_region(file_path, region, n_columns=9, **read_csv_kwargs):
+    # Fetch one chromosome/region into a header-less DataFrame (integer column names like header=None)
+    lines = fetch_lines(file_path, region)
+    if not lines:
+        return pd.DataFrame(columns=range(n_columns))
+    return pd.read_csv(io.StringIO('\n'.join(lines) + '\n'), sep='\t', header=None, **read_csv_kwargs)
+
+
+def filter_region(df, region, chr_col=0, start_col=3, end_col=4):
+    # Same selection as read_region, for inputs that were loaded whole
+    contig, start, end = parse_region(region)
+    if contig.startswith('chr'):
+        contig = contig[3:]
+    mask = df[chr_col].astype(str).str.replace('^chr', '', regex=True) == contig
+    if start is not None:
+        mask &= pd.to_numeric(df[end_col]) >= start
+    if end is not None:
+        mask &= pd.to_numeric(df[start_col]) <= end
+    return df[mask]
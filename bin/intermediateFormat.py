@@ -0,0 +1,233 @@
+"""
+intermediateFormat.py
+
+Optional binary columnar format for the tables the pipeline stages hand to each other
+(grabbedhg38.gff, matched_*_blocks.gff, filtered_matched_human_exons.gff, split_*_{chr}.txt,
+output_*_matched_chr*.csv, *_final.csv).
+
+LEAP_INTERMEDIATE_FORMAT selects what the writers produce:
+    tsv       tab separated text, the default
+    parquet   Parquet, one row group per run of rows on the same chromosome
+    arrow     Arrow IPC (Feather v2) file
+
+File names do not change. Readers look at the first bytes of a file to tell the formats apart, so a
+stage reads whatever the previous stage wrote and the formats can be mixed within one run. Binary
+tables keep their dtypes (categoricals, int32 coordinates) so nothing is re-parsed or re-inferred.
+
+Text files were written with or without a header line and read back with header/skiprows options that
+depend on that. Binary tables record whether a header was written, and read_table applies the same
+header/skiprows options to them so a reader gets the same rows from either format.
+
+Human-facing outputs (the final GFF, statistics) are always written as text.
+
+Dependencies:
+    - pandas
+    - pyarrow (only when a binary format is written or read)
+"""
+import os
+import shutil
+
+import pandas as pd
+
+FORMATS = ['tsv', 'parquet', 'arrow']
+HEADER_KEY = b'leap_header'
+
+
+def intermediate_format():
+    fmt = os.environ.get('LEAP_INTERMEDIATE_FORMAT', 'tsv').lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid LEAP_INTERMEDIATE_FORMAT '{fmt}'. Use one of {', '.join(FORMATS)}.")
+    return fmt
+
+
+def table_format(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            magic = f.read(6)
+    except OSError:
+        return 'tsv'
+    if magic[:4] == b'PAR1':
+        return 'parquet'
+    if magic == b'ARROW1':
+        return 'arrow'
+    return 'tsv'
+
+
+def is_binary(file_path):
+    return table_format(file_path) != 'tsv'
+
+
+def _arrow_table(df, header):
+    import pyarrow as pa
+    # Arrow needs string column names; header=None frames have integer labels
+    table = pa.Table.from_pandas(df.rename(columns=str), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[HEADER_KEY] = b'true' if header is not False else b'false'
+    return table.replace_schema_metadata(metadata)
+
+
+def chromosome_runs(df):
+    # Row ranges of consecutive rows on the same chromosome (first column)
+    if df.empty:
+        return []
+    chromosomes = df.iloc[:, 0].astype(str).to_numpy()
+    breaks = [0] + [i for i in range(1, len(chromosomes)) if chromosomes[i] != chromosomes[i - 1]] + [len(chromosomes)]
+    return list(zip(breaks[:-1], breaks[1:]))
+
+
+def write_table(df, file_path, header=True, fmt=None):
+    fmt = fmt or intermediate_format()
+    if fmt == 'tsv' or len(df.columns) == 0:
+        # Tables without columns (e.g. no matches) stay empty text files in every format
+        df.to_csv(file_path, sep='\t', index=False, header=header)
+        return
+    table = _arrow_table(df, header)
+    if fmt == 'parquet':
+        import pyarrow.parquet as pq
+        with pq.ParquetWriter(file_path, table.schema) as writer:
+            for start, end in chromosome_runs(df) or [(0, 0)]:
+                writer.write_table(table.slice(start, end - start))
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, file_path)
+
+
+def _read_binary(file_path, chromosome=None, columns=None):
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+    if table_format(file_path) == 'parquet':
+        table = pq.read_table(file_path, columns=columns)
+    else:
+        table = feather.read_table(file_path, columns=columns)
+    written_header = (table.schema.metadata or {}).get(HEADER_KEY, b'true') == b'true'
+    df = table.to_pandas()
+    if chromosome is not None and not df.empty:
+        chromosome = str(chromosome)
+        chromosome = chromosome[3:] if chromosome.startswith('chr') else chromosome
+        chromosomes = df.iloc[:, 0].astype(str).str.replace('^chr', '', regex=True)
+        df = df[(chromosomes == chromosome).to_numpy()].reset_index(drop=True)
+    return df, written_header
+
+
+def _apply_text_options(df, written_header, header='infer', skiprows=None, names=None, usecols=None):
+    # Give a binary table the rows and labels pd.read_csv would have given its text version
+    skip = skiprows if isinstance(skiprows, int) else 0
+    header_lines = 1 if written_header else 0
+    if header is None:
+        drop = max(skip - header_lines, 0)
+    elif skip < header_lines:
+        drop = 0
+    else:
+        # The first remaining data row would have been used as the header line
+        drop = skip - header_lines + 1
+    df = df.iloc[drop:].reset_index(drop=True)
+    if names is not None:
+        df.columns = list(names)[:len(df.columns)] + list(df.columns[len(names):])
+    elif header is None or not written_header or skip >= header_lines:
+        df.columns = range(len(df.columns))
+    if usecols is not None:
+        df = df[[col for col in df.columns if col in usecols]]
+    return df
+
+
+def read_table(file_path, header='infer', skiprows=None, names=None, usecols=None, chromosome=None, **read_csv_kwargs):
+    # pd.read_csv(sep='\t') for text tables, or the equivalent rows of a binary table
+    if not is_binary(file_path):
+        df = pd.read_csv(file_path, sep='\t', header=header, skiprows=skiprows, names=names, usecols=usecols, **read_csv_kwargs)
+        return df
+    df, written_header = _read_binary(file_path, chromosome)
+    df = _apply_text_options(df, written_header, header, skiprows, names, usecols)
+    # Other read_csv options only concern parsing text; an explicit dtype is still honoured
+    return _apply_dtype(df, read_csv_kwargs.get('dtype'))
+
+
+def _apply_dtype(df, dtype):
+    if isinstance(dtype, dict):
+        return df.astype({col: col_dtype for col, col_dtype in dtype.items() if col in df.columns})
+    if dtype is not None:
+        return df.astype(dtype)
+    return df
+
+
+def handoff(df, written_header=True, header='infer', skiprows=None, names=None, usecols=None, dtype=None):
+    '''
+    The table read_table(header=..., skiprows=..., ...) gives a later stage for a file written with
+    write_table(df, header=written_header), without the file: the rows and labels a binary table would
+    give. Used when the stages run in one process (see localPipeline.py).
+    '''
+    if len(df.columns) == 0:
+        return df
+    df = _apply_text_options(df.reset_index(drop=True), written_header, header, skiprows, names, usecols)
+    return _apply_dtype(df, dtype)
+
+
+def iter_table_chunks(file_path, chunk_size, header='infer', **read_csv_kwargs):
+    # Chunked reading in either format; binary tables are read one record batch at a time
+    if not is_binary(file_path):
+        yield from pd.read_csv(file_path, sep='\t', header=header, chunksize=chunk_size, **read_csv_kwargs)
+        return
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+    if table_format(file_path) == 'parquet':
+        parquet_file = pq.ParquetFile(file_path)
+        written_header = (parquet_file.schema_arrow.metadata or {}).get(HEADER_KEY, b'true') == b'true'
+        batches = parquet_file.iter_batches(batch_size=chunk_size)
+    else:
+        table = feather.read_table(file_path)
+        written_header = (table.schema.metadata or {}).get(HEADER_KEY, b'true') == b'true'
+        batches = table.to_batches(max_chunksize=chunk_size)
+    for batch in batches:
+        df = batch.to_pandas()
+        if header is None or not written_header:
+            df.columns = range(len(df.columns))
+        yield df
+
+
+class TableAppender:
+    '''
+    Appends DataFrames to several output files, e.g. one per chromosome. Text files are appended to
+    directly; binary files keep one open writer each and every append becomes a row group/batch.
+    Call close() once all rows are written.
+    '''
+
+    def __init__(self, fmt=None):
+        self.fmt = fmt or intermediate_format()
+        self.writers = {}
+
+    def append(self, df, file_path, header=True):
+        if self.fmt == 'tsv':
+            first = file_path not in self.writers
+            df.to_csv(file_path, sep='\t', index=False, mode='w' if first else 'a', header=header and first)
+            self.writers[file_path] = None
+            return
+        table = _arrow_table(df, header)
+        if file_path not in self.writers:
+            if self.fmt == 'parquet':
+                import pyarrow.parquet as pq
+                writer = pq.ParquetWriter(file_path, table.schema)
+            else:
+                import pyarrow as pa
+                writer = pa.ipc.new_file(file_path, table.schema)
+            self.writers[file_path] = (writer, table.schema)
+        writer, schema = self.writers[file_path]
+        # Later chunks may infer slightly different types (e.g. dictionary index widths)
+        writer.write_table(table.cast(schema))
+
+    def close(self):
+        for entry in self.writers.values():
+            if entry is not None:
+                entry[0].close()
+        self.writers = {}
+
+
+def concatenate_tables(input_files, output_file):
+    # CAT_ALL: byte-for-byte concatenation for text, one combined table otherwise
+    if not any(is_binary(file_path) for file_path in input_files):
+        with open(output_file, 'wb') as outfile:
+            for file_path in input_files:
+                with open(file_path, 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile)
+        return
+    # Text inputs among binary ones are the empty placeholders written when a chromosome had no matches
+    frames = [read_table(file_path) for file_path in input_files if is_binary(file_path)]
+    write_table(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(), output_file)
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+localPipeline.py
+
+Runs the workflow of main.nf in a single Python process, for dev boxes and small genomes where starting an
+interpreter per Nextflow task (and re-reading the same annotation and evidence in every one) costs more
+than the work itself:
+    round 1, for fivePrime and threePrime: HUMAN_FILTER, START_OR_END_GRAB, GENERAL_EXON_MATCHER,
+    SPLIT_ALL_CHROMOSOMES, PROCESS_CHROMOSOMES (per chromosome), CAT_ALL, CLEANUP and PREP_NEXT;
+    round 2, for both directions, from the PREP_NEXT output of the other direction, up to CLEANUP.
+
+Every input file is parsed once and shared: the human GFF3 is filtered and the transcripts of both
+directions grabbed in one go, the FANTOM and long read evidence and the capOrTail sites are loaded once
+and reused by both rounds. The tables the stages hand each other stay in memory, given to the next stage
+with the rows and labels it would have read from the file (see intermediateFormat.handoff). The per
+chromosome transcript checks of both directions are fanned out to a process pool sized to the local cores.
+
+Only what the pipeline publishes is written, in the layout PUBLISH_RESULTS and CLEANUP use:
+    <output_dir>/run1/{five,three}_prime/<direction>_nextRun.gff
+    <output_dir>/run2/{five,three}_prime/<id>_modified_extended_transcripts_<direction>_final.csv
+    <output_dir>/cleanup/<id>_extended_transcripts_<direction>_{final.csv,ExtendStats.txt,ExtendStats.json,ExtendPlot.png}
+The results are the same as those of the Nextflow pipeline. A metrics sidecar (see stageMetrics.py) records
+the time, memory, rows and bytes of every stage.
+
+With --incremental, round 2 works like main.nf's --incremental: it matches against the terminal blocks of the
+round 1 evidence and only checks the exons round 1 did not already match in the same direction. Exons round 1
+checked without finding a match are checked again, so the saving is the matched exons, not every unchanged one.
+
+Usage:
+    python localPipeline.py <input_csv> <output_dir> --readthroughs <readthrough_file> [--single-exon true|false]
+                            [--chromosomes 1,2,...] [--workers N] [--engine sweep|loop] [--no-plot] [--incremental]
+
+Example:
+    python localPipeline.py input.csv results --readthroughs readthroughList.txt --workers 8
+"""
+import argparse
+import csv
+import io
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from finalFilterandStats import INPUT_DTYPES, get_prime_label, select_extensions, write_outputs
+from gffLoading import read_gff, report_peak_rss
+from globalExonMatcher import extract_transcript_id_and_exon_number, load_gff, match_exons
+from globalTranscriptChecker import check_chromosome, load_previous, prepare_inputs
+from humanFilter import GeneBlockFilter, load_readthrough_list
+from indexedInputs import input_extension, is_indexed
+from intermediateFormat import handoff
+from prepNext import INPUT_COLUMNS, NEXT_RUN_HEADER, gtf_lines, load_annotation, prep_next
+from splitChromosomes import GFF_EXTENSIONS, split_frames, split_reader
+from startOrEndGrab import GFF_COLUMN_NAMES, grab_transcripts
+from stageMetrics import StageMetrics
+
+# The chromosomes main.nf processes
+CHROMOSOMES = [str(chromosome) for chromosome in range(1, 23)] + ['X', 'Y']
+DIRECTIONS = ['fivePrime', 'threePrime']
+
+
+def read_sample_sheet(input_csv):
+    # One sample per direction, classified on the End column like main.nf does
+    samples = {}
+    with open(input_csv, newline='') as f:
+        for row in csv.DictReader(f):
+            row = {key.strip(): value.strip() for key, value in row.items()}
+            end = row['End'].lower()
+            is_three = 'three' in end or '3prime' in end or end == '3'
+            samples['threePrime' if is_three else 'fivePrime'] = {
+                'id': row['End'], 'human': row['human'], 'capOrTail': row['capOrTail'],
+                'fantom': row['fantom'], 'longRead': row['longRead']}
+    return samples
+
+
+def check_task(human, capOrTail, fantom, longRead, direction, chromosome, engine, previous=None):
+    # PROCESS_CHROMOSOMES for one chromosome, run in a worker process
+    return direction, chromosome, check_chromosome(*prepare_inputs(human, capOrTail, fantom, longRead), direction, chromosome,
+                                                   engine, previous)
+
+
+class LocalPipeline:
+    '''
+    The parsed inputs of one run and the stages that use them. Every input is parsed on first use and kept.
+    '''
+
+    def __init__(self, samples, output_dir, readthrough_file, single_exon=True, chromosomes=CHROMOSOMES,
+                 engine='sweep', plot=True, executor=None, incremental=False):
+        self.samples = samples
+        self.output_dir = output_dir
+        self.readthrough_file = readthrough_file
+        self.single_exon = single_exon
+        self.chromosomes = set(chromosomes)
+        self.chromosome_order = list(chromosomes)
+        self.engine = engine
+        self.plot = plot
+        self.executor = executor
+        self.incremental = incremental
+        self.metrics = StageMetrics('localPipeline')
+        self.grabbed = {}
+        self.evidence = {}
+        self.capOrTails = {}
+        self.annotations = {}
+        # Round 1 terminal block indexes and matches of each direction, for an incremental round 2
+        self.indexes = {}
+        self.previous = {}
+
+    def grab(self, human_file, direction):
+        # HUMAN_FILTER and START_OR_END_GRAB of both directions, once per annotation
+        if human_file not in self.grabbed:
+            with self.metrics.phase('human_filter') as phase:
+                gene_filter = GeneBlockFilter(load_readthrough_list(self.readthrough_file), self.single_exon)
+                with open(human_file) as infile:
+                    filtered = io.StringIO(''.join(gene_filter.filter(infile)))
+                phase.read(human_file, self.readthrough_file)
+                phase.rows_in, phase.rows_out = gene_filter.lines_in, gene_filter.lines_out
+            with self.metrics.phase('start_or_end_grab') as phase:
+                df = read_gff(filtered, names=GFF_COLUMN_NAMES, comment='#', header=None)
+                results = grab_transcripts(df, DIRECTIONS)
+                phase.rows_in = len(df)
+                phase.rows_out = sum(len(result) for result in results.values())
+            # As GENERAL_EXON_MATCHER reads the grabbedhg38.gff tables
+            self.grabbed[human_file] = {name: handoff(result) for name, result in results.items()}
+        return self.grabbed[human_file][direction]
+
+    def load_evidence(self, file_path):
+        if file_path not in self.evidence:
+            with self.metrics.phase('load_evidence') as phase:
+                # The transcript and block number of every block are parsed once for all four matcher runs
+                self.evidence[file_path] = extract_transcript_id_and_exon_number(load_gff(file_path, header=None, comment='#'))
+                phase.read(file_path)
+                phase.rows_out = len(self.evidence[file_path])
+        # The matcher adds columns to the blocks it is given
+        return self.evidence[file_path].copy()
+
+    def load_capOrTail(self, file_path):
+        # The capOrTail sites split by chromosome, and whether SPLIT_ALL_CHROMOSOMES writes them with a header
+        if file_path not in self.capOrTails:
+            with self.metrics.phase('load_evidence') as phase:
+                file_extension = input_extension(file_path)
+                frames = split_frames(split_reader(file_path, self.chromosomes), file_extension, self.chromosomes)
+                written_header = file_extension not in GFF_EXTENSIONS + ['bed'] and not is_indexed(file_path)
+                self.capOrTails[file_path] = (frames, written_header)
+                phase.read(file_path)
+                phase.rows_out = sum(len(frame) for frame in frames.values())
+        return self.capOrTails[file_path]
+
+    def load_annotation(self, file_path):
+        if file_path not in self.annotations:
+            with self.metrics.phase('load_annotation') as phase:
+                self.annotations[file_path] = load_annotation(file_path)
+                phase.read(file_path)
+                phase.rows_out = len(self.annotations[file_path])
+        return self.annotations[file_path]
+
+    def split_direction(self, direction, human_df, round_number=1):
+        '''
+        GENERAL_EXON_MATCHER and SPLIT_ALL_CHROMOSOMES of one direction: the four tables of every chromosome
+        that has data in all of them, as PROCESS_CHROMOSOMES reads them. An incremental round 2 matches against
+        the terminal block indexes of round 1 and has its checks reuse the round 1 matches.
+        '''
+        sample = self.samples[direction]
+        reuse = self.incremental and round_number == 2
+        capOrTail_frames, capOrTail_header = self.load_capOrTail(sample['capOrTail'])
+        if reuse:
+            fantom_df, longread_df = (index.copy() for index in self.indexes[direction])
+        else:
+            fantom_df = self.load_evidence(sample['fantom'])
+            longread_df = self.load_evidence(sample['longRead'])
+        with self.metrics.phase('exon_matcher') as phase:
+            phase.rows_in = len(human_df)
+            outputs = match_exons(human_df.copy(), fantom_df, longread_df, self.single_exon, direction.lower(),
+                                  write_index=self.incremental and not reuse, indexed=reuse)
+            phase.rows_out = len(outputs['filtered_matched_human_exons.gff'])
+        if self.incremental and not reuse:
+            # As GENERAL_EXON_MATCHER writes them, without a header
+            self.indexes[direction] = tuple(handoff(outputs[f"terminal_{name}_blocks.gff"], written_header=False, header=None)
+                                            for name in ['fantom', 'longread'])
+        with self.metrics.phase('split_chromosomes') as phase:
+            # The matched tables are written without a header and split as read with header=None
+            split = {name: split_frames([handoff(outputs[f"{name}.gff"], written_header=False, header=None)], 'gff', self.chromosomes)
+                     for name in ['filtered_matched_human_exons', 'matched_fantom_blocks', 'matched_longread_blocks']}
+            human, fantom, longRead = split.values()
+            phase.rows_out = sum(len(frame) for frames in split.values() for frame in frames.values())
+        tasks = []
+        for chromosome in human:
+            if chromosome in capOrTail_frames and chromosome in fantom and chromosome in longRead:
+                tasks.append((handoff(human[chromosome], written_header=False, skiprows=1),
+                              handoff(capOrTail_frames[chromosome], written_header=capOrTail_header, header=None),
+                              handoff(fantom[chromosome], written_header=False, header=None),
+                              handoff(longRead[chromosome], written_header=False, header=None),
+                              direction.lower(), chromosome, self.engine, self.previous.get(direction) if reuse else None))
+        return tasks
+
+    def check(self, tasks):
+        # PROCESS_CHROMOSOMES of every task, on the pool; the matches of each direction in chromosome order
+        with self.metrics.phase('process_chromosomes') as phase:
+            if self.executor is None:
+                results = [check_task(*task) for task in tasks]
+            else:
+                results = list(self.executor.map(check_task, *zip(*tasks))) if tasks else []
+            matches = {}
+            for direction, chromosome, result in sorted(results, key=lambda result: self.chromosome_order.index(result[1])):
+                matches.setdefault(direction, []).append(result)
+            phase.rows_in = sum(len(task[0]) for task in tasks)
+            phase.rows_out = sum(len(result[2]) for result in results)
+        return matches
+
+    def cleanup(self, direction, sample_id, matches):
+        # CAT_ALL and CLEANUP: the combined matches as finalFilterandStats reads them, and its outputs
+        with self.metrics.phase('cleanup') as phase:
+            frames = []
+            for result in matches:
+                if not len(result.columns):
+                    continue
+                if frames:
+                    # CAT_ALL concatenates the text tables, so every table after the first adds its header
+                    # line as a row; finalFilterandStats drops it, but it turns the site columns to floats
+                    frames.append(pd.DataFrame([list(result.columns)], columns=result.columns))
+                frames.append(handoff(result))
+            combined = handoff(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(), dtype=INPUT_DTYPES)
+            prime_label = get_prime_label(direction)
+            filtered_df, stats = select_extensions(combined, prime_label)
+            cleanup_dir = os.path.join(self.output_dir, 'cleanup')
+            os.makedirs(cleanup_dir, exist_ok=True)
+            written = write_outputs(filtered_df, stats, prime_label, os.path.join(cleanup_dir, f"{sample_id}_extended_transcripts.csv"), self.plot)
+            phase.rows_in = len(combined)
+            phase.rows_out = len(filtered_df)
+            phase.wrote(*written)
+        return filtered_df, written[0]
+
+    def prep_next(self, direction, filtered_df, output_file):
+        '''
+        PREP_NEXT: writes the next run GFF and returns it as GENERAL_EXON_MATCHER reads it in round 2.
+        '''
+        human_file = self.samples[direction]['human']
+        annotation = self.load_annotation(human_file)
+        with self.metrics.phase('prep_next') as phase:
+            exons = prep_next(filtered_df[INPUT_COLUMNS], direction, annotation, source=human_file)
+            text = NEXT_RUN_HEADER + ''.join(gtf_lines(exons))
+            with open(output_file, 'w') as f:
+                f.write(text)
+            next_df = read_gff(io.StringIO(text), header='infer', on_bad_lines='skip')
+            phase.rows_in = len(filtered_df)
+            phase.rows_out = len(next_df)
+            phase.wrote(output_file)
+        return next_df
+
+    def run_round(self, round_number, humans):
+        # Matching and splitting of both directions first, so the checks of both share the pool
+        tasks = []
+        for direction in DIRECTIONS:
+            tasks.extend(self.split_direction(direction, humans[direction], round_number))
+        matches = self.check(tasks)
+        finals = {}
+        for direction in DIRECTIONS:
+            if self.incremental and round_number == 1:
+                # The CAT_ALL table of round 1, as PROCESS_CHROMOSOMES_2 gets it with --previous
+                frames = [result for result in matches.get(direction.lower(), []) if len(result.columns)]
+                self.previous[direction] = load_previous(pd.concat(frames, ignore_index=True) if frames else pd.DataFrame())
+            sample_id = self.samples[direction]['id'] + ('_modified' if round_number == 2 else '')
+            finals[direction] = self.cleanup(direction, sample_id, matches.get(direction.lower(), []))
+            print(f"Round {round_number} {direction}: {len(finals[direction][0])} extended transcripts")
+        return finals
+
+    def run(self):
+        finals_one = self.run_round(1, {direction: self.grab(self.samples[direction]['human'], direction) for direction in DIRECTIONS})
+        next_runs = {}
+        for direction in DIRECTIONS:
+            run_dir = os.path.join(self.output_dir, 'run1', direction.replace('Prime', '_prime'))
+            os.makedirs(run_dir, exist_ok=True)
+            next_runs[direction] = self.prep_next(direction, finals_one[direction][0], os.path.join(run_dir, f"{direction}_nextRun.gff"))
+
+        # Round 2 starts from the transcripts the other direction extended
+        finals_two = self.run_round(2, {direction: next_runs[other] for direction, other in zip(DIRECTIONS, reversed(DIRECTIONS))})
+        published = []
+        for direction in DIRECTIONS:
+            run_dir = os.path.join(self.output_dir, 'run2', direction.replace('Prime', '_prime'))
+            os.makedirs(run_dir, exist_ok=True)
+            published.append(shutil.copy(finals_two[direction][1], run_dir))
+        return published
+
+
+def main(input_csv, output_dir, readthrough_file, single_exon=True, chromosomes=CHROMOSOMES, workers=None,
+         engine='sweep', plot=True, incremental=False):
+    samples = read_sample_sheet(input_csv)
+    missing = [direction for direction in DIRECTIONS if direction not in samples]
+    if missing:
+        raise ValueError(f"{input_csv} has no {' or '.join(missing)} row.")
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        pipeline = LocalPipeline(samples, output_dir, readthrough_file, single_exon, chromosomes, engine, plot, executor, incremental)
+        published = pipeline.run()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for file_path in published:
+        print(f"Written {file_path}")
+    report_peak_rss('localPipeline')
+    pipeline.metrics.write()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run both rounds of the LEAP workflow in one process.')
+    parser.add_argument('input_csv', help='Sample sheet with End, human, capOrTail, fantom and longRead columns (see input.csv)')
+    parser.add_argument('output_dir', help='Directory the run1, run2 and cleanup outputs are written to')
+    parser.add_argument('--readthroughs', required=True, help='List of readthrough transcript stable IDs for humanFilter')
+    parser.add_argument('--single-exon', default='true', help="'true' (the default) leaves out single exon genes and transcripts")
+    parser.add_argument('--chromosomes', default=','.join(CHROMOSOMES), help='Comma separated chromosomes to process (default: 1-22, X, Y)')
+    parser.add_argument('--workers', type=int, default=None, help='Processes for the chromosome checks (default: one per core)')
+    parser.add_argument('--engine', choices=['sweep', 'loop'], default='sweep', help='globalTranscriptChecker matching engine')
+    parser.add_argument('--no-plot', action='store_true', help='Skip the extension histograms (and the matplotlib import)')
+    parser.add_argument('--incremental', action='store_true', help='Round 2 reuses the round 1 evidence indexes and matches')
+    args = parser.parse_args()
+
+    main(args.input_csv, args.output_dir, args.readthroughs, args.single_exon.lower() == 'true', args.chromosomes.split(','),
+         args.workers, args.engine, not args.no_plot, args.incremental)
@@ -1,5 +1,9 @@
+import numpy as np
 import pandas as pd
 import argparse
+from gffLoading import read_gff, report_peak_rss
+from gffAttributes import attribute_value, key_columns, transcript_ids
+from stageMetrics import StageMetrics
 
 """
 makeGFF.py
@@ -10,7 +14,7 @@ attributes based on specific conditions. The resulting GFF file includes extende
 with updated start and end positions, as well as standardized tags.
 
 Usage:
-    python makeGFF.py <file1> <file2> <file3> <file4> <reference_gff> <output_gff> <final_merge_file>
+    python makeGFF.py <file1> <file2> <file3> <file4> <reference_gff> <output_gff> <final_merge_file> [--stream]
 
 Arguments:
     file1               Path to the first input CSV file.
@@ -24,15 +28,24 @@ Arguments:
 Steps:
 1. Load the four input CSV files and merge them based on transcript IDs.
 2. Consolidate overlapping columns in the merged dataframe to create a unified dataset.
-3. Load the reference GFF file and process its rows to:
+3. Load the reference GFF file, group it by transcript once (row ranges, minimum Start and maximum End
+   per transcript) and process its rows with column operations to:
    - Extend transcript start and end positions based on CAGE and PolyA data.
    - Add standardized tags (`gencode_primary`, `gencode_basic`) to all GFF attributes.
    - Add the `MANE_copy` tag to transcripts marked as `MANE_Select`.
 4. Write the processed GFF data to the output file.
 
+With --stream the reference GFF is not loaded. It is read once, line by line, and only the rows of extended
+transcripts are kept (until their gene block ends) and rewritten. Extending a transcript moves its mRNA and
+end exons past rows written before them, so the rewritten rows of a chromosome are held and written sorted
+by start when the chromosome ends; chromosomes keep the reference order. Memory grows with the extended
+rows of one chromosome, and when the reference has no "###" separators the rows of its extended
+transcripts are held until the chromosome ends as well. Without --stream the output follows the merged CSV.
+
 Output:
     - A GFF file with extended transcript information and updated attributes.
     - A merged CSV file for inspection of the consolidated input data.
+    - A metrics sidecar with the merge, load, rewrite and write phases (merge and stream with --stream).
 
 Dependencies:
     - pandas: For data manipulation.
@@ -51,6 +64,8 @@ parser.add_argument("file4", type=str, help="Path to the fourth (threeprime2) in
 parser.add_argument("reference_gff", type=str, help="Path to the reference GFF file")
 parser.add_argument("output_gff", type=str, help="Path to the output GFF file")
 parser.add_argument("final_merge_file", type=str, help="Path to save the final merged dataframe")
+parser.add_argument("--stream", action="store_true",
+                    help="Stream the reference GFF once and write the extended transcripts in reference order")
 args = parser.parse_args()
 
 # Load the four CSV files
@@ -62,19 +77,23 @@ reference_gff = args.reference_gff
 output_gff = args.output_gff
 final_merge_file = args.final_merge_file
 
-df1 = pd.read_csv(file1, sep="\t")
-df2 = pd.read_csv(file2, sep="\t")
-df3 = pd.read_csv(file3, sep="\t")
-df4 = pd.read_csv(file4, sep="\t")
+metrics = StageMetrics('makeGFF')
+with metrics.phase('merge') as phase:
+    df1 = pd.read_csv(file1, sep="\t")
+    df2 = pd.read_csv(file2, sep="\t")
+    df3 = pd.read_csv(file3, sep="\t")
+    df4 = pd.read_csv(file4, sep="\t")
+    phase.read(file1, file2, file3, file4)
+    phase.rows_in = len(df1) + len(df2) + len(df3) + len(df4)
 
-# Merge the first two files on transcript ID
-merged_df1 = pd.merge(df1, df2, left_on="Transcript_Name", right_on="Transcript_Name", how="outer", suffixes=("_fiveprime1", "_threeprime1"))
+    # Merge the first two files on transcript ID
+    merged_df1 = pd.merge(df1, df2, left_on="Transcript_Name", right_on="Transcript_Name", how="outer", suffixes=("_fiveprime1", "_threeprime1"))
 
-# Merge the second two files on transcript ID
-merged_df2 = pd.merge(df3, df4, left_on="Transcript_Name", right_on="Transcript_Name", how="outer", suffixes=("_fiveprime2", "_threeprime2"))
+    # Merge the second two files on transcript ID
+    merged_df2 = pd.merge(df3, df4, left_on="Transcript_Name", right_on="Transcript_Name", how="outer", suffixes=("_fiveprime2", "_threeprime2"))
 
-# Merge the two resulting dataframes on transcript ID
-final_merged_df = pd.merge(merged_df1, merged_df2, on="Transcript_Name", how="outer", suffixes=("_df1", "_df2"))
+    # Merge the two resulting dataframes on transcript ID
+    final_merged_df = pd.merge(merged_df1, merged_df2, on="Transcript_Name", how="outer", suffixes=("_df1", "_df2"))
 # Consolidate columns with similar names
 def consolidate_columns(df, base_columns, exclude_columns=None):
     if exclude_columns is None:
@@ -105,255 +124,227 @@ base_columns = [
 # Consolidate the columns in the final merged dataframe
 # Columns to exclude from consolidation
 exclude_columns = ["capOrTail_Start", "capOrTail_End"]
-final_merged_df = consolidate_columns(final_merged_df, base_columns, exclude_columns)
+with metrics.phase('merge') as phase:
+    final_merged_df = consolidate_columns(final_merged_df, base_columns, exclude_columns)
 
-# Save the final merged dataframe to a file for inspection
-final_merged_df.to_csv(final_merge_file, sep="\t", index=False)
+    # Save the final merged dataframe to a file for inspection
+    final_merged_df.to_csv(final_merge_file, sep="\t", index=False)
+    phase.rows_out = len(final_merged_df)
+    phase.wrote(final_merge_file)
 
 # Load the reference GFF into a DataFrame
 gff_columns = [
     "Chromosome", "Source", "Type", "Start", "End", "Score", "Strand", "Phase", "Attributes"
 ]
-gff_df = pd.read_csv(reference_gff, sep="\t", comment="#", names=gff_columns, header=None)
-
-# Create a list to store the output GFF lines
-output_lines = []
-numberOfTranscripts = 0
-
 # Open the output GFF file in write mode initially to add the header
 with open(output_gff, "w") as gff_file:
     gff_file.write("##gff-version 3\n")
 
-def process_transcripts(merged_df, gff_df):
-    output_lines = []
-    
-
-    # Pre-index the GFF DataFrame by transcript name for faster lookups
-    gff_df["Transcript_Name"] = gff_df["Attributes"].str.extract(r"transcript:([^;]+)")
-    gff_index = gff_df.set_index("Transcript_Name")
-
-    def process_row(row):
-        numberOfTranscripts = 0
-        output = []
-        transcript_name = row["Name"] if not pd.isna(row["Name"]) else row["Name"]
-        is_mane_copy = False
-
-        # Check if the transcript was originally a MANE_copy
-        if "MANE_copy" in transcript_name:
-            is_mane_copy = True
-            transcript_name = transcript_name.rstrip("_MANE_copy")
-
-
-        chromosome = row["Chromosome"]
-
-        # Safely convert chromosome to an integer if possible
-        try:
-            chromosome = int(float(chromosome))  # Handles cases where it's a float
-        except (ValueError, TypeError):
-            pass  # Leave it as is if it can't be converted
-
-        strand = row["Strand"]
-
-        # Retrieve GFF rows for the transcript
-        if transcript_name in gff_index.index:
-            transcript_gff = gff_index.loc[[transcript_name]]
-        else:
+def add_tags(attributes, is_mrna):
+    # Add MANE_copy tag if applicable
+    if "tag=" in attributes:
+        tags = attributes.split("tag=")[1].split(";")[0].split(",")
+        if is_mrna and "MANE_Select" in tags:
+            if "MANE_copy" not in tags:
+                tags.append("MANE_copy")
+            if "LEAP" not in tags:
+                tags.append("LEAP")
+        if "gencode_primary" not in tags:
+            tags.extend(["gencode_primary", "gencode_basic"])
+        if "LEAP" not in tags:
+            tags.append("LEAP")
+        attributes = attributes.split("tag=")[0] + "tag=" + ",".join(tags) + ";" + ";".join(attributes.split("tag=")[1].split(";")[1:])
+    return attributes
+
+def output_chromosome(chromosome):
+    # Safely convert chromosome to an integer if possible
+    try:
+        return str(int(float(chromosome)))  # Handles cases where it's a float
+    except (ValueError, TypeError):
+        return str(chromosome)  # Leave it as is if it can't be converted
+
+def transcript_bounds(gff_df, reference_gff=None):
+    '''
+    Groups the reference GFF by transcript once. Returns the rows sorted by transcript (file order within
+    a transcript) and, per transcript, the row range in that frame, its minimum Start and maximum End.
+    '''
+    gff_df = gff_df.assign(Transcript_Name=transcript_ids(key_columns(gff_df["Attributes"], source=reference_gff)))
+    gff_df = gff_df.dropna(subset=["Transcript_Name"]).sort_values("Transcript_Name", kind="stable").reset_index(drop=True)
+    grouped = gff_df.groupby("Transcript_Name", sort=True)
+    bounds = pd.DataFrame({"count": grouped.size(), "min_start": grouped["Start"].min(), "max_end": grouped["End"].max()})
+    bounds["first_row"] = bounds["count"].cumsum() - bounds["count"]
+    return gff_df, bounds
+
+def extension_coordinates(merged_df, bounds):
+    '''
+    Extended start and end of every transcript in merged_df. CAGE/polyA coordinates come from the first
+    run, then the second run, and fall back on the reference transcript bounds.
+    '''
+    cage_start = merged_df["capOrTail_Start_fiveprime1"].fillna(merged_df["capOrTail_Start_fiveprime2"])
+    cage_end = merged_df["capOrTail_End_fiveprime1"].fillna(merged_df["capOrTail_End_fiveprime2"])
+    polya_start = merged_df["capOrTail_Start_threeprime1"].fillna(merged_df["capOrTail_Start_threeprime2"])
+    polya_end = merged_df["capOrTail_End_threeprime1"].fillna(merged_df["capOrTail_End_threeprime2"])
+    plus_strand = (merged_df["Strand"] == "+").to_numpy()
+    extended_start = pd.Series(np.where(plus_strand, cage_start, polya_start), index=merged_df.index)
+    extended_end = pd.Series(np.where(plus_strand, polya_end, cage_end), index=merged_df.index)
+    extended_start = extended_start.fillna(pd.Series(bounds["min_start"].to_numpy(), index=merged_df.index))
+    extended_end = extended_end.fillna(pd.Series(bounds["max_end"].to_numpy(), index=merged_df.index))
+    return extended_start.astype("int64"), extended_end.astype("int64")
+
+def extension_table(merged_df):
+    '''
+    The merged rows with the reference transcript name of each (without "_MANE_copy"), dropping rows
+    without a strand.
+    '''
+    transcript_names = merged_df["Name"].astype(str)
+    # Check if the transcript was originally a MANE_copy
+    is_mane_copy = transcript_names.str.contains("MANE_copy", regex=False)
+    merged_df = merged_df.assign(reference_name=transcript_names.where(~is_mane_copy, transcript_names.str.rstrip("_MANE_copy")))
+    valid_strand = merged_df["Strand"].isin(["+", "-"])
+    for transcript_name in merged_df.loc[~valid_strand, "reference_name"]:
+        print(transcript_name, "has no strand, skipped")
+    return merged_df[valid_strand]
+
+def rewrite_rows(rows, transcripts, bounds, transcript_rows):
+    '''
+    Output lines for the reference rows of extended transcripts. transcript_rows gives, for every row, the
+    position of its transcript in transcripts (the merged rows) and bounds (its minimum Start and maximum End).
+    '''
+    extended_start, extended_end = extension_coordinates(transcripts, bounds)
+
+    # Per transcript values, repeated for each of its rows
+    strand = transcripts["Strand"].to_numpy()[transcript_rows]
+    plus_strand = strand == "+"
+    chromosome = np.array([output_chromosome(chromosome) for chromosome in transcripts["Chromosome"]], dtype=object)[transcript_rows]
+    min_start = bounds["min_start"].to_numpy()[transcript_rows]
+    max_end = bounds["max_end"].to_numpy()[transcript_rows]
+    new_start = extended_start.to_numpy()[transcript_rows]
+    new_end = extended_end.to_numpy()[transcript_rows]
+
+    # Boundary rows take the extended coordinates: the mRNA always, exons at either end and the UTR
+    # at the 5' or 3' end of the transcript
+    gff_type = rows["Type"].astype(str).to_numpy()
+    is_mrna = gff_type == "mRNA"
+    extend_start = is_mrna | ((rows["Start"].to_numpy() == min_start) & (
+        (gff_type == "exon") | ((gff_type == "five_prime_UTR") & plus_strand) | ((gff_type == "three_prime_UTR") & ~plus_strand)))
+    extend_end = is_mrna | ((rows["End"].to_numpy() == max_end) & (
+        (gff_type == "exon") | ((gff_type == "five_prime_UTR") & ~plus_strand) | ((gff_type == "three_prime_UTR") & plus_strand)))
+    start = pd.Series(rows["Start"].to_numpy(dtype="int64")).where(~extend_start, new_start)
+    end = pd.Series(rows["End"].to_numpy(dtype="int64")).where(~extend_end, new_end)
+
+    attributes = [add_tags(attributes, mrna) for attributes, mrna in zip(rows["Attributes"].astype(str), is_mrna)]
+
+    # Format all lines at once
+    lines = (pd.Series(chromosome) + "\t" + rows["Source"].astype(str).reset_index(drop=True) + "\t" + pd.Series(gff_type) + "\t"
+             + start.astype(str) + "\t" + end.astype(str) + "\t.\t" + pd.Series(strand) + "\t.\t"
+             + pd.Series(attributes, dtype=object) + "\n")
+    return lines.tolist()
+
+def process_transcripts(merged_df, gff_df, reference_gff=None):
+    '''
+    Rewrites the reference rows of every transcript in merged_df with its extended ends and returns the
+    output GFF lines, in merged_df order. The per-transcript bounds are computed once and the boundary
+    exon/UTR coordinates are replaced with column operations.
+    '''
+    sorted_gff, bounds = transcript_bounds(gff_df, reference_gff)
+    merged_df = extension_table(merged_df)
+
+    transcript_index = bounds.index.get_indexer(merged_df["reference_name"])
+    for transcript_name in merged_df["reference_name"][transcript_index < 0]:
+        print(transcript_name, "not found in GFF")
+    merged_df = merged_df[transcript_index >= 0]
+    transcript_bounds_df = bounds.iloc[transcript_index[transcript_index >= 0]]
+
+    # Row ranges of the reference rows of every transcript, in merged_df order
+    counts = transcript_bounds_df["count"].to_numpy()
+    offsets = np.repeat(transcript_bounds_df["first_row"].to_numpy() - (np.cumsum(counts) - counts), counts)
+    rows = sorted_gff.iloc[offsets + np.arange(counts.sum())].reset_index(drop=True)
+
+    print("processed transcripts: ", len(merged_df))
+    return rewrite_rows(rows, merged_df, transcript_bounds_df, np.repeat(np.arange(len(merged_df)), counts))
+
+def stream_transcripts(merged_df, reference_gff, output_file):
+    '''
+    Streams the reference GFF once and appends the rewritten rows of the extended transcripts to
+    output_file, chromosome by chromosome in reference order and sorted by start within a chromosome.
+    Rows of extended transcripts are held until their gene block ends ("###") or the chromosome changes,
+    when the bounds of their transcripts are known; the rewritten rows are held until the chromosome
+    changes. Memory is bounded by the extended rows of one chromosome, not the annotation.
+    A transcript listed twice in merged_df is written once.
+    '''
+    extensions = extension_table(merged_df).drop_duplicates("reference_name").set_index("reference_name", drop=False)
+    block = []
+    chromosome_lines = []
+    seen = set()
+
+    def flush():
+        if not block:
+            return
+        rows = pd.DataFrame(block, columns=gff_columns + ["Transcript_Name"])
+        rows["Start"] = rows["Start"].astype("int64")
+        rows["End"] = rows["End"].astype("int64")
+        grouped = rows.groupby("Transcript_Name", sort=False)
+        bounds = pd.DataFrame({"min_start": grouped["Start"].min(), "max_end": grouped["End"].max()})
+        transcripts = extensions.loc[bounds.index]
+        chromosome_lines.extend(rewrite_rows(rows, transcripts, bounds, bounds.index.get_indexer(rows["Transcript_Name"])))
+        seen.update(bounds.index)
+        block.clear()
+
+    def write_chromosome(out):
+        # Extended starts can move upstream of earlier rows, so sort on the rewritten start (stable)
+        flush()
+        chromosome_lines.sort(key=lambda line: int(line.split("\t", 4)[3]))
+        out.writelines(chromosome_lines)
+        chromosome_lines.clear()
+
+    current_seqid = None
+    with open(reference_gff) as infile, open(output_file, "a") as out:
+        for line in infile:
+            if line.startswith("#"):
+                if line.startswith("###"):
+                    flush()
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9:
+                continue
+            if fields[0] != current_seqid:
+                write_chromosome(out)
+                current_seqid = fields[0]
+            transcript_name = attribute_value(fields[8], "ID", "transcript") or attribute_value(fields[8], "Parent", "transcript")
+            if transcript_name in extensions.index:
+                block.append(fields[:9] + [transcript_name])
+        write_chromosome(out)
+
+    for transcript_name in extensions.index:
+        if transcript_name not in seen:
             print(transcript_name, "not found in GFF")
-            return output  # Skip if no matching GFF rows
-
-        # Get the minimum and maximum Start and End from the GFF file
-        gff_start = transcript_gff["Start"].min()
-        gff_end = transcript_gff["End"].max()
-
-        # Determine cage and polya values
-        # Determine capOrTail (CAGE and PolyA) values for fiveprime and threeprime
-        if strand == "+":
-            # For fiveprime (CAGE)
-            cage_start = (
-                int(row["capOrTail_Start_fiveprime1"])
-                if not pd.isna(row["capOrTail_Start_fiveprime1"])
-                else (
-                    int(row["capOrTail_Start_fiveprime2"])
-                    if not pd.isna(row["capOrTail_Start_fiveprime2"])
-                    else gff_start
-                )
-            )
-            cage_end = (
-                int(row["capOrTail_End_fiveprime1"])
-                if not pd.isna(row["capOrTail_End_fiveprime1"])
-                else (
-                    int(row["capOrTail_End_fiveprime2"])
-                    if not pd.isna(row["capOrTail_End_fiveprime2"])
-                    else gff_start
-                )
-            )
-
-            # For threeprime (PolyA)
-            polya_start = (
-                int(row["capOrTail_Start_threeprime1"])
-                if not pd.isna(row["capOrTail_Start_threeprime1"])
-                else (
-                    int(row["capOrTail_Start_threeprime2"])
-                    if not pd.isna(row["capOrTail_Start_threeprime2"])
-                    else gff_end
-                )
-            )
-            polya_end = (
-                int(row["capOrTail_End_threeprime1"])
-                if not pd.isna(row["capOrTail_End_threeprime1"])
-                else (
-                    int(row["capOrTail_End_threeprime2"])
-                    if not pd.isna(row["capOrTail_End_threeprime2"])
-                    else gff_end
-                )
-            )
-        elif strand == "-":
-            # For fiveprime (CAGE)
-            cage_start = (
-                int(row["capOrTail_End_fiveprime1"])
-                if not pd.isna(row["capOrTail_End_fiveprime1"])
-                else (
-                    int(row["capOrTail_End_fiveprime2"])
-                    if not pd.isna(row["capOrTail_End_fiveprime2"])
-                    else gff_end
-                )
-            )
-            cage_end = (
-                int(row["capOrTail_End_fiveprime1"])
-                if not pd.isna(row["capOrTail_End_fiveprime1"])
-                else (
-                    int(row["capOrTail_End_fiveprime2"])
-                    if not pd.isna(row["capOrTail_End_fiveprime2"])
-                    else gff_end
-                )
-            )
-
-            # For threeprime (PolyA)
-            polya_start = (
-                int(row["capOrTail_Start_threeprime1"])
-                if not pd.isna(row["capOrTail_Start_threeprime1"])
-                else (
-                    int(row["capOrTail_Start_threeprime2"])
-                    if not pd.isna(row["capOrTail_Start_threeprime2"])
-                    else gff_start
-                )
-            )
-            polya_end = (
-                int(row["capOrTail_End_threeprime1"])
-                if not pd.isna(row["capOrTail_End_threeprime1"])
-                else (
-                    int(row["capOrTail_End_threeprime2"])
-                    if not pd.isna(row["capOrTail_End_threeprime2"])
-                    else gff_start
-                )
-            )
-
-        # Determine extended start and end
-        if strand == "+":
-            extended_start = cage_start
-            extended_end = polya_end
-        elif strand == "-":
-            extended_start = polya_start
-            extended_end = cage_end
-
-        # Process GFF rows
-        for _, gff_row in transcript_gff.iterrows():
-            gff_type = gff_row["Type"]
-            gff_start = gff_row["Start"]
-            gff_end = gff_row["End"]
-            gff_attributes = gff_row["Attributes"]
-
-            # Add MANE_copy tag if applicable
-            if "tag=" in gff_attributes:
-                tags = gff_attributes.split("tag=")[1].split(";")[0].split(",")
-                if gff_type == "mRNA" and "MANE_Select" in tags:
-                    if "MANE_copy" not in tags:
-                        tags.append("MANE_copy")
-                    if "LEAP" not in tags:
-                        tags.append("LEAP")
-                if "gencode_primary" not in tags:
-                    tags.extend(["gencode_primary", "gencode_basic"])
-                if "LEAP" not in tags:
-                    tags.append("LEAP")
-                gff_attributes = gff_attributes.split("tag=")[0] + "tag=" + ",".join(tags) + ";" + ";".join(gff_attributes.split("tag=")[1].split(";")[1:])
-
-            if gff_type == "mRNA":
-                output.append(
-                    f"{chromosome}\t{gff_row['Source']}\tmRNA\t{extended_start}\t{extended_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                )
-            elif gff_type == "five_prime_UTR":
-                if strand == "+":
-                    if gff_start == transcript_gff["Start"].min():
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tfive_prime_UTR\t{extended_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                    else:
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tfive_prime_UTR\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                else:
-                    if gff_end == transcript_gff["End"].max():
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tfive_prime_UTR\t{gff_start}\t{extended_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                    else:
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tfive_prime_UTR\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-            elif gff_type == "three_prime_UTR":
-                if strand == "+":
-                    if gff_end == transcript_gff["End"].max():
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tthree_prime_UTR\t{gff_start}\t{extended_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                    else:
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tthree_prime_UTR\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                else:
-                    if gff_start == transcript_gff["Start"].min():
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tthree_prime_UTR\t{extended_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-                    else:
-                        output.append(
-                            f"{chromosome}\t{gff_row['Source']}\tthree_prime_UTR\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                        )
-            elif gff_type == "exon":
-                if strand == "+":
-                    if gff_start == transcript_gff["Start"].min():
-                        gff_start = extended_start
-                    if gff_end == transcript_gff["End"].max():
-                        gff_end = extended_end
-                elif strand == "-":
-                    if gff_end == transcript_gff["End"].max():
-                        gff_end = extended_end
-                    if gff_start == transcript_gff["Start"].min():
-                        gff_start = extended_start
-
-                output.append(
-                    f"{chromosome}\t{gff_row['Source']}\texon\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                )
-            else:
-                output.append(
-                    f"{chromosome}\t{gff_row['Source']}\t{gff_type}\t{gff_start}\t{gff_end}\t.\t{strand}\t.\t{gff_attributes}\n"
-                )
-
-        numberOfTranscripts += 1
-        print("processed transcript: ", numberOfTranscripts)
-        return output
-
-    # Use apply to process rows in a vectorized manner
-    merged_df.apply(lambda row: output_lines.extend(process_row(row)), axis=1)
-
-    return output_lines
+    print("processed transcripts: ", len(seen))
 
 if __name__ == "__main__":
-    # Process transcripts and generate output lines
-    output_lines = process_transcripts(final_merged_df, gff_df)
-
-    # Write all lines to the output file at once
-    with open(output_gff, "a") as gff_file:
-        gff_file.writelines(output_lines)
-
-    print(f"Extended GFF file created: {output_gff}")
\ No newline at end of file
+    if args.stream:
+        with metrics.phase('stream') as phase:
+            stream_transcripts(final_merged_df, reference_gff, output_gff)
+            phase.rows_in = len(final_merged_df)
+            phase.read(reference_gff)
+            phase.wrote(output_gff)
+    else:
+        with metrics.phase('load') as phase:
+            gff_df = read_gff(reference_gff, comment="#", names=gff_columns, header=None)
+            phase.read(reference_gff)
+            phase.rows_out = len(gff_df)
+        with metrics.phase('rewrite') as phase:
+            # Process transcripts and generate output lines
+            output_lines = process_transcripts(final_merged_df, gff_df, reference_gff)
+            phase.rows_in = len(final_merged_df)
+            phase.rows_out = len(output_lines)
+
+        with metrics.phase('write') as phase:
+            # Write all lines to the output file at once
+            with open(output_gff, "a") as gff_file:
+                gff_file.writelines(output_lines)
+            phase.rows_in = len(output_lines)
+            phase.wrote(output_gff)
+
+    print(f"Extended GFF file created: {output_gff}")
+    report_peak_rss('makeGFF')
+    metrics.write()
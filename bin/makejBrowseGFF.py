@@ -1,4 +1,309 @@
-sed -i 's/Parent=gene:ENSG[0-9]*;//g' /nfs/production/flicek/ensembl/havana/lucascortes/LEAP/synchronise/testFurther.gff
-gff3sort $file > $file_sorted
-bgzip $file
-tabix $file
\ No newline at end of file
+#!/usr/bin/env python3
+import argparse
+import heapq
+import os
+import re
+import struct
+import tempfile
+import zlib
+
+"""
+makejBrowseGFF.py
+
+Prepares the GFF written by makeGFF.py for a genome browser (e.g. JBrowse) in one step: the gene parent
+links are removed, the records are sorted by chromosome and start, and the result is written BGZF
+compressed together with its tabix (.tbi) or CSI (.csi) index.
+
+This replaces running sed, gff3sort, bgzip and tabix by hand:
+    sed -i 's/Parent=gene:ENSG[0-9]*;//g' <file>
+    gff3sort <file> > <file_sorted>
+    bgzip <file_sorted>
+    tabix <file_sorted>.gz
+
+Usage:
+    python makejBrowseGFF.py <input_gff> <output_gff_gz> [--csi] [--chunk-lines N]
+
+Arguments:
+    input_gff           GFF written by makeGFF.py.
+    output_gff_gz       BGZF compressed, sorted output. The index is written next to it.
+    --csi               Write a CSI index instead of a tabix index (needed for chromosomes over 512 Mb, the
+                        index gets as many levels as the largest end coordinate needs).
+    --chunk-lines       Lines sorted in memory at a time (default CHUNK_LINES).
+
+Steps:
+1. Stream the input, drop "Parent=gene:ENSG...;" from the attributes and cut it into sorted runs of
+   --chunk-lines lines written to temporary files, so memory is bounded by the run size.
+2. Merge the runs. Chromosomes are kept in the order they first appear (the reference order for the
+   output of makeGFF.py --stream) and records are sorted by start within a chromosome. The sort is
+   stable, so an mRNA stays before the exons that start at the same position.
+3. Write the merged records as BGZF blocks, recording the virtual offset of every record, and write
+   the index from those offsets once the last block is written. The file is read and written once.
+
+Dependencies:
+    - Python standard library only. The output can be read with tabix, pysam or any htslib tool.
+
+Example:
+    python makejBrowseGFF.py LEAP_extended.gff LEAP_extended.sorted.gff3.gz
+"""
+
+# Lines sorted in memory per run
+CHUNK_LINES = 1000000
+GENE_PARENT = re.compile(r'Parent=gene:ENSG[0-9]*;')
+
+# Uncompressed bytes per BGZF block, as written by bgzip
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+# Tabix header for GFF: generic format, sequence/start/end in columns 1/4/5 and "#" comment lines
+TABIX_GFF_PRESET = (0, 1, 4, 5, ord('#'), 0)
+TABIX_MIN_SHIFT = 14
+TABIX_DEPTH = 5
+# Tabix indexes cover positions below 2^29 (512 Mb)
+TABIX_MAX_LENGTH = 1 << (TABIX_MIN_SHIFT + 3 * TABIX_DEPTH)
+
+
+def sorted_runs(input_file, run_dir, chunk_lines=CHUNK_LINES):
+    # Cut the input into sorted runs; returns the run files, the header lines, the chromosome order and the
+    # largest end coordinate
+    runs = []
+    headers = []
+    contigs = {}
+    chunk = []
+    max_end = 0
+
+    def write_run():
+        chunk.sort(key=lambda record: record[0])
+        run_file = os.path.join(run_dir, f"run_{len(runs)}.gff")
+        with open(run_file, 'w') as out:
+            out.writelines(line for _, line in chunk)
+        runs.append(run_file)
+        chunk.clear()
+
+    with open(input_file) as infile:
+        for line in infile:
+            if line.startswith('#'):
+                if line.startswith('##gff-version'):
+                    headers.append(line)
+                continue
+            if not line.strip():
+                continue
+            line = GENE_PARENT.sub('', line)
+            if not line.endswith('\n'):
+                line += '\n'
+            seqid, _, _, start, end, _ = line.split('\t', 5)
+            rank = contigs.setdefault(seqid, len(contigs))
+            chunk.append(((rank, int(start)), line))
+            max_end = max(max_end, int(end))
+            if len(chunk) >= chunk_lines:
+                write_run()
+    if chunk:
+        write_run()
+    return runs, headers, contigs, max_end
+
+
+def merge_runs(runs, contigs):
+    # k-way merge of the sorted runs; heapq.merge keeps equal keys in run order, so the sort stays stable
+    def records(run_file):
+        with open(run_file) as infile:
+            for line in infile:
+                seqid, _, _, start, _ = line.split('\t', 4)
+                yield (contigs[seqid], int(start)), line
+
+    for _, line in heapq.merge(*(records(run_file) for run_file in runs), key=lambda record: record[0]):
+        yield line
+
+
+def reg2bin(beg, end, min_shift=TABIX_MIN_SHIFT, depth=TABIX_DEPTH):
+    # Smallest bin containing [beg, end), for the binning scheme shared by tabix and CSI
+    end -= 1
+    level_size = ((1 << (3 * depth)) - 1) // 7
+    shift = min_shift
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return level_size + (beg >> shift)
+        shift += 3
+        level_size -= 1 << (3 * (level - 1))
+    return 0
+
+
+def csi_depth(max_end, min_shift=TABIX_MIN_SHIFT):
+    # Levels a CSI index needs for positions up to max_end, raised from the tabix depth as htslib does
+    depth = TABIX_DEPTH
+    while 1 << (min_shift + 3 * depth) <= max_end:
+        depth += 1
+    return depth
+
+
+def bin_first_window(bin_number, min_shift=TABIX_MIN_SHIFT, depth=TABIX_DEPTH):
+    # First linear index window (of 1 << min_shift bases) covered by a bin
+    level, first_bin = 0, 0
+    while bin_number >= first_bin + (1 << (3 * level)):
+        first_bin += 1 << (3 * level)
+        level += 1
+    return (bin_number - first_bin) << (3 * (depth - level))
+
+
+class BgzfWriter:
+    '''
+    Writes BGZF blocks and reports virtual offsets ((compressed offset << 16) | offset in block),
+    which is what a tabix/CSI index points at.
+    '''
+
+    def __init__(self, file_path, level=6):
+        self.handle = open(file_path, 'wb')
+        self.level = level
+        self.buffer = bytearray()
+        self.compressed_offset = 0
+
+    def tell(self):
+        return (self.compressed_offset << 16) | len(self.buffer)
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BGZF_BLOCK_SIZE]))
+            del self.buffer[:BGZF_BLOCK_SIZE]
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        deflated = compressor.compress(data) + compressor.flush()
+        if len(deflated) + 26 > 65536:
+            # Incompressible data; stored deflate blocks always fit
+            compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+            deflated = compressor.compress(data) + compressor.flush()
+        block_size = len(deflated) + 26
+        self.handle.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00')
+        self.handle.write(struct.pack('<H', block_size - 1))
+        self.handle.write(deflated)
+        self.handle.write(struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data)))
+        self.compressed_offset += block_size
+
+    def close(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+
+
+class IndexBuilder:
+    '''
+    Collects the bins, chunks and linear index of a coordinate sorted BGZF file record by record and
+    writes them as a tabix (.tbi) or CSI (.csi) index.
+    '''
+
+    def __init__(self, min_shift=TABIX_MIN_SHIFT, depth=TABIX_DEPTH):
+        self.min_shift = min_shift
+        self.depth = depth
+        self.names = []
+        self.references = []
+
+    def add(self, seqid, beg, end, start_offset, end_offset):
+        if end > 1 << (self.min_shift + 3 * self.depth):
+            raise ValueError(f"{seqid}:{end} is beyond the {1 << (self.min_shift + 3 * self.depth)} bp an index of "
+                             f"depth {self.depth} covers" + ('' if self.depth > TABIX_DEPTH else ', use --csi'))
+        if not self.names or self.names[-1] != seqid:
+            if seqid in self.names:
+                raise ValueError(f"Records of {seqid} are not contiguous, the file is not sorted")
+            self.names.append(seqid)
+            self.references.append(({}, []))
+        bins, linear = self.references[-1]
+        chunks = bins.setdefault(reg2bin(beg, end, self.min_shift, self.depth), [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+        last_window = (end - 1) >> self.min_shift
+        if len(linear) <= last_window:
+            linear.extend([None] * (last_window + 1 - len(linear)))
+        for window in range(beg >> self.min_shift, last_window + 1):
+            if linear[window] is None:
+                linear[window] = start_offset
+
+    def _filled_linear(self, linear):
+        # Windows without records point at the previous window's first record
+        filled, previous = [], 0
+        for offset in linear:
+            previous = offset if offset is not None else previous
+            filled.append(previous)
+        return filled
+
+    def _tabix_header(self):
+        names = b''.join(name.encode() + b'\x00' for name in self.names)
+        return struct.pack('<6i', *TABIX_GFF_PRESET) + struct.pack('<i', len(names)) + names
+
+    def tabix_bytes(self):
+        data = bytearray(b'TBI\x01' + struct.pack('<i', len(self.names)) + self._tabix_header())
+        for bins, linear in self.references:
+            data += struct.pack('<i', len(bins))
+            for bin_number, chunks in sorted(bins.items()):
+                data += struct.pack('<Ii', bin_number, len(chunks))
+                for start_offset, end_offset in chunks:
+                    data += struct.pack('<QQ', start_offset, end_offset)
+            filled = self._filled_linear(linear)
+            data += struct.pack('<i', len(filled)) + struct.pack(f'<{len(filled)}Q', *filled)
+        return bytes(data)
+
+    def csi_bytes(self):
+        aux = self._tabix_header()
+        data = bytearray(b'CSI\x01' + struct.pack('<iii', self.min_shift, self.depth, len(aux)) + aux)
+        data += struct.pack('<i', len(self.names))
+        for bins, linear in self.references:
+            filled = self._filled_linear(linear)
+            data += struct.pack('<i', len(bins))
+            for bin_number, chunks in sorted(bins.items()):
+                window = bin_first_window(bin_number, self.min_shift, self.depth)
+                loffset = filled[window] if window < len(filled) else (filled[-1] if filled else 0)
+                data += struct.pack('<IQi', bin_number, loffset, len(chunks))
+                for start_offset, end_offset in chunks:
+                    data += struct.pack('<QQ', start_offset, end_offset)
+        return bytes(data)
+
+    def write(self, index_file, csi=False):
+        writer = BgzfWriter(index_file)
+        writer.write(self.csi_bytes() if csi else self.tabix_bytes())
+        writer.close()
+
+
+def write_indexed_gff(lines, headers, output_file, csi=False, depth=TABIX_DEPTH):
+    # Compress and index in the same pass over the sorted records
+    writer = BgzfWriter(output_file)
+    index = IndexBuilder(depth=depth)
+    for header in headers[:1]:
+        writer.write(header.encode())
+    records = 0
+    for line in lines:
+        seqid, _, _, start, end, _ = line.split('\t', 5)
+        start_offset = writer.tell()
+        writer.write(line.encode())
+        beg = int(start) - 1
+        index.add(seqid, beg, max(int(end), beg + 1), start_offset, writer.tell())
+        records += 1
+    writer.close()
+    index_file = output_file + ('.csi' if csi else '.tbi')
+    index.write(index_file, csi)
+    return records, index_file
+
+
+def main(input_file, output_file, csi=False, chunk_lines=CHUNK_LINES):
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_file))) as run_dir:
+        runs, headers, contigs, max_end = sorted_runs(input_file, run_dir, chunk_lines)
+        if not csi and max_end >= TABIX_MAX_LENGTH:
+            # A tabix index cannot address these records; fail before writing an index that misses them
+            raise ValueError(f"{input_file} has records ending at {max_end}, past the {TABIX_MAX_LENGTH} bp "
+                             f"a tabix index covers, use --csi")
+        depth = csi_depth(max_end) if csi else TABIX_DEPTH
+        records, index_file = write_indexed_gff(merge_runs(runs, contigs), headers or ['##gff-version 3\n'], output_file,
+                                                csi, depth)
+    print(f"Sorted {records} records from {len(runs)} runs into {output_file}, indexed in {index_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sort, bgzip and index a makeGFF output for genome browsers.")
+    parser.add_argument("input_gff", type=str, help="Path to the GFF written by makeGFF.py")
+    parser.add_argument("output_gff_gz", type=str, help="Path to the BGZF compressed, sorted output")
+    parser.add_argument("--csi", action="store_true", help="Write a CSI index instead of a tabix index")
+    parser.add_argument("--chunk-lines", type=int, default=CHUNK_LINES, help="Lines sorted in memory at a time")
+    args = parser.parse_args()
+
+    main(args.input_gff, args.output_gff_gz, args.csi, args.chunk_lines)
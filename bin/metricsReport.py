@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import json
+import os
+from collections import defaultdict
+
+"""
+metricsReport.py
+
+Rolls the metrics sidecars written by the bin scripts (see stageMetrics.py) up into a per-run, per-chromosome
+report of where the time and memory of a pipeline run went.
+
+Every sidecar is one script run with its labels (direction, chromosome, region). The phases of all the runs of a
+script are summed per run ($LEAP_RUN_ID of the sidecar), chromosome and direction: wall and CPU time, rows in and
+out and bytes read and written add up, peak RSS is the largest seen. Sidecars without a chromosome label (humanFilter,
+prepNext, makeGFF, ...) are reported under "all".
+
+Usage:
+    python metricsReport.py <output_prefix> <sidecar_or_directory> [<sidecar_or_directory> ...]
+
+Output:
+    - <output_prefix>.json: the rolled up phases, per run.
+    - <output_prefix>.txt: the same as a table, slowest script first, with the totals of each run.
+
+Example:
+    python metricsReport.py leap_metrics outputs/metrics
+"""
+
+SUMMED = ['wall_s', 'cpu_s', 'rows_in', 'rows_out', 'bytes_read', 'bytes_written']
+
+
+def find_sidecars(paths):
+    sidecars = []
+    for path in paths:
+        if os.path.isdir(path):
+            sidecars.extend(sorted(glob.glob(os.path.join(path, '**', '*.metrics.json'), recursive=True)))
+        else:
+            sidecars.append(path)
+    return sidecars
+
+
+def load_sidecars(sidecar_files):
+    records = []
+    for sidecar_file in sidecar_files:
+        try:
+            with open(sidecar_file) as f:
+                records.append(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"Skipping {sidecar_file}: {e}")
+    return records
+
+
+def roll_up(records):
+    '''
+    Phase totals keyed on run, script, chromosome, direction and phase, with the number of script runs in each.
+    '''
+    totals = defaultdict(lambda: {'runs': 0, 'peak_rss_mb': 0.0, **{key: 0 for key in SUMMED}})
+    for record in records:
+        labels = record.get('labels', {})
+        run = record.get('run') or 'default'
+        chromosome = labels.get('chromosome') or labels.get('region') or 'all'
+        direction = labels.get('direction', '')
+        for phase in record.get('phases', []):
+            total = totals[(run, record['script'], chromosome, direction, phase['phase'])]
+            total['runs'] += 1
+            total['peak_rss_mb'] = max(total['peak_rss_mb'], phase.get('peak_rss_mb') or 0.0)
+            for key in SUMMED:
+                total[key] += phase.get(key) or 0
+    return totals
+
+
+def report(totals):
+    runs = defaultdict(list)
+    for (run, script, chromosome, direction, phase), total in totals.items():
+        runs[run].append({'script': script, 'chromosome': chromosome, 'direction': direction, 'phase': phase, **total})
+    for rows in runs.values():
+        rows.sort(key=lambda row: -row['wall_s'])
+    return dict(runs)
+
+
+def write_table(runs, output_file):
+    header = ['script', 'chromosome', 'direction', 'phase', 'runs', 'wall_s', 'cpu_s', 'peak_rss_mb',
+              'rows_in', 'rows_out', 'bytes_read', 'bytes_written']
+    with open(output_file, 'w') as f:
+        for run, rows in sorted(runs.items()):
+            f.write(f"# run {run}: {sum(row['runs'] for row in rows)} phases, "
+                    f"{sum(row['wall_s'] for row in rows):.1f}s wall, {sum(row['cpu_s'] for row in rows):.1f}s CPU, "
+                    f"{max(row['peak_rss_mb'] for row in rows):.0f} MB peak RSS\n")
+            f.write('\t'.join(header) + '\n')
+            for row in rows:
+                values = [f"{row[key]:.2f}" if isinstance(row[key], float) else str(row[key]) for key in header]
+                f.write('\t'.join(values) + '\n')
+
+
+def main(output_prefix, paths):
+    records = load_sidecars(find_sidecars(paths))
+    runs = report(roll_up(records))
+    with open(f"{output_prefix}.json", 'w') as f:
+        json.dump(runs, f, indent=1)
+    write_table(runs, f"{output_prefix}.txt")
+    print(f"{len(records)} sidecars rolled up into {output_prefix}.json and {output_prefix}.txt")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Roll the metrics sidecars of the pipeline up into a per-run, per-chromosome report.')
+    parser.add_argument('output_prefix', help='Prefix of the .json and .txt reports')
+    parser.add_argument('paths', nargs='+', help='Sidecar files, or directories searched for *.metrics.json')
+    args = parser.parse_args()
+
+    main(args.output_prefix, args.paths)
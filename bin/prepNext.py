@@ -1,8 +1,9 @@
 #!/usr/bin/env python3
 import sys
-import os
 import pandas as pd
-import requests
+from gffLoading import read_gff, report_peak_rss
+from gffAttributes import gff3_attribute, key_columns, strip_prefix
+from stageMetrics import StageMetrics, get_logger
 
 """
 prepNext.py
@@ -14,6 +15,10 @@ exon for the reverse strand, depending on the specified identity. The output is
 Usage:
     python prepNext.py <input_file> <identity> <gtf_file>
 
+    or in-process, e.g. straight after the cleanup stage:
+    from prepNext import prep_next
+    exons = prep_next(final_df, 'five', 'human.gff3', 'five_nextRun.gff')
+
 Arguments:
     input_file          Path to the input GFF file containing transcript data.
     identity            Specifies whether to extract five_prime or three_prime exons. Acceptable values:
@@ -23,146 +28,148 @@ Arguments:
 Steps:
 1. Normalize the `identity` argument to determine whether to process five_prime or three_prime exons.
 2. Read the input GFF file and extract transcript IDs, handling `_MANE_COPY` transcripts separately.
-3. Parse the GTF file to filter for relevant transcript IDs and extract exon information.
+3. Parse the GTF file to filter for relevant transcript IDs and extract exon information. The transcript
+   ID of every exon is extracted once and semi-joined against the ID set, so the run time is linear in
+   the size of the annotation.
 4. Identify the first exon for the forward strand or the last exon for the reverse strand based on the 
-   specified identity.
+   specified identity, with a grouped idxmin/idxmax per transcript.
 5. Write the selected exons to an output GFF file.
 
 Output:
-    - A GFF file containing the selected exons for each transcript.
+    - A GFF file containing the selected exons for each transcript. The rows are formatted and written
+      as they are generated, without building an intermediate record per exon.
+    - A metrics sidecar with the load, select and write phases (see stageMetrics.py).
 
 Dependencies:
     - pandas: For reading and processing tabular data.
-    - requests: For potential external requests (not used in the current implementation).
     - sys, os: For command-line argument handling and file operations.
 
 Example:
     python prepNext.py input.gff five gtf_file.gtf
 """
-# Get the input file name from the command line arguments
-input_file = sys.argv[1]
-identity = sys.argv[2]
-gtf_file = sys.argv[3]
-
-# Normalize the identity input
-base_name, ext = os.path.splitext(input_file)
-output_file = f"{identity}_nextRun.gff"
-identity = identity.lower()  # Convert to lowercase for case-insensitive matching
-if 'five' in identity or '5' in identity:
-    identity = 'five_prime'
-elif 'three' in identity or '3' in identity:
-    identity = 'three_prime'
-else:
+
+# Exon kept per transcript and strand: (coordinate, pick) furthest in the requested direction
+SELECT_EXON = {
+    'five_prime': {'+': ('end', 'idxmax'), '-': ('start', 'idxmin')},
+    'three_prime': {'+': ('start', 'idxmin'), '-': ('end', 'idxmax')},
+}
+
+log = get_logger('prepNext')
+
+INPUT_COLUMNS = ["Chromosome", "Source", "Type", "Start", "End", "Score", "Strand", "Phase", "Attributes", "gene_id", "Name",
+                 "capOrTail_Start", "capOrTail_End", "Transcript_Start", "Transcript_End", "Transcript_Name"]
+GTF_COLUMNS = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
+# Header line of the next run GFF, in the column names globalExonMatcher reads the human exons with
+NEXT_RUN_HEADER = "seqname\tsource\tfeature\tStart\tEnd\tscore\tStrand\tframe\tAttributes\tgene_id\n"
+
+def normalize_identity(identity):
+    identity = identity.lower()  # Convert to lowercase for case-insensitive matching
+    if 'five' in identity or '5' in identity:
+        return 'five_prime'
+    elif 'three' in identity or '3' in identity:
+        return 'three_prime'
     raise ValueError("Invalid identity input. Please use 'five', '5', 'three', or '3'.")
-# Construct the output file name
-
-
-# Read the input file
-df = pd.read_csv(input_file, sep='\t', usecols=["Chromosome","Source","Type","Start","End","Score","Strand","Phase","Attributes","gene_id","Name","capOrTail_Start","capOrTail_End","Transcript_Start","Transcript_End","Transcript_Name"])
-print(df.tail())
-
-# Function to parse attributes from the GTF file
-def parse_attributes(attribute_string):
-    attributes = {}
-    for attribute in attribute_string.split(';'):
-        if attribute.strip():
-            key, value = attribute.strip().split('=')
-            attributes[key] = value.strip('"')
-    return attributes
-# Extract transcript IDs and handle _MANE_copy
-transcript_ids = []
-mane_transcripts = {}
-
-for _, row in df.iterrows():
-    attributes = parse_attributes(row['Attributes'])
-    transcript_id = attributes.get('Parent').split(':')[1] if 'Parent' in attributes else row['Transcript_Name']
-    if pd.notna(transcript_id):
-        if '_MANE_COPY' in transcript_id.upper():
-            base_id = transcript_id.upper().split('_MANE_COPY')[0]
-            transcript_ids.append(base_id)
-            mane_transcripts[base_id] = transcript_id
-            print(mane_transcripts, "MANE")
-        else:
-            transcript_ids.append(transcript_id)
-
-gene_ids = df.set_index('Transcript_Name')['gene_id'].to_dict()
-print(gene_ids)
-# Extract transcript IDs from the 'Transcript_Name' column
-gtf_columns = ["seqname", "source", "feature", "start", "end", "score", "strand", "frame", "attribute"]
-gtf_df = pd.read_csv(gtf_file, sep="\t", comment='#', names=gtf_columns)
-
-# Filter the GTF DataFrame for the relevant transcript IDs and "exon" feature
-filtered_gtf_df = gtf_df[(gtf_df['attribute'].str.contains('|'.join(transcript_ids))) & (gtf_df['feature'] == 'exon')]
-#print(filtered_gtf_df.tail())
-
-
-
-# Extract transcript data from the filtered GTF DataFrame
-transcript_data = []
-for _, row in filtered_gtf_df.iterrows():
-    attributes = parse_attributes(row['attribute'])
-    transcript_id = attributes.get('Parent').split(':')[1] if 'Parent' in attributes else None
-    exon_number = attributes.get('rank')  # Extract exon number from rank
-    if transcript_id in transcript_ids:
-        if transcript_id in mane_transcripts:
-            transcript_id = mane_transcripts[transcript_id]
-        gene_id = gene_ids.get(transcript_id)
-        transcript_data.append({
-            'seq_region_name': row['seqname'],
-            'source': row['source'],
-            'feature': row['feature'],
-            'start': row['start'],
-            'end': row['end'],
-            'score': row['score'],
-            'strand': row['strand'],
-            'frame': row['frame'],
-            'transcript_id': transcript_id if transcript_id not in mane_transcripts else mane_transcripts[transcript_id],
-            'gene_id': gene_id,
-            'exon_number': int(exon_number)  # Convert exon_number to integer for sorting
-        })
-
-# Sort transcript_data by transcript_id and exon_number
-transcript_data.sort(key=lambda x: (x['transcript_id'], x['exon_number']))
-
-# Filter to keep only the first exon for each transcript on the forward strand
-# and the last exon for each transcript on the reverse strand
-select_exons = {}
-for data in transcript_data:
-    transcript_id = data['transcript_id']
-    strand = data['strand']
-    start = int(data['start'])
-    end = int(data['end'])
-    if transcript_id not in select_exons:
-        select_exons[transcript_id] = data
-        #print(f"Adding first exon for transcript {transcript_id} on strand {strand}: {data}")
-    else:
-        if identity == 'five_prime':
-            if strand == '+':
-                if end > int(select_exons[transcript_id]['end']):
-                    select_exons[transcript_id] = data
-                    #print(f"Updating first exon for transcript {transcript_id} on strand {strand}: {data}")
-            elif strand == '-':
-                if start < int(select_exons[transcript_id]['start']):
-                    select_exons[transcript_id] = data
-        elif identity == 'three_prime':
-            if strand == '+':
-                if start < int(select_exons[transcript_id]['start']):
-                    select_exons[transcript_id] = data
-            elif strand == '-':
-                if end > int(select_exons[transcript_id]['end']):
-                    select_exons[transcript_id] = data
-                    #print(f"Updating first exon for transcript {transcript_id} on strand {strand}: {data}")
-
-
-# Convert the dictionary back to a list
-select_exon_data = list(select_exons.values())
-
-# Function to write the results to a GTF file
-def write_gtf(transcript_data, output_file):
-    with open(output_file, 'w') as f:
-        f.write("seqname\tsource\tfeature\tStart\tEnd\tscore\tStrand\tframe\tAttributes\tgene_id\n")
-        for data in transcript_data:
-            f.write(f"{data['seq_region_name']}\t{data['source']}\t{data['feature']}\t{data['start']}\t{data['end']}\t{data['score']}\t{data['strand']}\t{data['frame']}\texon_number {data['exon_number']};Parent=transcript:{data['transcript_id']}; gene_id={data['gene_id']}\t\"{data['gene_id']}\" \n")
 
-# Write the results to the output GTF file
-write_gtf(select_exon_data, output_file)
\ No newline at end of file
+def load_extended_transcripts(input_file):
+    # Accepts the cleanup output as a path or as the DataFrame itself
+    if isinstance(input_file, pd.DataFrame):
+        return input_file
+    return pd.read_csv(input_file, sep='\t', usecols=INPUT_COLUMNS)
+
+def load_annotation(gtf_file):
+    if isinstance(gtf_file, pd.DataFrame):
+        return gtf_file
+    return read_gff(gtf_file, comment='#', names=GTF_COLUMNS)
+
+def parent_transcript_ids(parents):
+    # "transcript:ENST00000367770" -> "ENST00000367770"
+    return strip_prefix(parents).str.strip().str.strip('"')
+
+def extended_transcript_ids(df):
+    '''
+    Transcript IDs of the extended transcripts, the _MANE_copy transcripts keyed on their base ID and
+    the gene of every transcript.
+    '''
+    parents = gff3_attribute(df['Attributes'], 'Parent')
+    transcript_ids = parent_transcript_ids(parents).where(parents.notna(), df['Transcript_Name'])
+    transcript_ids = transcript_ids.dropna().astype(str)
+    is_mane = transcript_ids.str.upper().str.contains('_MANE_COPY', regex=False)
+    base_ids = transcript_ids.str.upper().str.split('_MANE_COPY', regex=False).str[0]
+    mane_transcripts = dict(zip(base_ids[is_mane], transcript_ids[is_mane]))
+    gene_ids = df.set_index('Transcript_Name')['gene_id'].to_dict()
+    return set(base_ids[is_mane]) | set(transcript_ids[~is_mane]), mane_transcripts, gene_ids
+
+def select_next_exons(df, gtf_df, identity, gtf_file=None):
+    '''
+    The first exon of every extended transcript on the forward strand and its last exon on the reverse
+    strand (the other way round for three_prime), taken from the reference annotation. gtf_file, when the
+    annotation was read from a file, lets its Parent and rank attributes be parsed once per file.
+    '''
+    transcript_ids, mane_transcripts, gene_ids = extended_transcript_ids(df)
+    log.debug("%s MANE", mane_transcripts)
+
+    # Semi-join the exons of the annotation against the transcript IDs, on the ID pulled out of each row once
+    keys = key_columns(gtf_df['attribute'], source=gtf_file)
+    is_exon = (gtf_df['feature'] == 'exon').to_numpy()
+    exons, keys = gtf_df[is_exon], keys[is_exon]
+    exon_transcripts = parent_transcript_ids(keys['Parent'])
+    is_extended = exon_transcripts.isin(transcript_ids).to_numpy()
+    exons = exons.assign(transcript_id=exon_transcripts)[is_extended]
+    exons['exon_number'] = keys.loc[is_extended, 'rank'].astype(int)
+    exons['transcript_id'] = exons['transcript_id'].map(lambda transcript_id: mane_transcripts.get(transcript_id, transcript_id))
+    # object dtype so transcripts without a gene keep None, as written before
+    exons['gene_id'] = pd.Series([gene_ids.get(transcript_id) for transcript_id in exons['transcript_id']], index=exons.index, dtype=object)
+
+    # Sorting on exon number first makes ties go to the lowest ranked exon
+    exons = exons.sort_values(['transcript_id', 'exon_number'], kind='stable')
+    selected = []
+    for strand, (coordinate, pick) in SELECT_EXON[identity].items():
+        strand_exons = exons[(exons['strand'] == strand).to_numpy()]
+        selected.append(strand_exons.loc[getattr(strand_exons.groupby('transcript_id', sort=False)[coordinate], pick)()])
+    return pd.concat(selected).sort_values('transcript_id', kind='stable')
+
+def gtf_lines(exons):
+    for row in exons[GTF_COLUMNS[:8] + ['transcript_id', 'gene_id', 'exon_number']].itertuples(index=False, name=None):
+        seqname, source, feature, start, end, score, strand, frame, transcript_id, gene_id, exon_number = row
+        yield (f"{seqname}\t{source}\t{feature}\t{start}\t{end}\t{score}\t{strand}\t{frame}\t"
+               f"exon_number {exon_number};Parent=transcript:{transcript_id}; gene_id={gene_id}\t\"{gene_id}\" \n")
+
+def write_gtf(exons, output_file):
+    with open(output_file, 'w') as f:
+        f.write(NEXT_RUN_HEADER)
+        f.writelines(gtf_lines(exons))
+
+def prep_next(input_file, identity, gtf_file, output_file=None, metrics=None, source=None):
+    # Paths or DataFrames in; the selected exons are returned and written when output_file is given.
+    # source is the file an annotation DataFrame was read from, so its attributes are parsed once
+    metrics = metrics or StageMetrics('prepNext', direction=identity)
+    with metrics.phase('load') as phase:
+        df = load_extended_transcripts(input_file)
+        gtf_df = load_annotation(gtf_file)
+        phase.read(*[path for path in (input_file, gtf_file) if not isinstance(path, pd.DataFrame)])
+        phase.rows_out = len(df) + len(gtf_df)
+    log.debug("%s", df.tail())
+    with metrics.phase('select') as phase:
+        phase.rows_in = len(df)
+        source = source if isinstance(gtf_file, pd.DataFrame) else gtf_file
+        exons = select_next_exons(df, gtf_df, normalize_identity(identity), source)
+        phase.rows_out = len(exons)
+    if output_file is not None:
+        with metrics.phase('write') as phase:
+            write_gtf(exons, output_file)
+            phase.rows_in = len(exons)
+            phase.wrote(output_file)
+    return exons
+
+def main(input_file, identity, gtf_file):
+    metrics = StageMetrics('prepNext', direction=identity)
+    prep_next(input_file, identity, gtf_file, f"{identity}_nextRun.gff", metrics)
+    report_peak_rss('prepNext')
+    metrics.write()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print("Usage: python prepNext.py <input_file> <identity> <gtf_file>")
+        sys.exit(1)
+
+    main(sys.argv[1], sys.argv[2], sys.argv[3])
@@ -0,0 +1,148 @@
+"""
+resultCache.py
+
+Content-addressed cache of the per-chromosome results of globalExonMatcher and globalTranscriptChecker.
+
+A result is keyed on a hash of the input slices it was computed from (the rows, column names and dtypes of
+every DataFrame, not where they came from) and of the parameters that change it, such as the direction,
+single_exon or the capOrTail window. A chromosome whose inputs did not change is therefore served from the
+cache whatever else changed in the run (e.g. the long reads of another chromosome), independently of
+Nextflow's task level cache. The key also holds a hash of the source of the script computing the result
+(bin/<name>.py), so any change to that code starts from an empty cache; CACHE_VERSION covers changes
+elsewhere, e.g. to the format of the stored results.
+
+Results are stored as Parquet files (needs pyarrow, otherwise nothing is cached) in $LEAP_CACHE_DIR/results
+(default ~/.cache/leap/results). A hit refreshes the file's modification time, and once the directory
+grows past $LEAP_RESULT_CACHE_MB (default 2048) the least recently used results are removed.
+LEAP_RESULT_CACHE_MB=0 turns the cache off.
+
+Example:
+    key = result_key('globalTranscriptChecker', [human, capOrTail, fantom, longRead], direction=direction, window=WINDOW)
+    matches = load_result(key)
+    if matches is None:
+        matches = findMatchesSweep(human, fantom, longRead, capOrTail, direction)
+        save_result(key, matches)
+"""
+import functools
+import hashlib
+import os
+
+import pandas as pd
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_MB = 2048
+
+
+def cache_dir():
+    cache_dir = os.environ.get('LEAP_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'leap'))
+    return os.path.join(cache_dir, 'results')
+
+
+def cache_limit():
+    # Size limit of the cache directory in bytes, 0 when caching is off
+    return int(float(os.environ.get('LEAP_RESULT_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024)
+
+
+def enabled():
+    if cache_limit() <= 0:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _column_bytes(column):
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # The categories of a slice are those of the whole file, so hash only the values it uses
+        codes, values = pd.factorize(column, use_na_sentinel=False)
+        return _column_bytes(pd.Series(values.astype(column.cat.categories.dtype))) + codes.tobytes()
+    if column.dtype.kind in 'biufcmM':
+        return column.to_numpy().tobytes()
+    import pyarrow as pa
+    try:
+        values = pa.array(column.array, from_pandas=True)
+    except (pa.ArrowException, TypeError, ValueError):
+        # Mixed types: one separator between values, missing values kept apart from the string 'nan'
+        return '\x00'.join(column.astype(object).where(column.notna(), '\x01').astype(str)).encode('utf-8', 'surrogatepass')
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    # Text as its Arrow buffers, copied first as a slice still points into the buffers of the whole file
+    values = pa.concat_arrays([values])
+    return str(values.type).encode() + b''.join(bytes(buffer) for buffer in values.buffers() if buffer is not None)
+
+
+def frame_digest(df):
+    # Hash of the rows in order, with the column names and dtypes; the index is not part of it
+    digest = hashlib.sha1(repr([(str(column), str(dtype)) for column, dtype in df.dtypes.items()]).encode())
+    for _, column in df.items():
+        digest.update(hashlib.sha1(_column_bytes(column)).digest())
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def source_digest(name):
+    # Hash of bin/<name>.py and of this module, read once per process
+    digest = hashlib.sha1()
+    for source_file in [os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{name}.py"), os.path.abspath(__file__)]:
+        try:
+            with open(source_file, 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(source_file.encode())
+    return digest.hexdigest()
+
+
+def result_key(name, frames, **params):
+    key = [name, str(CACHE_VERSION), source_digest(name)] + [frame_digest(df) for df in frames]
+    key += [f"{param}={params[param]!r}" for param in sorted(params)]
+    return hashlib.sha1('|'.join(key).encode()).hexdigest()
+
+
+def _result_file(key):
+    return os.path.join(cache_dir(), key + '.parquet')
+
+
+def load_result(key):
+    if not enabled():
+        return None
+    result_file = _result_file(key)
+    try:
+        result = pd.read_parquet(result_file)
+        os.utime(result_file)
+    except (OSError, ValueError):
+        return None
+    return result
+
+
+def save_result(key, result):
+    if not enabled():
+        return
+    try:
+        os.makedirs(cache_dir(), exist_ok=True)
+        # Written next to the final name and renamed, so concurrent jobs never read a partial file
+        temp_file = f"{_result_file(key)}.{os.getpid()}"
+        result.reset_index(drop=True).to_parquet(temp_file, index=False)
+        os.replace(temp_file, _result_file(key))
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Could not update the result cache: {e}")
+        return
+    evict()
+
+
+def evict():
+    # Remove the least recently used results until the directory fits the size limit
+    try:
+        entries = [entry for entry in os.scandir(cache_dir()) if entry.name.endswith('.parquet')]
+        results = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+    except OSError:
+        return
+    total = 0
+    for _, size, path in results:
+        total += size
+        if total > cache_limit():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+
+import numpy as np
+import pandas as pd
+from genomicShards import write_shards
+from globalTranscriptChecker import WINDOW
+from indexedInputs import input_extension
+from splitChromosomes import split_chunk, split_reader
+from stageMetrics import StageMetrics, get_logger
+
+"""
+shardGenome.py
+
+Plans the genomic shards that SPLIT_ALL_CHROMOSOMES and PROCESS_CHROMOSOMES work on, instead of one job per
+chromosome from a fixed list. The contig names and the number of rows on every contig (its feature density)
+are read from the four matched inputs, and the work is spread over about <shard_count> shards of similar size:
+    - a contig holding more than its share is cut into pieces, only in gaps between human exons that are wider
+      than 2 * WINDOW + 1 bp (gene free gaps), so no capOrTail site or block is within reach of exons on both
+      sides of a cut and every piece gives the same matches as its part of the whole contig
+    - small contigs (chrY, chrM, unplaced scaffolds, alt contigs, ...) are batched together
+Contigs without human exons cannot have a match and are left out.
+
+The plan is a tab separated table of shards, each a list of regions (see genomicShards.py):
+    shard       regions
+    shard001    1:1-61872213
+    shard002    1:61872214-248937043
+    shard003    21,22,Y,KI270728.1
+
+splitChromosomes.py takes the plan instead of a chromosome and writes split_*_<shard>.txt files, and
+globalTranscriptChecker.py --shards <plan> checks one shard; the matches of all shards together are those of
+the per chromosome runs (see those scripts for the details).
+
+Usage:
+    python shardGenome.py <human> <capOrTail> <fantom> <longRead> <output_tsv> [--shards N] [--contigs 1,2,X]
+
+Example:
+    python shardGenome.py filtered_matched_human_exons.gff polyA.txt matched_fantom_blocks.gff matched_longread_blocks.gff shards.tsv --shards 24
+"""
+
+log = get_logger('shardGenome')
+
+# Default number of shards, as many as the chromosome jobs they replace
+SHARD_COUNT = 24
+# Narrowest gap (bp) between human exons a contig may be cut in
+MIN_GAP = 2 * WINDOW + 1
+
+
+def contig_features(input_file, contigs=None):
+    # {contig: (starts, ends)} of the rows of one input, coordinates as in the split files
+    starts, ends = {}, {}
+    file_extension = input_extension(input_file)
+    for chunk in split_reader(input_file, contigs):
+        for contig, rows in split_chunk(chunk, file_extension, contigs):
+            starts.setdefault(contig, []).append(pd.to_numeric(rows.iloc[:, 3], errors='coerce').to_numpy(dtype='float64'))
+            ends.setdefault(contig, []).append(pd.to_numeric(rows.iloc[:, 4], errors='coerce').to_numpy(dtype='float64'))
+    return {contig: (np.concatenate(starts[contig]), np.concatenate(ends[contig])) for contig in starts}
+
+
+def cut_contig(contig, exons, positions, target):
+    '''
+    Regions of about target rows each. exons are the (starts, ends) of the human exons, positions the sorted
+    start of every row on the contig; the contig is only cut in gaps of at least MIN_GAP between exons.
+    '''
+    keep = ~(np.isnan(exons[0]) | np.isnan(exons[1]))
+    if not keep.any():
+        return [(contig, None, None)]
+    order = np.argsort(exons[0][keep], kind='stable')
+    exon_starts = exons[0][keep][order].astype('int64')
+    reach = np.maximum.accumulate(exons[1][keep][order].astype('int64'))
+    first = min(1, int(positions[0])) if len(positions) else 1
+    last = int(max(reach[-1], positions[-1])) if len(positions) else int(reach[-1])
+
+    regions = []
+    start = first
+    # Gap after exon i: from the furthest exon end so far to the start of exon i + 1
+    for i in np.flatnonzero(exon_starts[1:] - reach[:-1] >= MIN_GAP):
+        cut = int((reach[i] + exon_starts[i + 1] + 1) // 2)
+        rows = np.searchsorted(positions, cut, 'left') - np.searchsorted(positions, start, 'left')
+        if rows >= target:
+            regions.append((contig, start, cut - 1))
+            start = cut
+    if not regions:
+        return [(contig, None, None)]
+    regions.append((contig, start, last))
+    return regions
+
+
+def contig_order(contig):
+    # Numbered chromosomes first, then X, Y, M and the rest by name
+    return (0, int(contig), '') if contig.isdigit() else (1, {'X': 0, 'Y': 1, 'M': 2, 'MT': 2}.get(contig, 3), contig)
+
+
+def plan_shards(human, evidence, shard_count=SHARD_COUNT):
+    '''
+    Shards of similar size from the features of the human exons and of the evidence (see contig_features).
+    Returns [[(contig, start, end), ...], ...], the regions of every shard.
+    '''
+    weights = {}
+    positions = {}
+    for contig, (starts, ends) in human.items():
+        contig_starts = [starts] + [features[contig][0] for features in evidence if contig in features]
+        positions[contig] = np.sort(np.concatenate(contig_starts))
+        positions[contig] = positions[contig][~np.isnan(positions[contig])]
+        weights[contig] = sum(len(part) for part in contig_starts)
+    if not weights:
+        return []
+    target = max(sum(weights.values()) / max(shard_count, 1), 1)
+
+    # Contigs holding more than one shard's share are cut in pieces of about that size
+    items = []
+    for contig in sorted(weights, key=contig_order):
+        regions = cut_contig(contig, human[contig], positions[contig], target) if weights[contig] > target else [(contig, None, None)]
+        for region_contig, start, end in regions:
+            if start is None:
+                weight = weights[contig]
+            else:
+                weight = np.searchsorted(positions[contig], end, 'right') - np.searchsorted(positions[contig], start, 'left')
+            items.append((weight, (region_contig, start, end)))
+
+    # Largest first onto the lightest shard
+    shards = [(0, i, []) for i in range(min(shard_count, len(items)))]
+    heapq.heapify(shards)
+    for weight, region in sorted(items, key=lambda item: -item[0]):
+        total, i, regions = heapq.heappop(shards)
+        regions.append(region)
+        heapq.heappush(shards, (total + weight, i, regions))
+    shards = [sorted(regions, key=lambda region: (contig_order(region[0]), region[1] or 0)) for _, _, regions in shards if regions]
+    return sorted(shards, key=lambda regions: (contig_order(regions[0][0]), regions[0][1] or 0))
+
+
+def main(human_file, capOrTail_file, fantom_file, longRead_file, output_file, shard_count=SHARD_COUNT, contigs=None):
+    metrics = StageMetrics('shardGenome')
+    features = {}
+    for name, input_file in [('human', human_file), ('capOrTail', capOrTail_file), ('fantom', fantom_file), ('longRead', longRead_file)]:
+        with metrics.phase(f"read_{name}") as phase:
+            features[name] = contig_features(input_file, contigs)
+            phase.read(input_file)
+            phase.rows_out = sum(len(starts) for starts, _ in features[name].values())
+    with metrics.phase('plan') as phase:
+        shards = plan_shards(features['human'], [features['capOrTail'], features['fantom'], features['longRead']], shard_count)
+        plan = write_shards(shards, output_file)
+        phase.rows_out = len(plan)
+        phase.wrote(output_file)
+    for shard, regions in zip(plan['shard'], plan['regions']):
+        log.info("%s: %s", shard, regions)
+    print(f"Written {len(plan)} shards to {output_file}")
+    metrics.write()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plan size-balanced genomic shards for the per shard stages.')
+    parser.add_argument('human', help='Matched human exons (filtered_matched_human_exons.gff)')
+    parser.add_argument('capOrTail', help='CAGE peaks or polyA sites')
+    parser.add_argument('fantom', help='Matched FANTOM blocks')
+    parser.add_argument('longRead', help='Matched long read blocks')
+    parser.add_argument('output_tsv', help='Shard plan to write')
+    parser.add_argument('--shards', type=int, default=SHARD_COUNT, help=f"Number of shards to aim for (default {SHARD_COUNT})")
+    parser.add_argument('--contigs', default='', help='Comma separated contigs to keep (default: every contig with human exons)')
+    args = parser.parse_args()
+
+    contigs = {contig[3:] if contig.startswith('chr') else contig for contig in args.contigs.split(',') if contig} or None
+    main(args.human, args.capOrTail, args.fantom, args.longRead, args.output_tsv, args.shards, contigs)
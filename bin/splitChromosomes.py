@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
+import glob
+import os
 import sys
 import pandas as pd
+from genomicShards import read_shards, region_mask
+from indexedInputs import input_extension, is_indexed, list_contigs, read_region
+from intermediateFormat import TableAppender, is_binary, iter_table_chunks, read_table, write_table
+from stageMetrics import StageMetrics, get_logger
 
 """
 splitChromosomes.py
@@ -13,7 +19,9 @@ Usage:
     python splitChromosomes.py <chr> <fantom> <longRead> <capOrTail> <human> <capOrTail_type>
 
 Arguments:
-    chr                 The chromosome to filter (e.g., "1", "X", "MT").
+    chr                 The chromosome to filter (e.g., "1", "X", "MT"). A comma separated list
+                        (e.g., "1,2,X") or "all" switches to single pass mode, and a shard plan
+                        written by shardGenome.py to shard mode, see below.
     fantom              Path to the FANTOM input file.
     longRead            Path to the long-read input file.
     capOrTail           Path to the cap or tail input file.
@@ -23,9 +31,32 @@ Arguments:
 Steps:
 1. Parse the input files based on their format (GFF, GTF, BED, or tab-delimited).
 2. Filter the data for the specified chromosome.
+   Bgzipped, coordinate sorted inputs are read through their tabix/CSI index instead, so only the
+   requested chromosome is fetched (see indexedInputs.py).
 3. Convert BED files to GFF format if necessary.
 4. Write the filtered data to output files with a prefix indicating the input file type.
 
+Single pass mode:
+    Each input is streamed once in chunks of CHUNK_SIZE rows and every chunk is split by chromosome
+    (ignoring any "chr" prefix), so all split_*_{chr}.txt files are written in the same pass. BED rows
+    are converted to GFF chunk by chunk. Memory is bounded by the chunk size, not the file size.
+
+Shard mode:
+    As single pass mode, but every row goes to the split_*_{shard}.txt file of each shard with a region
+    it overlaps (see genomicShards.py), so the files of a shard hold everything its checks can reach.
+    globalTranscriptChecker.py reads a chromosome's human split with skiprows=1 and takes the next line
+    as the header, so the per chromosome runs never check the first two human exons of a chromosome
+    (in file order). Shard splits leave those rows out and are read without a header, so the matches
+    of all shards are those of the per chromosome runs.
+
+Intermediate format:
+    Inputs written by earlier stages as Parquet/Arrow tables are read as such, and the split files
+    are written in the format selected by LEAP_INTERMEDIATE_FORMAT (see intermediateFormat.py).
+
+Metrics:
+    Each input is one phase (split_fantom, split_longRead, split_capOrTail, split_human) of the
+    metrics sidecar (see stageMetrics.py), with the rows and bytes it read and wrote.
+
 Output:
     - Separate output files for each input file, containing only the data for the specified chromosome.
 
@@ -35,8 +66,18 @@ Dependencies:
 
 Example:
     python splitChromosomes.py 1 fantom.gff longRead.bed capOrTail.txt human.gtf cap
+    python splitChromosomes.py all fantom.gff longRead.bed capOrTail.txt human.gtf cap
+    python splitChromosomes.py shards.tsv fantom.gff longRead.bed capOrTail.txt human.gtf cap
 """
 
+log = get_logger('splitChromosomes')
+
+# Rows read per chunk in single pass mode
+CHUNK_SIZE = 500000
+GFF_EXTENSIONS = ['gff', 'gtf', 'gff3']
+# Human rows of a chromosome a per chromosome check never reads: the skipped line and the inferred header
+UNREAD_HUMAN_ROWS = 2
+
 def convert_to_gff(df):
     # Convert BAM-like DataFrame to GFF format
     gff_df = pd.DataFrame()
@@ -52,15 +93,25 @@ def convert_to_gff(df):
     return gff_df
 
 def split_file(input_file, output_prefix, chr):
-    file_extension = input_file.split('.')[-1]
-    print(file_extension)
-    
-    if file_extension in ['gff', 'gtf', 'gff3']:
+    file_extension = input_extension(input_file)
+    log.debug("%s", file_extension)
+    write_header = file_extension not in GFF_EXTENSIONS + ['bed']
+
+    if is_indexed(input_file):
+        # Only the requested chromosome is read, through the tabix/CSI index
+        df = read_region(input_file, chr, dtype=str)
+        chr_col = 0
+        write_header = False
+    elif is_binary(input_file):
+        # Binary tables keep their dtypes and remember whether they were written with a header
+        df = read_table(input_file, header=None if file_extension in GFF_EXTENSIONS + ['bed'] else 'infer', chromosome=chr)
+        chr_col = df.columns[0]
+    elif file_extension in ['gff', 'gtf', 'gff3']:
         df = pd.read_csv(input_file, sep='\t', comment='#', header=None, dtype=str)
         chr_col = 0
     elif file_extension == 'bed':
         df = pd.read_csv(input_file, sep='\t', header=None, dtype=str)
-        print(df.head())
+        log.debug("%s", df.head())
         chr_col = 0
     else:
         df = pd.read_csv(input_file, sep='\t', header=0, dtype=str)
@@ -72,33 +123,149 @@ def split_file(input_file, output_prefix, chr):
     else:
         chr_value = chr
     
-    filtered_df = df[df[chr_col] == chr_value]
+    filtered_df = df[df[chr_col].astype(str) == chr_value]
     if not filtered_df.empty:
         if file_extension == 'bed':
             filtered_df = convert_to_gff(filtered_df)
         output_file = f"{output_prefix}_{chr}.txt"
-        filtered_df.to_csv(output_file, sep='\t', index=False, header=(file_extension not in ['gff', 'gtf', 'gff3', 'bed']))
+        write_table(filtered_df, output_file, header=write_header)
         print(f"Written to {output_file}")
     else:
         print(f"No data found for chromosome {chr} in {input_file}")
+    return len(df), len(filtered_df)
 
-def main(chr, fantom, longRead, capOrTail, human, capOrTail_type):
-    # Process FANTOM input file
-    split_file(fantom, "split_fantom", chr)
+def split_reader(input_file, chromosomes=None, chunk_size=CHUNK_SIZE):
+    # Chunks of the file, in the dtypes and header layout split_file would read it with
+    file_extension = input_extension(input_file)
+    if is_indexed(input_file):
+        # One indexed fetch per contig stands in for the chunks
+        contigs = [contig for contig in list_contigs(input_file)
+                   if chromosomes is None or (contig[3:] if contig.startswith('chr') else contig) in chromosomes]
+        return (read_region(input_file, contig, dtype=str) for contig in contigs)
+    elif os.path.getsize(input_file) == 0:
+        # An earlier stage matched nothing, so there is nothing to split
+        return iter(())
+    elif is_binary(input_file):
+        return iter_table_chunks(input_file, chunk_size, header=None if file_extension in GFF_EXTENSIONS + ['bed'] else 'infer')
+    elif file_extension in GFF_EXTENSIONS:
+        return pd.read_csv(input_file, sep='\t', comment='#', header=None, dtype=str, chunksize=chunk_size)
+    elif file_extension == 'bed':
+        return pd.read_csv(input_file, sep='\t', header=None, dtype=str, chunksize=chunk_size)
+    else:
+        return pd.read_csv(input_file, sep='\t', header=0, dtype=str, chunksize=chunk_size)
+
+def split_chunk(chunk, file_extension, chromosomes=None):
+    # (chromosome, rows) of one chunk, ignoring any "chr" prefix; BED rows are converted to GFF
+    chr_col = chunk.columns[0]
+    chr_labels = chunk[chr_col].astype(str).str.replace('^chr', '', regex=True)
+    for chr_label, chr_df in chunk.groupby(chr_labels, sort=False):
+        if chromosomes is not None and chr_label not in chromosomes:
+            continue
+        if file_extension == 'bed':
+            chr_df = convert_to_gff(chr_df)
+        yield chr_label, chr_df
+
+def split_frames(chunks, file_extension, chromosomes=None):
+    '''
+    In-memory counterpart of split_file_all: the rows of every chromosome as one DataFrame, keyed on the
+    chromosome, in the order they were first seen.
+    '''
+    frames = {}
+    for chunk in chunks:
+        for chr_label, chr_df in split_chunk(chunk, file_extension, chromosomes):
+            frames.setdefault(chr_label, []).append(chr_df)
+    return {chr_label: pd.concat(chr_dfs, ignore_index=True) for chr_label, chr_dfs in frames.items()}
 
-    # Process longRead input file
-    split_file(longRead, "split_longRead", chr)
+def split_file_all(input_file, output_prefix, chromosomes=None, chunk_size=CHUNK_SIZE):
+    # Stream the file once and append each chunk's rows to the output file of their chromosome
+    file_extension = input_extension(input_file)
+    log.debug("%s", file_extension)
+    reader = split_reader(input_file, chromosomes, chunk_size)
+    write_header = file_extension not in GFF_EXTENSIONS + ['bed'] and not is_indexed(input_file)
 
-    # Process capOrTail input file
-    # Process capOrTail input file
-    split_file(capOrTail, "split_capOrTail", chr)
+    written = []
+    rows_read = rows_written = 0
+    appender = TableAppender()
+    for chunk in reader:
+        rows_read += len(chunk)
+        for chr_label, chr_df in split_chunk(chunk, file_extension, chromosomes):
+            output_file = f"{output_prefix}_{chr_label}.txt"
+            appender.append(chr_df, output_file, header=write_header)
+            rows_written += len(chr_df)
+            if chr_label not in written:
+                written.append(chr_label)
+    appender.close()
 
-    # Process HUMAN input file
-    split_file(human, "split_human", chr)
+    for chr_label in written:
+        print(f"Written to {output_prefix}_{chr_label}.txt")
+    for chr_label in sorted(set(chromosomes or []) - set(written)):
+        print(f"No data found for chromosome {chr_label} in {input_file}")
+    return rows_read, rows_written
+
+def split_file_shards(input_file, output_prefix, shards, unread_rows=0, chunk_size=CHUNK_SIZE):
+    '''
+    Stream the file once and append each chunk's rows to the output file of every shard with a region they
+    overlap. The first unread_rows rows of every contig are left out.
+    '''
+    file_extension = input_extension(input_file)
+    contig_regions = {}
+    for shard, regions in shards.items():
+        for contig, start, end in regions:
+            contig_regions.setdefault(contig, []).append((shard, start, end))
+    reader = split_reader(input_file, set(contig_regions), chunk_size)
+    write_header = file_extension not in GFF_EXTENSIONS + ['bed'] and not is_indexed(input_file)
+
+    written = []
+    seen = {}
+    rows_read = rows_written = 0
+    appender = TableAppender()
+    for chunk in reader:
+        rows_read += len(chunk)
+        for contig, contig_df in split_chunk(chunk, file_extension, set(contig_regions)):
+            skip = max(unread_rows - seen.get(contig, 0), 0)
+            seen[contig] = seen.get(contig, 0) + len(contig_df)
+            contig_df = contig_df.iloc[skip:]
+            for shard, start, end in contig_regions[contig]:
+                shard_df = contig_df[region_mask(contig_df.iloc[:, 3], contig_df.iloc[:, 4], start, end)]
+                if shard_df.empty:
+                    continue
+                appender.append(shard_df, f"{output_prefix}_{shard}.txt", header=write_header)
+                rows_written += len(shard_df)
+                if shard not in written:
+                    written.append(shard)
+    appender.close()
+
+    for shard in written:
+        print(f"Written to {output_prefix}_{shard}.txt")
+    for shard in [shard for shard in shards if shard not in written]:
+        print(f"No data found for {shard} in {input_file}")
+    return rows_read, rows_written
+
+def main(chr, fantom, longRead, capOrTail, human, capOrTail_type):
+    shards = read_shards(chr) if os.path.isfile(chr) else None
+    single_pass = chr == 'all' or ',' in chr or shards is not None
+    # A single pass covers every chromosome, so only single chromosome runs get a chromosome label
+    metrics = StageMetrics('splitChromosomes', direction=capOrTail_type, chromosome=None if single_pass else chr)
+    chromosomes = None if chr == 'all' or not single_pass or shards is not None else set(chr.split(','))
+    for input_file, output_prefix in [(fantom, "split_fantom"), (longRead, "split_longRead"),
+                                      (capOrTail, "split_capOrTail"), (human, "split_human")]:
+        with metrics.phase(output_prefix) as phase:
+            if shards is not None:
+                unread_rows = UNREAD_HUMAN_ROWS if output_prefix == "split_human" else 0
+                phase.rows_in, phase.rows_out = split_file_shards(input_file, output_prefix, shards, unread_rows)
+                phase.wrote(*glob.glob(f"{output_prefix}_*.txt"))
+            elif single_pass:
+                phase.rows_in, phase.rows_out = split_file_all(input_file, output_prefix, chromosomes)
+                phase.wrote(*glob.glob(f"{output_prefix}_*.txt"))
+            else:
+                phase.rows_in, phase.rows_out = split_file(input_file, output_prefix, chr)
+                phase.wrote(f"{output_prefix}_{chr}.txt")
+            phase.read(input_file)
+    metrics.write()
 
 if __name__ == "__main__":
     if len(sys.argv) != 7:
-        print("Usage: python split_chromosomes.py <chr> <fantom> <longRead> <capOrTail> <human> <capOrTail_type>")
+        print("Usage: python split_chromosomes.py <chr|shards.tsv> <fantom> <longRead> <capOrTail> <human> <capOrTail_type>")
         sys.exit(1)
 
     chr = sys.argv[1]
@@ -0,0 +1,162 @@
+"""
+stageMetrics.py
+
+Timing and memory instrumentation shared by the bin scripts, and the log level their chatty output sits behind.
+
+A script creates one StageMetrics with its name and labels (direction, chromosome) and wraps each of its
+phases (load, match, write, ...) in metrics.phase(). Every phase records its wall time, CPU time, the peak
+RSS of the process at its end, the rows going in and out and the bytes read and written:
+
+    metrics = StageMetrics('startOrEndGrab', direction='both')
+    with metrics.phase('load') as phase:
+        df = read_gff(input_file, ...)
+        phase.read(input_file)
+        phase.rows_out = len(df)
+    ...
+    metrics.write()
+
+write() saves a JSON sidecar, <script>[_<labels>].metrics.json, in $LEAP_METRICS_DIR (default: the working
+directory, i.e. the Nextflow task directory). $LEAP_RUN_ID, when set, tags the sidecar with the run it belongs
+to. metricsReport.py rolls the sidecars of a run up into a per-run, per-chromosome report.
+
+Debug output (table heads, per-exon values) goes through get_logger(), at the level set by $LEAP_LOG_LEVEL
+(debug, info, warning or error; default info). Debug messages take their values as arguments, so nothing is
+formatted unless the level is debug.
+"""
+import json
+import logging
+import os
+import socket
+import sys
+import time
+
+from gffLoading import peak_rss_mb
+
+LOG_LEVELS = ['debug', 'info', 'warning', 'error']
+
+
+def log_level():
+    level = os.environ.get('LEAP_LOG_LEVEL', 'info').lower()
+    if level not in LOG_LEVELS:
+        raise ValueError(f"Invalid LEAP_LOG_LEVEL '{level}'. Use one of {', '.join(LOG_LEVELS)}.")
+    return getattr(logging, level.upper())
+
+
+def get_logger(name):
+    # Plain messages on stdout, like the prints they replace
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(log_level())
+    return logger
+
+
+def file_size(file_path):
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+class Phase:
+    '''
+    One named phase of a script. Set rows_in/rows_out and call read()/wrote() with the files it touches.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.peak_rss_mb = 0.0
+
+    def read(self, *file_paths):
+        self.bytes_read += sum(file_size(file_path) for file_path in file_paths)
+
+    def wrote(self, *file_paths):
+        self.bytes_written += sum(file_size(file_path) for file_path in file_paths)
+
+    def to_dict(self):
+        return {'phase': self.name, 'wall_s': self.wall_s, 'cpu_s': self.cpu_s, 'peak_rss_mb': self.peak_rss_mb,
+                'rows_in': self.rows_in, 'rows_out': self.rows_out,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+
+
+class _PhaseTimer:
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self.phase
+
+    def __exit__(self, *exc_info):
+        self.phase.wall_s += time.perf_counter() - self.wall
+        self.phase.cpu_s += time.process_time() - self.cpu
+        self.phase.peak_rss_mb = peak_rss_mb()
+        return False
+
+
+class StageMetrics:
+    '''
+    Phases of one script run and the labels that identify it (direction, chromosome, ...).
+    '''
+
+    def __init__(self, script, **labels):
+        self.script = script
+        self.labels = {key: str(value) for key, value in labels.items() if value is not None}
+        self.phases = []
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def phase(self, name):
+        # A phase entered twice (e.g. once per input) accumulates into the same entry
+        for phase in self.phases:
+            if phase.name == name:
+                return _PhaseTimer(phase)
+        phase = Phase(name)
+        self.phases.append(phase)
+        return _PhaseTimer(phase)
+
+    def to_dict(self):
+        return {
+            'script': self.script,
+            'run': os.environ.get('LEAP_RUN_ID'),
+            'labels': self.labels,
+            'argv': sys.argv[1:],
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'started': self.started,
+            'intermediate_format': os.environ.get('LEAP_INTERMEDIATE_FORMAT', 'tsv'),
+            'load_profile': os.environ.get('LEAP_LOAD_PROFILE', 'lowmem'),
+            'wall_s': time.perf_counter() - self.wall,
+            'cpu_s': time.process_time() - self.cpu,
+            'peak_rss_mb': peak_rss_mb(),
+            'phases': [phase.to_dict() for phase in self.phases],
+        }
+
+    def sidecar_file(self):
+        name = '_'.join([self.script] + [self.labels[key] for key in sorted(self.labels)])
+        metrics_dir = os.environ.get('LEAP_METRICS_DIR') or os.getcwd()
+        if os.environ.get('LEAP_METRICS_DIR'):
+            # A shared directory collects the sidecars of every task, so make the names unique
+            name += f".{socket.gethostname()}.{os.getpid()}"
+        return os.path.join(metrics_dir, f"{name}.metrics.json")
+
+    def write(self):
+        sidecar = self.sidecar_file()
+        try:
+            os.makedirs(os.path.dirname(sidecar), exist_ok=True)
+            with open(sidecar, 'w') as f:
+                json.dump(self.to_dict(), f, indent=1)
+        except OSError as e:
+            print(f"Could not write the metrics sidecar {sidecar}: {e}")
+        return sidecar
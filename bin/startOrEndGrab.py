@@ -1,137 +1,142 @@
 #!/usr/bin/env python3
+import numpy as np
 import pandas as pd
 import sys
+import os
+from gffLoading import read_gff, report_peak_rss
+from intermediateFormat import write_table
+from gffAttributes import key_columns, strip_prefix
+from stageMetrics import StageMetrics, get_logger
 
 '''
 Author: Lucas Cortes
 Date: 2020-10-15
-Usage: python 3primeGrab.py <input_file> <fiveOrThreePrime?> <output_file>
+Usage: python 3primeGrab.py <input_file> <fiveOrThreePrime?|both> <output_file>
 
 This script is intended to find the furthest threePrime or fivePrime transcript for each gene in the Human Genome
 The result will be a GTF with an additional column that contains the gene name associated with the transcript 
+
+Gene IDs are forward filled from the gene lines and the furthest exon per gene is picked with a sort and
+drop_duplicates over the whole file, rather than a Python function per gene group.
+
+With "both" the annotation is parsed once and the most 5' and most 3' selections are written side by side,
+e.g. grabbedhg38_fivePrime.gff and grabbedhg38_threePrime.gff for an <output_file> of grabbedhg38.gff.
+Outputs are written in the format selected by LEAP_INTERMEDIATE_FORMAT (see intermediateFormat.py).
+The ID, Parent and tag attributes are parsed once per annotation file (see gffAttributes.py).
+Timings per phase (load, select, write) are written to a metrics sidecar (see stageMetrics.py).
 '''
 
-def main(input_file, capOrTail, output_file):
-    # Define the column names for the GFF file
-    gff_column_names = [
-        "seqname", "source", "feature", "Start", "End", "score", "Strand", "frame", "Attributes"
+log = get_logger('startOrEndGrab')
+
+def assign_gene_ids(df, keys):
+    # Every row belongs to the gene line above it, so forward fill the IDs of the gene rows
+    gene_ids = strip_prefix(keys['ID'], 'gene').where(df['feature'] == 'gene')
+    df['ensembl_gene_id'] = gene_ids.ffill().fillna("NA")
+    return df
+
+def find_candidate_exons(df, keys):
+    '''
+    Exons of the transcripts that have both a five_prime_UTR and a three_prime_UTR, with their transcript
+    ID, whether their gene is on the + strand and whether the transcript is the MANE_Select. This is the
+    direction independent part of the selection, so it is only done once in "both" mode.
+    '''
+    transcript_ids = strip_prefix(keys['Parent'], 'transcript')
+    gene_transcripts = pd.MultiIndex.from_arrays([df['ensembl_gene_id'], transcript_ids])
+
+    # Transcripts with both UTRs, per gene
+    five_prime_utrs = gene_transcripts[(df['feature'] == 'five_prime_UTR').to_numpy() & transcript_ids.notna().to_numpy()]
+    three_prime_utrs = gene_transcripts[(df['feature'] == 'three_prime_UTR').to_numpy() & transcript_ids.notna().to_numpy()]
+    valid_transcripts = five_prime_utrs.unique().intersection(three_prime_utrs.unique())
+
+    exons = df[(df['feature'] == 'exon').to_numpy() & gene_transcripts.isin(valid_transcripts)].copy()
+    exons['transcript_id'] = transcript_ids.loc[exons.index]
+
+    # The strand of a gene is taken from its first row, the gene line itself
+    exons['plus_strand'] = df.groupby('ensembl_gene_id')['Strand'].transform('first').loc[exons.index] == '+'
+
+    # MANE_Select transcripts, keyed on the mRNA line of each transcript
+    is_mane = (df['feature'] == 'mRNA') & keys['tag'].str.contains('MANE_Select', regex=False).fillna(False).astype(bool)
+    mane_transcripts = pd.MultiIndex.from_arrays([df.loc[is_mane, 'ensembl_gene_id'], strip_prefix(keys.loc[is_mane, 'ID'], 'transcript')])
+    exons['has_mane'] = pd.MultiIndex.from_arrays([exons['ensembl_gene_id'], exons['transcript_id']]).isin(mane_transcripts)
+    return exons
+
+def select_transcripts(exons, capOrTail):
+    '''
+    Picks, for every gene, the candidate exon that reaches furthest 5' (fivePrime) or 3' (threePrime).
+    Returns one exon row per gene, with "_MANE_copy" appended to the transcript ID when that transcript
+    is the MANE_Select.
+    '''
+    if capOrTail == 'fivePrime':
+        sort_key = np.where(exons['plus_strand'], exons['Start'], -exons['End'])
+    else:
+        sort_key = np.where(exons['plus_strand'], -exons['End'], exons['Start'])
+    # Stable sort so ties keep the first exon in file order, like idxmin/idxmax did
+    selected = exons.assign(sort_key=sort_key).sort_values(['ensembl_gene_id', 'sort_key'], kind='stable')
+    selected = selected.drop_duplicates('ensembl_gene_id')
+
+    selected['Attributes'] = [
+        attributes.replace(transcript_id, transcript_id + '_MANE_copy') if mane else attributes
+        for attributes, transcript_id, mane in zip(selected['Attributes'], selected['transcript_id'], selected['has_mane'])
     ]
+    return selected.drop(columns=['transcript_id', 'plus_strand', 'has_mane', 'sort_key'])
 
-    # Read the GFF file with the specified column names
-    df = pd.read_csv(input_file, sep='\t', names=gff_column_names, comment='#', header=None)
-    print(df.head())
-    # Initialize variables
-    ensembl_gene_ids = []
-    current_ensg = "NA"
-
-    # Loop through the GFF file to extract gene IDs and add them to the DataFrame
-    for idx, row in df.iterrows():
-        if row['feature'] == 'gene':
-            current_ensg = row['Attributes'].split('ID=gene:')[1].split(';')[0]
-            
-        ensembl_gene_ids.append(current_ensg)
-        if row['Attributes'].startswith('###'):
-            current_ensg = "NA"  # Reset the gene ID at the end of a block
-
+def grab_transcripts(df, directions, source=None):
+    # The selected exons of every direction of the parsed annotation; source is the file it was read from
     # Add the ensembl_gene_id column to the DataFrame
-    df['ensembl_gene_id'] = ensembl_gene_ids
-    print(df)
-
-    # Group by GeneID and apply a lambda function to select the most 5' transcript
-    def select_most_3_transcript(group):
-        # Extract transcript IDs associated with both 5' and 3' UTRs
-        five_prime_utrs = group[group['feature'] == 'five_prime_UTR']['Attributes'].str.extract('Parent=transcript:([^;]+)')[0]
-        print(five_prime_utrs)
-        three_prime_utrs = group[group['feature'] == 'three_prime_UTR']['Attributes'].str.extract('Parent=transcript:([^;]+)')[0]
-        valid_transcripts = set(five_prime_utrs.dropna()) & set(three_prime_utrs.dropna())
-
-        # Filter the group for valid transcripts
-        valid_transcript_group = group[group['Attributes'].apply(lambda x: any(f'Parent=transcript:{tid}' in x for tid in valid_transcripts))]
-
-        if not valid_transcript_group.empty:
-            # Select the most 5' CDS from the valid transcripts
-            three_prime_utrs = valid_transcript_group[valid_transcript_group['feature'] == 'exon']
-            if not three_prime_utrs.empty:
-                if group['Strand'].iloc[0] == '+':
-                    most_3_transcript = three_prime_utrs.loc[three_prime_utrs['End'].idxmax()]
-                else:
-                    most_3_transcript = three_prime_utrs.loc[three_prime_utrs['Start'].idxmin()]
-
-                if 'Parent=transcript:' in most_3_transcript['Attributes']:
-                    transcript_id = most_3_transcript['Attributes'].split('Parent=transcript:')[1].split(';')[0]
-                else:
-                    return None
-                transcript_group = group[group['Attributes'].str.contains(f'{transcript_id}')]
-                print(transcript_group, "/n", "TRANSCRIPT GROUP")
-
-                has_mane = any((transcript_group['feature'] == 'mRNA') & (transcript_group['Attributes'].str.contains('MANE_Select')))
-                if has_mane:
-                    print(has_mane, "/n" ,"HAS MANE")
-                
-                if has_mane:
-                    most_3_transcript['Attributes'] = most_3_transcript['Attributes'].replace(transcript_id, transcript_id + '_MANE_copy')
-                
-                return most_3_transcript
-            else:
-                return None
-        else:
-            return None
-    # Group by GeneID and apply a lambda function to select the most 5' transcript
-    def select_most_5_transcript(group):
-        # Extract transcript IDs associated with both 5' and 3' UTRs
-        five_prime_utrs = group[group['feature'] == 'five_prime_UTR']['Attributes'].str.extract('Parent=transcript:([^;]+)')[0]
-        three_prime_utrs = group[group['feature'] == 'three_prime_UTR']['Attributes'].str.extract('Parent=transcript:([^;]+)')[0]
-        valid_transcripts = set(five_prime_utrs.dropna()) & set(three_prime_utrs.dropna())
-
-        # Filter the group for valid transcripts
-        valid_transcript_group = group[group['Attributes'].apply(lambda x: any(f'Parent=transcript:{tid}' in x for tid in valid_transcripts))]
-
-        if not valid_transcript_group.empty:
-            # Select the most 5' CDS from the valid transcripts
-            five_prime_utrs = valid_transcript_group[valid_transcript_group['feature'] == 'exon']
-            if not five_prime_utrs.empty:
-                if group['Strand'].iloc[0] == '+':
-                    most_5_transcript = five_prime_utrs.loc[five_prime_utrs['Start'].idxmin()]
-                else:
-                    most_5_transcript = five_prime_utrs.loc[five_prime_utrs['End'].idxmax()]
-
-                if 'Parent=transcript:' in most_5_transcript['Attributes']:
-                    transcript_id = most_5_transcript['Attributes'].split('Parent=transcript:')[1].split(';')[0]
-                else:
-                    return None
-                transcript_group = group[group['Attributes'].str.contains(f'{transcript_id}')]
-                print(transcript_group, "/n", "TRANSCRIPT GROUP")
-
-                has_mane = any((transcript_group['feature'] == 'mRNA') & (transcript_group['Attributes'].str.contains('MANE_Select')))
-                if has_mane:
-                    print(has_mane, "/n" ,"HAS MANE")
-                
-                if has_mane:
-                    most_5_transcript['Attributes'] = most_5_transcript['Attributes'].replace(transcript_id, transcript_id + '_MANE_copy')
-                
-                return most_5_transcript
-            else:
-                return None
-        else:
-            return None
-
-    if capOrTail == 'threePrime':
-        result = df.groupby('ensembl_gene_id').apply(select_most_3_transcript)
-    elif capOrTail == 'fivePrime':
-        result = df.groupby('ensembl_gene_id').apply(select_most_5_transcript)
+    keys = key_columns(df['Attributes'], source=source)
+    df = assign_gene_ids(df, keys)
+    exons = find_candidate_exons(df, keys)
+    results = {}
+    for direction in directions:
+        # Filter out incomplete rows
+        results[direction] = select_transcripts(exons, direction).dropna().reset_index(drop=True)
+    return results
+
+def direction_output_file(output_file, capOrTail):
+    # "grabbedhg38.gff" -> "grabbedhg38_fivePrime.gff" for the outputs of "both" mode
+    base_name, ext = os.path.splitext(output_file)
+    return f"{base_name}_{capOrTail}{ext}"
+
+# Define the column names for the GFF file
+GFF_COLUMN_NAMES = [
+    "seqname", "source", "feature", "Start", "End", "score", "Strand", "frame", "Attributes"
+]
+
+def main(input_file, capOrTail, output_file):
+
+    if capOrTail == 'both':
+        outputs = {direction: direction_output_file(output_file, direction) for direction in ['fivePrime', 'threePrime']}
+    elif capOrTail in ['threePrime', 'fivePrime']:
+        outputs = {capOrTail: output_file}
     else:
-        print("Invalid option for fiveOrThreePrime. Please use 'fivePrime' or 'threePrime'.")
+        print("Invalid option for fiveOrThreePrime. Please use 'fivePrime', 'threePrime' or 'both'.")
         sys.exit(1)
 
-    # Filter out None values
-    result = result.dropna().reset_index(drop=True)
-
-    # Save the result to a new file
-    result.to_csv(output_file, sep='\t', index=False)
+    metrics = StageMetrics('startOrEndGrab', direction=capOrTail)
+    with metrics.phase('load') as phase:
+        # Read the GFF file with the specified column names
+        df = read_gff(input_file, names=GFF_COLUMN_NAMES, comment='#', header=None)
+        phase.read(input_file)
+        phase.rows_out = len(df)
+    log.debug("%s", df.head())
+
+    with metrics.phase('select') as phase:
+        phase.rows_in = len(df)
+        results = grab_transcripts(df, list(outputs), source=input_file)
+        phase.rows_out = sum(len(result) for result in results.values())
+
+    with metrics.phase('write') as phase:
+        for direction, direction_file in outputs.items():
+            # Save the result to a new file
+            write_table(results[direction], direction_file)
+            phase.wrote(direction_file)
+        phase.rows_in = sum(len(result) for result in results.values())
+    report_peak_rss('startOrEndGrab')
+    metrics.write()
 
 if __name__ == "__main__":
     if len(sys.argv) != 4:
-        print("Usage: python 3primeGrab.py <input_file> <fiveOrThreePrime> <output_file>")
+        print("Usage: python 3primeGrab.py <input_file> <fiveOrThreePrime|both> <output_file>")
         sys.exit(1)
 
     input_file = sys.argv[1]
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+import argparse
+import csv
+import math
+import os
+import random
+
+"""
+syntheticData.py
+
+Writes a consistent synthetic LEAP input set at a chosen scale, for benchmarking the pipeline without the
+full hg38, FANTOM and long read data:
+    human.gff3          Ensembl style GFF3 gene blocks (gene, mRNA, exon, UTR and CDS lines, "###" between
+                        genes), protein coding and lncRNA, with MANE_Select/Ensembl_canonical tags
+    readthrough.txt     stable_id list of readthrough transcripts for humanFilter.py
+    fantom.gff          FANTOM transcript models, chr prefixed, one exon block per line (Name="<id>.1_block<n>")
+    longread.gtf        long read alignments, one exon per line (transcript_id, gene_id, exon_number)
+    longread.bed        the same long read exons as BED (only with --bed)
+    cage_peaks.gff      CAGE peaks, the fivePrime capOrTail input
+    polya_sites.gff     polyA sites, the threePrime capOrTail input
+    input.csv           sample sheet in the layout main.nf reads (End, human, capOrTail, fantom, longRead)
+
+Every transcript has a "true" start and end a little beyond its annotated ends. FANTOM models and most long
+reads end there and the CAGE peaks and polyA sites sit on them, so a share of the transcripts can be
+extended, as with real data. Long reads are spread over the transcripts with a lognormal expression level;
+some are 5' truncated and some are intergenic noise. The same seed and options always give the same files.
+
+Gene models are built for all chromosomes first (a whole genome is around 20,000 genes), then the files are
+written chromosome by chromosome in coordinate order, so memory does not grow with the number of reads.
+
+Usage:
+    python syntheticData.py <output_dir> [--chromosomes 21|1,2,X|all] [--reads N] [--gene-density GENES_PER_MB]
+                            [--length-scale F] [--fantom-fraction F] [--bed] [--seed N]
+
+Example:
+    python syntheticData.py synthetic_chr21 --chromosomes 21 --reads 100000
+    python syntheticData.py synthetic_genome --chromosomes all --reads 10000000
+"""
+
+# GRCh38 chromosome lengths, in bases
+CHROMOSOME_LENGTHS = {
+    '1': 248956422, '2': 242193529, '3': 198295559, '4': 190214555, '5': 181538259, '6': 170805979,
+    '7': 159345973, '8': 145138636, '9': 138394717, '10': 133797422, '11': 135086622, '12': 133275309,
+    '13': 114364328, '14': 107043718, '15': 101991189, '16': 90338345, '17': 83257441, '18': 80373285,
+    '19': 58617616, '20': 64444167, '21': 46709983, '22': 50818468, 'X': 156040895, 'Y': 57227415,
+}
+
+# Roughly 20,000 protein coding and lncRNA genes over the 3.1 Gb genome
+GENE_DENSITY = 6.5
+LNCRNA_FRACTION = 0.15
+SINGLE_EXON_FRACTION = 0.08
+MANE_FRACTION = 0.9
+READTHROUGH_FRACTION = 0.01
+FANTOM_FRACTION = 0.8
+# Largest distance (bp) between an annotated transcript end and its true end
+MAX_EXTENSION = 500
+# Share of long reads that are 5' truncated, and of extra reads that fall between genes
+TRUNCATED_READ_FRACTION = 0.2
+NOISE_READ_FRACTION = 0.05
+
+
+class Transcript:
+    '''
+    One annotated transcript: its exons in genomic order and how far its true ends reach beyond them.
+    '''
+
+    def __init__(self, transcript_id, exons, strand, coding, tags, five_extension, three_extension, expression):
+        self.transcript_id = transcript_id
+        self.exons = exons
+        self.strand = strand
+        self.coding = coding
+        self.tags = tags
+        self.five_extension = five_extension
+        self.three_extension = three_extension
+        self.expression = expression
+
+    @property
+    def start(self):
+        return self.exons[0][0]
+
+    @property
+    def end(self):
+        return self.exons[-1][1]
+
+    def true_ends(self):
+        # (true start, true end) on the genome, whatever the strand
+        if self.strand == '+':
+            return self.start - self.five_extension, self.end + self.three_extension
+        return self.start - self.three_extension, self.end + self.five_extension
+
+    def extended_exons(self, start, end):
+        exons = [list(exon) for exon in self.exons]
+        exons[0][0] = min(start, exons[0][1] - 1)
+        exons[-1][1] = max(end, exons[-1][0] + 1)
+        return exons
+
+
+class Gene:
+    def __init__(self, chromosome, gene_id, strand, biotype, transcripts):
+        self.chromosome = chromosome
+        self.gene_id = gene_id
+        self.strand = strand
+        self.biotype = biotype
+        self.transcripts = transcripts
+
+    @property
+    def start(self):
+        return min(transcript.start for transcript in self.transcripts)
+
+    @property
+    def end(self):
+        return max(transcript.end for transcript in self.transcripts)
+
+
+def parse_chromosomes(chromosomes):
+    if chromosomes == 'all':
+        return list(CHROMOSOME_LENGTHS)
+    selected = [chromosome[3:] if chromosome.startswith('chr') else chromosome for chromosome in chromosomes.split(',')]
+    unknown = [chromosome for chromosome in selected if chromosome not in CHROMOSOME_LENGTHS]
+    if unknown:
+        raise ValueError(f"Unknown chromosomes {', '.join(unknown)}. Use 1-22, X, Y or 'all'.")
+    return selected
+
+
+def gene_exons(rng, single_exon):
+    # Exon (start, end) offsets from the gene start
+    n_exons = 1 if single_exon else rng.randint(2, 12)
+    exons, position = [], 0
+    for number in range(n_exons):
+        terminal = number in (0, n_exons - 1)
+        length = rng.randint(100, 800) if terminal else rng.randint(60, 300)
+        exons.append((position, position + length - 1))
+        position += length + int(rng.lognormvariate(7.5, 1.0)) + 100
+    return exons
+
+
+def transcript_exons(rng, exons, number):
+    # The first transcript has every exon; the others skip an internal exon or start/end at an inner one
+    if number == 0 or len(exons) < 3:
+        return list(exons)
+    choice = rng.random()
+    if choice < 0.5:
+        skipped = rng.randint(1, len(exons) - 2)
+        return exons[:skipped] + exons[skipped + 1:]
+    if choice < 0.75:
+        return exons[1:]
+    return exons[:-1]
+
+
+def build_genes(chromosomes, seed, gene_density=GENE_DENSITY, length_scale=1.0, fantom_fraction=FANTOM_FRACTION):
+    rng = random.Random(seed)
+    genes = {}
+    gene_number = 0
+    for chromosome in chromosomes:
+        length = int(CHROMOSOME_LENGTHS[chromosome] * length_scale)
+        mean_gap = 1e6 / gene_density
+        position = 10000
+        genes[chromosome] = []
+        while True:
+            position += int(rng.expovariate(1 / mean_gap)) + 2 * MAX_EXTENSION + 1000
+            biotype = 'lncRNA' if rng.random() < LNCRNA_FRACTION else 'protein_coding'
+            exons = gene_exons(rng, rng.random() < SINGLE_EXON_FRACTION)
+            if position + exons[-1][1] + 2 * MAX_EXTENSION >= length:
+                break
+            strand = rng.choice('+-')
+            gene_id = f"ENSG{gene_number:011d}"
+            transcripts = []
+            for number in range(rng.choice([1, 1, 2, 2, 3])):
+                offsets = transcript_exons(rng, exons, number)
+                tags = ['basic']
+                if number == 0:
+                    tags.append('Ensembl_canonical')
+                    if biotype == 'protein_coding' and rng.random() < MANE_FRACTION:
+                        tags.append('MANE_Select')
+                supported = rng.random() < fantom_fraction
+                transcripts.append(Transcript(
+                    f"ENST{gene_number:09d}{number:02d}",
+                    [(position + start, position + end) for start, end in offsets],
+                    strand,
+                    biotype == 'protein_coding',
+                    tags,
+                    rng.randint(10, MAX_EXTENSION) if supported else 0,
+                    rng.randint(10, MAX_EXTENSION) if supported else 0,
+                    rng.lognormvariate(0, 1.5),
+                ))
+            genes[chromosome].append(Gene(chromosome, gene_id, strand, biotype, transcripts))
+            position += exons[-1][1]
+            gene_number += 1
+    return genes
+
+
+def coding_parts(transcript):
+    # five_prime_UTR, CDS and three_prime_UTR pieces of a coding transcript, as (feature, start, end, phase)
+    exons = transcript.exons
+    first, last = exons[0], exons[-1]
+    utr_start = max(10, (first[1] - first[0]) // 4) if len(exons) > 1 else (first[1] - first[0]) // 4
+    utr_end = max(10, (last[1] - last[0]) // 4) if len(exons) > 1 else (last[1] - last[0]) // 4
+    cds_start, cds_end = first[0] + utr_start, last[1] - utr_end
+    if transcript.strand == '+':
+        start_utr, end_utr = 'five_prime_UTR', 'three_prime_UTR'
+    else:
+        start_utr, end_utr = 'three_prime_UTR', 'five_prime_UTR'
+    parts = [(start_utr, first[0], cds_start - 1, '.'), (end_utr, cds_end + 1, last[1], '.')]
+    for start, end in exons:
+        if start <= cds_end and end >= cds_start:
+            parts.append(('CDS', max(start, cds_start), min(end, cds_end), '0'))
+    return parts
+
+
+def gene_lines(gene):
+    chromosome = gene.chromosome
+    gene_feature = 'gene' if gene.biotype == 'protein_coding' else 'ncRNA_gene'
+    transcript_feature = 'mRNA' if gene.biotype == 'protein_coding' else 'lnc_RNA'
+    lines = [f"{chromosome}\tensembl_havana\t{gene_feature}\t{gene.start}\t{gene.end}\t.\t{gene.strand}\t.\t"
+             f"ID=gene:{gene.gene_id};Name=SYN{gene.gene_id[4:]};biotype={gene.biotype};gene_id={gene.gene_id};version=1\n"]
+    for transcript in gene.transcripts:
+        transcript_id = transcript.transcript_id
+        lines.append(f"{chromosome}\tensembl_havana\t{transcript_feature}\t{transcript.start}\t{transcript.end}\t.\t{gene.strand}\t.\t"
+                     f"ID=transcript:{transcript_id};Parent=gene:{gene.gene_id};biotype={gene.biotype};"
+                     f"tag={','.join(transcript.tags)};transcript_id={transcript_id};version=1\n")
+        n_exons = len(transcript.exons)
+        for number, (start, end) in enumerate(transcript.exons):
+            rank = number + 1 if gene.strand == '+' else n_exons - number
+            exon_id = f"ENSE{transcript_id[4:]}{rank:03d}"
+            lines.append(f"{chromosome}\tensembl_havana\texon\t{start}\t{end}\t.\t{gene.strand}\t.\t"
+                         f"Parent=transcript:{transcript_id};Name={exon_id};exon_id={exon_id};rank={rank};version=1\n")
+        if transcript.coding:
+            for feature, start, end, phase in coding_parts(transcript):
+                if end >= start:
+                    lines.append(f"{chromosome}\tensembl_havana\t{feature}\t{start}\t{end}\t.\t{gene.strand}\t{phase}\t"
+                                 f"Parent=transcript:{transcript_id}\n")
+    lines.append("###\n")
+    return lines
+
+
+def write_human(genes, output_dir):
+    with open(os.path.join(output_dir, 'human.gff3'), 'w') as out:
+        out.write("##gff-version 3\n")
+        for chromosome, chromosome_genes in genes.items():
+            length = CHROMOSOME_LENGTHS[chromosome]
+            out.write(f"##sequence-region   {chromosome} 1 {length}\n")
+            for gene in chromosome_genes:
+                out.writelines(gene_lines(gene))
+
+
+def write_readthroughs(genes, output_dir, seed):
+    rng = random.Random(seed + 1)
+    with open(os.path.join(output_dir, 'readthrough.txt'), 'w') as out:
+        out.write("stable_id\n")
+        for chromosome_genes in genes.values():
+            for gene in chromosome_genes:
+                if gene.biotype == 'protein_coding' and rng.random() < READTHROUGH_FRACTION:
+                    out.write(f"{gene.transcripts[0].transcript_id}\n")
+
+
+def fantom_lines(transcript, chromosome, number, rng):
+    start, end = transcript.true_ends()
+    # FANTOM ends within a few bases of the true ends, never short of the peak on them
+    exons = transcript.extended_exons(start - rng.randint(0, 20), end + rng.randint(0, 20))
+    fantom_id = f"FTMT{number:09d}"
+    n_exons = len(exons)
+    lines = []
+    for index, (block_start, block_end) in enumerate(exons):
+        block = index + 1 if transcript.strand == '+' else n_exons - index
+        lines.append(f"chr{chromosome}\tFANTOM\texon\t{block_start}\t{block_end}\t.\t{transcript.strand}\t.\t"
+                     f"ID={fantom_id}.1_block{block};Name=\"{fantom_id}.1_block{block}\"\n")
+    return lines
+
+
+def read_exons(transcript, rng):
+    # Most reads end on the true ends (give or take 30 bp), some stop short; some are 5' truncated
+    start, end = transcript.true_ends()
+    if rng.random() < 0.8:
+        start += rng.randint(-30, 30)
+        end += rng.randint(-30, 30)
+    else:
+        start, end = transcript.start + rng.randint(0, 50), transcript.end - rng.randint(0, 50)
+    exons = transcript.extended_exons(start, end)
+    if len(exons) > 2 and rng.random() < TRUNCATED_READ_FRACTION:
+        exons = exons[1:] if transcript.strand == '+' else exons[:-1]
+    return exons
+
+
+def read_lines(chromosome, read_id, strand, exons, bed=False):
+    gtf, bed_lines = [], []
+    n_exons = len(exons)
+    for index, (start, end) in enumerate(exons):
+        number = index + 1 if strand == '+' else n_exons - index
+        attributes = f'gene_id "LRG{read_id:010d}"; transcript_id "LRT{read_id:010d}"; exon_number "{number}";'
+        gtf.append(f"chr{chromosome}\tlongread\texon\t{start}\t{end}\t.\t{strand}\t.\t{attributes}\n")
+        if bed:
+            bed_lines.append(f"chr{chromosome}\t{start - 1}\t{end}\tLRT{read_id:010d}\t60\t{strand}\t{start - 1}\t{end}\t0\t{attributes}\n")
+    return gtf, bed_lines
+
+
+def peak_line(chromosome, position, strand, peak_type, peak_id):
+    return (position - 2, f"{chromosome}\tsynthetic\t{peak_type}\t{position - 2}\t{position + 2}\t.\t{strand}\t.\t"
+                          f"ID={peak_type}_{peak_id}\n")
+
+
+def poisson(rng, mean):
+    # Knuth's method for small means, a rounded normal approximation for large ones
+    if mean > 50:
+        return max(0, int(round(rng.gauss(mean, math.sqrt(mean)))))
+    threshold, count, product = math.exp(-mean), 0, rng.random()
+    while product > threshold:
+        count += 1
+        product *= rng.random()
+    return count
+
+
+def write_evidence(genes, output_dir, reads, seed, bed=False):
+    '''
+    FANTOM models, long reads and peaks, chromosome by chromosome. Returns the number of long reads written.
+    '''
+    rng = random.Random(seed + 2)
+    total_expression = sum(transcript.expression for chromosome_genes in genes.values()
+                           for gene in chromosome_genes for transcript in gene.transcripts)
+    transcript_reads = reads * (1 - NOISE_READ_FRACTION) / total_expression if total_expression else 0
+    files = {name: open(os.path.join(output_dir, name), 'w')
+             for name in ['fantom.gff', 'longread.gtf', 'cage_peaks.gff', 'polya_sites.gff'] + (['longread.bed'] if bed else [])}
+    fantom_number = read_id = peak_id = 0
+    try:
+        for chromosome, chromosome_genes in genes.items():
+            cage, polya = [], []
+            for gene in chromosome_genes:
+                gene_fantom, gene_reads, gene_bed = [], [], []
+                for transcript in gene.transcripts:
+                    if transcript.five_extension:
+                        gene_fantom.extend(fantom_lines(transcript, chromosome, fantom_number, rng))
+                        fantom_number += 1
+                        start, end = transcript.true_ends()
+                        five_end, three_end = (start, end) if transcript.strand == '+' else (end, start)
+                        cage.append(peak_line(chromosome, five_end, transcript.strand, 'CAGE', peak_id))
+                        polya.append(peak_line(chromosome, three_end, transcript.strand, 'polyA', peak_id))
+                        peak_id += 1
+                    for _ in range(poisson(rng, transcript.expression * transcript_reads)):
+                        gtf, bed_lines = read_lines(chromosome, read_id, transcript.strand, read_exons(transcript, rng), bed)
+                        gene_reads.extend(gtf)
+                        gene_bed.extend(bed_lines)
+                        read_id += 1
+                files['fantom.gff'].writelines(gene_fantom)
+                files['longread.gtf'].writelines(gene_reads)
+                if bed:
+                    files['longread.bed'].writelines(gene_bed)
+
+            # Intergenic noise reads, spread over the chromosome
+            chromosome_end = chromosome_genes[-1].end if chromosome_genes else 0
+            noise_reads = poisson(rng, reads * NOISE_READ_FRACTION * len(chromosome_genes) / max(1, sum(len(g) for g in genes.values())))
+            for _ in range(noise_reads):
+                start = rng.randint(1000, max(1001, chromosome_end))
+                gtf, bed_lines = read_lines(chromosome, read_id, rng.choice('+-'), [[start, start + rng.randint(200, 2000)]], bed)
+                files['longread.gtf'].writelines(gtf)
+                if bed:
+                    files['longread.bed'].writelines(bed_lines)
+                read_id += 1
+                # Some noise peaks as well, away from any transcript end
+                if rng.random() < 0.1:
+                    cage.append(peak_line(chromosome, start + 100, rng.choice('+-'), 'CAGE', f"noise{read_id}"))
+                    polya.append(peak_line(chromosome, start + 100, rng.choice('+-'), 'polyA', f"noise{read_id}"))
+
+            for peaks, name in ((cage, 'cage_peaks.gff'), (polya, 'polya_sites.gff')):
+                peaks.sort(key=lambda peak: peak[0])
+                files[name].writelines(line for _, line in peaks)
+    finally:
+        for handle in files.values():
+            handle.close()
+    return read_id
+
+
+def write_sample_sheet(output_dir):
+    with open(os.path.join(output_dir, 'input.csv'), 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(['End', 'human', 'capOrTail', 'fantom', 'longRead'])
+        for end, peaks in (('fivePrime', 'cage_peaks.gff'), ('threePrime', 'polya_sites.gff')):
+            writer.writerow([end] + [os.path.abspath(os.path.join(output_dir, name))
+                                     for name in ('human.gff3', peaks, 'fantom.gff', 'longread.gtf')])
+
+
+def main(output_dir, chromosomes='21', reads=10000, gene_density=GENE_DENSITY, length_scale=1.0,
+         fantom_fraction=FANTOM_FRACTION, bed=False, seed=1):
+    os.makedirs(output_dir, exist_ok=True)
+    genes = build_genes(parse_chromosomes(chromosomes), seed, gene_density, length_scale, fantom_fraction)
+    write_human(genes, output_dir)
+    write_readthroughs(genes, output_dir, seed)
+    written_reads = write_evidence(genes, output_dir, reads, seed, bed)
+    write_sample_sheet(output_dir)
+    n_genes = sum(len(chromosome_genes) for chromosome_genes in genes.values())
+    n_transcripts = sum(len(gene.transcripts) for chromosome_genes in genes.values() for gene in chromosome_genes)
+    print(f"Wrote {n_genes} genes, {n_transcripts} transcripts and {written_reads} long reads on "
+          f"{len(genes)} chromosomes to {output_dir}")
+    return genes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic human GFF3, FANTOM, long read and CAGE/polyA input set.")
+    parser.add_argument("output_dir", type=str, help="Directory the files are written to")
+    parser.add_argument("--chromosomes", type=str, default='21', help="Comma separated chromosomes, or 'all' (default 21)")
+    parser.add_argument("--reads", type=int, default=10000, help="Number of long reads (default 10000)")
+    parser.add_argument("--gene-density", type=float, default=GENE_DENSITY, help=f"Genes per Mb (default {GENE_DENSITY})")
+    parser.add_argument("--length-scale", type=float, default=1.0, help="Fraction of each chromosome's length to fill (default 1)")
+    parser.add_argument("--fantom-fraction", type=float, default=FANTOM_FRACTION, help="Share of transcripts with FANTOM support and peaks")
+    parser.add_argument("--bed", action="store_true", help="Also write the long reads as BED")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default 1)")
+    args = parser.parse_args()
+
+    main(args.output_dir, args.chromosomes, args.reads, args.gene_density, args.length_scale,
+         args.fantom_fraction, args.bed, args.seed)
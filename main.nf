@@ -7,15 +7,23 @@ supports configurable parameters to control the workflow. It integrates subworkf
 3' and 5' ends and allows for iterative refinement of results.
 
 Usage:
-    nextflow run main.nf --input <input.csv> --outputDir <output_directory>
+    nextflow run main.nf --input <input.csv> --outputDir <output_directory> [--shards N] [--contigs 1,2,X] [--incremental] [--plot false]
 
 Arguments:
     input.csv           A CSV file containing input data with columns for identifiers and file paths.
     outputDir           Directory where the results will be published (default: "results").
+    shards              Number of genomic shards the per chromosome checks are spread over (default: 24).
+    contigs             Comma separated contigs to check (default: every contig with human exons).
+    incremental         Round 2 reuses the round 1 matches of the same direction and only re-examines
+                        the exons round 1 did not match (default: false). Exons round 1 checked without
+                        a match are checked again, so round 2 still costs about one check per unmatched
+                        exon, not only per changed transcript.
+    plot                Write the extension length histogram of every sample (default: true).
 
 Steps:
 1. Load the input CSV file and parse it into channels for 3' and 5' processing based on the "End" column.
-2. Split the data into separate channels for 3' and 5' workflows.
+2. Split the data into separate channels for 3' and 5' workflows, and filter and grab the terminal exons of
+   every human annotation once for both (HUMAN_FILTER, START_OR_END_GRAB_BOTH).
 3. Call subworkflows (`THREE_PRIME_PIPELINE` and `FIVE_PRIME_PIPELINE`) to process the data.
 4. Combine results from the first run of each subworkflow and refine the data for a second run.
 5. Publish the results from both runs into the specified output directory.
@@ -36,15 +44,15 @@ Example:
     nextflow run main.nf --input input.csv --outputDir results
 */
 
-chromosomes = Channel.from('1', '2',
-'3', '4', '5', '6', '7', '8', '9', 
-'10','11', '12', '13', '14', '15', 
-'16', '17', '18', '19', '20','21', 
-'22', 'X', 'Y' ) // ADD X AND Y BACK IN LATER  'X', 'Y'
+// The checks run on genomic shards planned from the matched inputs (see bin/shardGenome.py) rather than on a
+// fixed chromosome list: large chromosomes are cut at gene free gaps and small contigs batched together
+shard_count = params.shards
 
 
 include { THREE_PRIME_PIPELINE } from './subworkflows/three_prime_pipeline'
 include { FIVE_PRIME_PIPELINE } from './subworkflows/five_prime_pipeline'
+include { HUMAN_FILTER } from './modules/human_filter'
+include { START_OR_END_GRAB_BOTH } from './modules/start_or_end_grab_both'
 
 params.outputDir = 'results_DFbrainAndMixture'
 
@@ -77,11 +85,22 @@ workflow {
         five_ch = csv_file.filter { it[0] == 'five' }.map { it[1] }
         .view()
 
+        // HUMAN_FILTER and START_OR_END_GRAB_BOTH run once per human annotation and are shared by both directions
+        readThroughs = file("/nfs/production/flicek/ensembl/havana/lucascortes/polyA-DB/data/readthroughList/readthroughList.txt")
+        humans = csv_file.map { it[1].human }.unique().map { human -> tuple(human, file(human)) }
+        grabbed = START_OR_END_GRAB_BOTH(HUMAN_FILTER(humans, readThroughs, single_exon))
+        three_grabbed = three_ch.map { row -> tuple(row.human, row) }
+            .combine(grabbed.three, by: 0)
+            .map { human, row, grab -> tuple(row.id, grab, file(row.capOrTail), file(row.fantom), file(row.longRead)) }
+        five_grabbed = five_ch.map { row -> tuple(row.human, row) }
+            .combine(grabbed.five, by: 0)
+            .map { human, row, grab -> tuple(row.id, grab, file(row.capOrTail), file(row.fantom), file(row.longRead)) }
+
             // Call subworkflows
-        three_prime_results_one = THREE_PRIME_PIPELINE(three_ch, prep_next, single_exon, chromosomes)
-        five_prime_results_one = FIVE_PRIME_PIPELINE(five_ch, prep_next, single_exon, chromosomes)
+        three_prime_results_one = THREE_PRIME_PIPELINE(three_ch, three_grabbed, prep_next, single_exon, shard_count, [])
+        five_prime_results_one = FIVE_PRIME_PIPELINE(five_ch, five_grabbed, prep_next, single_exon, shard_count, [])
         new_three_ch = three_ch
-            .combine(five_prime_results_one)
+            .combine(five_prime_results_one.prepnext_out)
             .map { original, new_human ->
                 original.human = new_human
                 original.id = original.id + "_modified" // Append "_modified" to the ID
@@ -89,19 +108,44 @@ workflow {
             }
             .view()
         new_five_ch = five_ch
-            .combine(three_prime_results_one)
+            .combine(three_prime_results_one.prepnext_out)
             .map { original, new_human ->
                 original.human = new_human
                 original.id = original.id + "_modified" // Append "_modified" to the ID
                 return original
             }
             .view()
+        three_previous = []
+        five_previous = []
+        if (params.incremental) {
+            // The evidence of round 2 is the terminal block index of round 1 of the same sample and direction,
+            // keyed on the round 2 id ("<id>_modified")
+            new_three_ch = new_three_ch
+                .map { row -> tuple(row.id, row) }
+                .join(three_prime_results_one.index.map { id, fantom, longRead -> tuple(id + "_modified", fantom, longRead) })
+                .map { id, original, fantom, longRead ->
+                    original.fantom = fantom
+                    original.longRead = longRead
+                    return original
+                }
+            new_five_ch = new_five_ch
+                .map { row -> tuple(row.id, row) }
+                .join(five_prime_results_one.index.map { id, fantom, longRead -> tuple(id + "_modified", fantom, longRead) })
+                .map { id, original, fantom, longRead ->
+                    original.fantom = fantom
+                    original.longRead = longRead
+                    return original
+                }
+            three_previous = three_prime_results_one.catted.map { id, table -> tuple(id + "_modified", table) }
+            five_previous = five_prime_results_one.catted.map { id, table -> tuple(id + "_modified", table) }
+        }
         prep_next = false
-        three_prime_results_two = THREE_PRIME_PIPELINE(new_three_ch, prep_next, single_exon, chromosomes)
-        five_prime_results_two = FIVE_PRIME_PIPELINE(new_five_ch, prep_next, single_exon, chromosomes)
+        three_prime_results_two = THREE_PRIME_PIPELINE(new_three_ch, [], prep_next, single_exon, shard_count, three_previous)
+        five_prime_results_two = FIVE_PRIME_PIPELINE(new_five_ch, [], prep_next, single_exon, shard_count, five_previous)
 
     // Publish outputs
-    PUBLISH_RESULTS(three_prime_results_one, five_prime_results_one, three_prime_results_two, five_prime_results_two)
+    PUBLISH_RESULTS(three_prime_results_one.prepnext_out, five_prime_results_one.prepnext_out,
+                    three_prime_results_two.prepnext_out, five_prime_results_two.prepnext_out)
 }
 
 // New process to handle publishing results
@@ -8,7 +8,7 @@ process CAT_ALL {
     tuple val(id), path("${id}_result.csv")
 
     """
-    cat ${results.join(' ')} > "${id}_result.csv"
+    catTables.py "${id}_result.csv" ${results.join(' ')}
     """
 
 }
\ No newline at end of file
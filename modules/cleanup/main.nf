@@ -7,9 +7,10 @@ process CLEANUP {
     path "${id}_extended_transcripts_${direction}_final.csv", emit:csv
     val(id), emit:id
     path "${id}_extended_transcripts_${direction}_ExtendStats.txt"
-    path "${id}_extended_transcripts_${direction}_ExtendPlot.png"
+    path "${id}_extended_transcripts_${direction}_ExtendStats.json", emit:stats
+    path "${id}_extended_transcripts_${direction}_ExtendPlot.png", optional: true
 
     """
-    finalFilterandStats.py ${result} ${direction} "${id}_extended_transcripts.csv"
+    finalFilterandStats.py ${result} ${direction} "${id}_extended_transcripts.csv" ${params.plot ? '' : '--no-plot'}
     """
 }
\ No newline at end of file
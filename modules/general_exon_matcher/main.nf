@@ -1,14 +1,19 @@
 process GENERAL_EXON_MATCHER{
     publishDir 'outputs/exonMatched', mode: 'copy', overwrite: true
+    // The long read evidence is loaded whole: benchmarkStages.py --scales chr1 (1M reads, 5.8M GTF rows) peaks
+    // at 3.1 GB, so a 10M read genome needs about 31 GB
     memory '40 GB'
     cpus 2
     input:
     tuple val(id), path(human), path(capOrTail), path(fantom), path (longRead)
     val single_exon
     val direction
+    // '--write-index' to also write the terminal block indexes, '--index' when fantom and longRead are such indexes
+    val matcher_args
     output:
-    tuple val(id), path("filtered_matched_human_exons.gff"), path(capOrTail), path("matched_fantom_blocks.gff"), path("matched_longread_blocks.gff") 
+    tuple val(id), path("filtered_matched_human_exons.gff"), path(capOrTail), path("matched_fantom_blocks.gff"), path("matched_longread_blocks.gff"), emit: matched
+    tuple val(id), path("terminal_fantom_blocks.gff"), path("terminal_longread_blocks.gff"), optional: true, emit: index
     """
-    globalExonMatcher.py ${human} ${fantom} ${longRead} ${single_exon} ${direction} .
+    globalExonMatcher.py ${human} ${fantom} ${longRead} ${single_exon} ${direction} . ${matcher_args}
     """
 }
\ No newline at end of file
@@ -1,10 +1,11 @@
+// Filters one human annotation, shared by both directions (see main.nf)
 process HUMAN_FILTER{
     input:
-    tuple val(id), path(human), path(capOrTail), path(fantom), path(longRead)
+    tuple val(id), path(human)
     path readthroughs
     val single_exon
     output:
-    tuple val(id), path('noReadthroughProteinCoding.gff3'), path(capOrTail), path(fantom), path (longRead)
+    tuple val(id), path('noReadthroughProteinCoding.gff3')
     """
     humanFilter.py ${human} 'noReadthroughProteinCoding.gff3' ${readthroughs} ${single_exon}
     """
@@ -1,7 +1,9 @@
 process PROCESS_CHROMOSOMES {
     publishDir 'outputs/processedChrs', mode: 'copy', overwrite: true
     input:
-    tuple path(human), path(capOrTail), path(fantom), path(longRead), val(id), val(chr)
+    // chr is the name of a shard of the shards plan, previous the CAT_ALL table of the same sample in the
+    // previous round whose matches are reused, [] for none
+    tuple path(human), path(capOrTail), path(fantom), path(longRead), val(id), val(chr), path(shards), path(previous)
     val (direction)
     
     output:
@@ -9,6 +11,6 @@ process PROCESS_CHROMOSOMES {
     
 
     """
-    globalTranscriptChecker.py ${human} ${capOrTail} ${fantom} ${longRead} ${direction} ${chr} output  
+    globalTranscriptChecker.py ${human} ${capOrTail} ${fantom} ${longRead} ${direction} ${chr} output --shards ${shards} ${previous ? "--previous ${previous}" : ''}
     """
 }
\ No newline at end of file
@@ -0,0 +1,11 @@
+//Plans size-balanced genomic shards from the contigs and feature density of the matched inputs
+process SHARD_GENOME {
+    input:
+    tuple val(id), path(human), path(capOrTail), path(fantom), path(longRead)
+    val shard_count
+    output:
+    tuple val(id), path('shards.tsv')
+    """
+    shardGenome.py ${human} ${capOrTail} ${fantom} ${longRead} shards.tsv --shards ${shard_count} ${params.contigs ? "--contigs ${params.contigs}" : ''}
+    """
+}
\ No newline at end of file
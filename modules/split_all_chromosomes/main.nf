@@ -0,0 +1,25 @@
+//Splits every input by shard (see SHARD_GENOME) in one pass, returns one tuple of split files per shard
+process SPLIT_ALL_CHROMOSOMES {
+    input:
+    tuple val(id), path(human), path(capOrTail), path(fantom), path(longRead), path(shards)
+    val three
+    output:
+    // A sample with nothing to split (e.g. no matched exons) emits no tuple instead of failing the run
+    tuple val(id), path('split_human_*'), path('split_capOrTail_*'), path('split_fantom_*'), path('split_longRead_*'), path(shards), optional: true
+    """
+    splitChromosomes.py ${shards} ${fantom} ${longRead} ${capOrTail} ${human} ${three}
+    """
+}
+
+// Regroup the single pass outputs into the (human, capOrTail, fantom, longRead, id, shard, shards) tuples
+// PROCESS_CHROMOSOMES expects, keeping only shards that have data in all four inputs
+def splitByChromosome(id, humans, capOrTails, fantoms, longReads, shards) {
+    def byChr = { files, prefix -> [files].flatten().collectEntries { [(it.name - "${prefix}_" - '.txt'): it] } }
+    def human = byChr(humans, 'split_human')
+    def capOrTail = byChr(capOrTails, 'split_capOrTail')
+    def fantom = byChr(fantoms, 'split_fantom')
+    def longRead = byChr(longReads, 'split_longRead')
+    human.keySet()
+        .findAll { capOrTail.containsKey(it) && fantom.containsKey(it) && longRead.containsKey(it) }
+        .collect { chr -> tuple(human[chr], capOrTail[chr], fantom[chr], longRead[chr], id, chr, shards) }
+}
@@ -0,0 +1,12 @@
+// Parses the filtered annotation once and returns the most 5' and most 3' selections, so
+// FIVE_PRIME_PIPELINE and THREE_PRIME_PIPELINE share one START_OR_END_GRAB (see main.nf)
+process START_OR_END_GRAB_BOTH {
+    input:
+    tuple val(id), path(noReadThrough)
+    output:
+    tuple val(id), path("grabbedhg38_fivePrime.gff"), emit: five
+    tuple val(id), path("grabbedhg38_threePrime.gff"), emit: three
+    """
+    startOrEndGrab.py ${noReadThrough} both grabbedhg38.gff
+    """
+}
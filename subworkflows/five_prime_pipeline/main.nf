@@ -1,38 +1,37 @@
-include {HUMAN_FILTER} from '../../modules/human_filter'
-include {START_OR_END_GRAB} from '../../modules/start_or_end_grab'
-include {SPLIT_CHROMOSOMES} from '../../modules/split_chromosomes'
+include {SPLIT_ALL_CHROMOSOMES; splitByChromosome} from '../../modules/split_all_chromosomes'
 include {PROCESS_CHROMOSOMES} from '../../modules/process_chromosomes'
 include {CAT_ALL} from '../../modules/cat_all'
 include {CLEANUP} from '../../modules/cleanup'
 include {GENERAL_EXON_MATCHER} from '../../modules/general_exon_matcher'
+include {SHARD_GENOME} from '../../modules/shard_genome'
 include {PREP_NEXT} from '../../modules/prep_next'
 
-include {HUMAN_FILTER as HUMAN_FILTER_2} from '../../modules/human_filter'
-include {START_OR_END_GRAB as START_OR_END_GRAB_2} from '../../modules/start_or_end_grab'
-include {SPLIT_CHROMOSOMES as SPLIT_CHROMOSOMES_2} from '../../modules/split_chromosomes'
+include {SPLIT_ALL_CHROMOSOMES as SPLIT_ALL_CHROMOSOMES_2} from '../../modules/split_all_chromosomes'
 include {PROCESS_CHROMOSOMES as PROCESS_CHROMOSOMES_2} from '../../modules/process_chromosomes'
 include {CAT_ALL as CAT_ALL_2} from '../../modules/cat_all'
 include {CLEANUP as CLEANUP_2} from '../../modules/cleanup'
 include {PREP_NEXT as PREP_NEXT_2} from '../../modules/prep_next'
 include {GENERAL_EXON_MATCHER as GENERAL_EXON_MATCHER_2} from '../../modules/general_exon_matcher'
+include {SHARD_GENOME as SHARD_GENOME_2} from '../../modules/shard_genome'
 
 workflow FIVE_PRIME_PIPELINE {
     
     take:
     ch_five
+    grabbed    // START_OR_END_GRAB_BOTH selection of ch_five's human annotation for round 1, [] in round 2
     prep_next
     single_exon
-    chromosomes
+    shard_count    // number of genomic shards to aim for, see SHARD_GENOME
+    previous    // (id, CAT_ALL table) of round 1 per round 2 sample id for an incremental round 2, [] otherwise
     main:
-    readThroughs = file("/nfs/production/flicek/ensembl/havana/lucascortes/polyA-DB/data/readthroughList/readthroughList.txt")
     five = "fivePrime"
     if (prep_next){
-        humanOut = HUMAN_FILTER(ch_five, readThroughs, single_exon)
-        fivePrimeOut = START_OR_END_GRAB(humanOut, five).view()
-        generalOut = GENERAL_EXON_MATCHER(fivePrimeOut, single_exon, five)
-        generalChromosomes = generalOut.combine(chromosomes).view()
-        splitChrs = SPLIT_CHROMOSOMES(generalChromosomes, five).view()
-        processChrOut = PROCESS_CHROMOSOMES(splitChrs, five)
+        generalOut = GENERAL_EXON_MATCHER(grabbed, single_exon, five, params.incremental ? '--write-index' : '')
+        shards = SHARD_GENOME(generalOut.matched, shard_count)
+        splitChrs = SPLIT_ALL_CHROMOSOMES(generalOut.matched.join(shards), five)
+        .flatMap { id, humans, capOrTails, fantoms, longReads, shardPlan -> splitByChromosome(id, humans, capOrTails, fantoms, longReads, shardPlan) }
+        .view()
+        processChrOut = PROCESS_CHROMOSOMES(splitChrs.map { it + [[]] }, five)
         .groupTuple(by: 0)  // Group by ID (index 0)
         .map { id, chrs, files -> tuple(id, files.flatten()) }  // Flatten the list of files
         .view()
@@ -41,10 +40,14 @@ workflow FIVE_PRIME_PIPELINE {
         prepnext_out = PREP_NEXT(cleaned.csv, five, ch_five)
         //prepnext_out = PREPNEXT(cleaned.csv, cleaned.id, generalChannel)
     } else {
-        generalOut = GENERAL_EXON_MATCHER_2(ch_five, single_exon,five)
-        generalChromosomes = generalOut.combine(chromosomes).view()
-        splitChrs = SPLIT_CHROMOSOMES_2(generalChromosomes,five).view()
-        processChrOut = PROCESS_CHROMOSOMES_2(splitChrs, five)
+        generalOut = GENERAL_EXON_MATCHER_2(ch_five, single_exon,five, params.incremental ? '--index' : '')
+        shards = SHARD_GENOME_2(generalOut.matched, shard_count)
+        splitChrs = SPLIT_ALL_CHROMOSOMES_2(generalOut.matched.join(shards), five)
+        .flatMap { id, humans, capOrTails, fantoms, longReads, shardPlan -> splitByChromosome(id, humans, capOrTails, fantoms, longReads, shardPlan) }
+        .view()
+        // Every shard of a sample reuses the round 1 matches of that same sample
+        withPrevious = params.incremental ? splitChrs.map { tuple(it[4], it) }.combine(previous, by: 0).map { id, split, table -> split + [table] } : splitChrs.map { it + [[]] }
+        processChrOut = PROCESS_CHROMOSOMES_2(withPrevious, five)
         .groupTuple(by: 0)  // Group by ID (index 0)
         .map { id, chrs, files -> tuple(id, files.flatten()) }  // Flatten the list of files
         .view()
@@ -55,4 +58,6 @@ workflow FIVE_PRIME_PIPELINE {
 
     emit:
     prepnext_out
+    index = generalOut.index    // terminal block indexes, with params.incremental in round 1
+    catted
 }
\ No newline at end of file